@@ -0,0 +1,83 @@
+"""add note search_text column and trigram index
+
+Revision ID: 3f2a9c1d0e01
+Revises:
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d0e01'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 回填时每批处理的笔记数量
+BACKFILL_BATCH_SIZE = 500
+
+
+def build_search_text(markdown_text: str) -> str:
+    """
+    迁移时的搜索文本规则（app.routers.notes.build_search_text 的冻结副本）
+
+    迁移不依赖应用代码，之后修改规则不会改变本迁移的回填结果
+    """
+    text = markdown_text or ""
+    # 图片语法只保留 alt 文本，链接语法只保留链接文本
+    text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', r'\1', text)
+    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
+    return text.lower()
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    is_postgresql = bind.dialect.name == "postgresql"
+
+    op.add_column("notes", sa.Column("search_text", sa.Text(), nullable=True))
+
+    # 回填已有笔记的 search_text（按 id 分批，避免一次性加载全部笔记）
+    notes = sa.table(
+        "notes",
+        sa.column("id", sa.Integer),
+        sa.column("body_md", sa.Text),
+        sa.column("search_text", sa.Text),
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(notes.c.id, notes.c.body_md)
+            .where(notes.c.id > last_id)
+            .order_by(notes.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            notes.update().where(notes.c.id == sa.bindparam("note_id")),
+            [{"note_id": row.id, "search_text": build_search_text(row.body_md)} for row in rows],
+        )
+        last_id = rows[-1].id
+
+    if is_postgresql:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index(
+            "ix_notes_search_text_trgm",
+            "notes",
+            ["search_text"],
+            postgresql_using="gin",
+            postgresql_ops={"search_text": "gin_trgm_ops"},
+        )
+    else:
+        op.create_index("ix_notes_search_text_trgm", "notes", ["search_text"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_notes_search_text_trgm", table_name="notes")
+    op.drop_column("notes", "search_text")
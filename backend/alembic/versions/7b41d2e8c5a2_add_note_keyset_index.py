@@ -0,0 +1,30 @@
+"""add composite index for notes keyset pagination
+
+Revision ID: 7b41d2e8c5a2
+Revises: 3f2a9c1d0e01
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b41d2e8c5a2'
+down_revision: Union[str, None] = '3f2a9c1d0e01'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_notes_user_pinned_created",
+        "notes",
+        ["user_id", "is_pinned", "created_at", "id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_notes_user_pinned_created", table_name="notes")
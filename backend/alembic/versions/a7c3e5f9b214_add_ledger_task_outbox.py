@@ -0,0 +1,47 @@
+"""add ledger_task_outbox table
+
+Revision ID: a7c3e5f9b214
+Revises: e4d8f1a6b902
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e5f9b214'
+down_revision: Union[str, None] = 'e4d8f1a6b902'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ledger_task_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("entry_id", sa.Integer(), sa.ForeignKey("ledger_entries.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("task_id", sa.String(length=255), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+    )
+    # 中继只扫描未投递的记录
+    op.create_index(
+        "ix_ledger_task_outbox_unsent",
+        "ledger_task_outbox",
+        ["id"],
+        postgresql_where=sa.text("sent_at IS NULL"),
+        sqlite_where=sa.text("sent_at IS NULL"),
+    )
+    op.create_index("ix_ledger_task_outbox_sent_at", "ledger_task_outbox", ["sent_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ledger_task_outbox_sent_at", table_name="ledger_task_outbox")
+    op.drop_index("ix_ledger_task_outbox_unsent", table_name="ledger_task_outbox")
+    op.drop_table("ledger_task_outbox")
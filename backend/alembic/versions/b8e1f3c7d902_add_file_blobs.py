@@ -0,0 +1,38 @@
+"""add file_blobs (content-addressed attachment storage) and files.content_hash
+
+Revision ID: b8e1f3c7d902
+Revises: d5b8c2f4a601
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e1f3c7d902'
+down_revision: Union[str, None] = 'd5b8c2f4a601'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "file_blobs",
+        sa.Column("content_hash", sa.String(length=64), primary_key=True),
+        sa.Column("file_path", sa.String(length=512), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    # 已有记录保持为空，删除时仍按独占文件处理
+    op.add_column("files", sa.Column("content_hash", sa.String(length=64), nullable=True))
+    op.create_index("ix_files_content_hash", "files", ["content_hash"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_files_content_hash", table_name="files")
+    op.drop_column("files", "content_hash")
+    op.drop_table("file_blobs")
@@ -0,0 +1,27 @@
+"""add ledger_task_outbox.claimed_until
+
+Revision ID: c3d9e7a1f456
+Revises: b8e1f3c7d902
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d9e7a1f456'
+down_revision: Union[str, None] = 'b8e1f3c7d902'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 中继先认领记录并提交，投递期间不持有行锁和数据库连接
+    op.add_column("ledger_task_outbox", sa.Column("claimed_until", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("ledger_task_outbox", "claimed_until")
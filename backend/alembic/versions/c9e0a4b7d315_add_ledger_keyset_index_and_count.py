@@ -0,0 +1,41 @@
+"""add ledger keyset index and users.ledger_count
+
+Revision ID: c9e0a4b7d315
+Revises: 7b41d2e8c5a2
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9e0a4b7d315'
+down_revision: Union[str, None] = '7b41d2e8c5a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_ledger_entries_user_created",
+        "ledger_entries",
+        ["user_id", "created_at", "id"],
+    )
+    op.add_column(
+        "users",
+        sa.Column("ledger_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    # 回填已有用户的记账条目计数
+    op.execute(
+        "UPDATE users SET ledger_count = ("
+        "SELECT COUNT(*) FROM ledger_entries WHERE ledger_entries.user_id = users.id"
+        ")"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "ledger_count")
+    op.drop_index("ix_ledger_entries_user_created", table_name="ledger_entries")
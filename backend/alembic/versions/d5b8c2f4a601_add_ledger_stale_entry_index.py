@@ -0,0 +1,32 @@
+"""add ledger_entries (status, updated_at) index and redispatch_attempts
+
+Revision ID: d5b8c2f4a601
+Revises: a7c3e5f9b214
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5b8c2f4a601'
+down_revision: Union[str, None] = 'a7c3e5f9b214'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "ledger_entries",
+        sa.Column("redispatch_attempts", sa.Integer(), server_default="0", nullable=False),
+    )
+    # 回收任务按状态查找长时间未更新的条目
+    op.create_index("ix_ledger_entries_status_updated", "ledger_entries", ["status", "updated_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ledger_entries_status_updated", table_name="ledger_entries")
+    op.drop_column("ledger_entries", "redispatch_attempts")
@@ -0,0 +1,69 @@
+"""add ledger_monthly_rollups table
+
+Revision ID: e4d8f1a6b902
+Revises: c9e0a4b7d315
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4d8f1a6b902'
+down_revision: Union[str, None] = 'c9e0a4b7d315'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# 从已有记账条目回填汇总：只统计已完成且金额不为空的条目，
+# 日期取 event_time（为空时取 created_at），分类为空记为 ''，币种为空记为 CNY
+BACKFILL_SQL = """
+INSERT INTO ledger_monthly_rollups (user_id, year, month, category, currency, amount, count, nonzero_count)
+SELECT
+    user_id,
+    {year} AS year,
+    {month} AS month,
+    COALESCE(category, '') AS category,
+    COALESCE(currency, 'CNY') AS currency,
+    SUM(amount) AS amount,
+    COUNT(id) AS count,
+    SUM(CASE WHEN amount != 0 THEN 1 ELSE 0 END) AS nonzero_count
+FROM ledger_entries
+WHERE status = 'completed' AND amount IS NOT NULL
+GROUP BY user_id, {year}, {month}, COALESCE(category, ''), COALESCE(currency, 'CNY')
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ledger_monthly_rollups",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("month", sa.Integer(), nullable=False),
+        sa.Column("category", sa.String(length=64), nullable=False),
+        sa.Column("currency", sa.String(length=16), nullable=False),
+        sa.Column("amount", sa.Float(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("nonzero_count", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("user_id", "year", "month", "category", "currency", name="uq_ledger_monthly_rollups_key"),
+    )
+    op.create_index("ix_ledger_monthly_rollups_id", "ledger_monthly_rollups", ["id"])
+
+    # 从已有记账条目回填汇总
+    entry_date = "COALESCE(event_time, created_at)"
+    if op.get_bind().dialect.name == "postgresql":
+        year = f"CAST(EXTRACT(YEAR FROM {entry_date}) AS INTEGER)"
+        month = f"CAST(EXTRACT(MONTH FROM {entry_date}) AS INTEGER)"
+    else:
+        year = f"CAST(STRFTIME('%Y', {entry_date}) AS INTEGER)"
+        month = f"CAST(STRFTIME('%m', {entry_date}) AS INTEGER)"
+    op.execute(BACKFILL_SQL.format(year=year, month=month))
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ledger_monthly_rollups_id", table_name="ledger_monthly_rollups")
+    op.drop_table("ledger_monthly_rollups")
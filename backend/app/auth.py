@@ -1,4 +1,8 @@
 import datetime as dt
+import json
+import logging
+import time
+from collections import OrderedDict
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
@@ -10,9 +14,19 @@ from sqlalchemy import select
 from .config import settings
 from . import models, schemas
 from .db import get_session
+from .redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# 已认证用户缓存：user_id -> (用户字段, 过期时间)
+# 缓存的是字段快照，每次命中都会构造新的 User 对象，避免请求之间共享可变对象
+# 不缓存 hashed_password（与密码等价，不能明文写入 Redis）和 ledger_count（每次写入都会变化）
+_user_cache: "OrderedDict[int, tuple[dict, float]]" = OrderedDict()
+USER_CACHE_FIELDS = ("id", "email", "user_name", "created_at")
+USER_CACHE_REDIS_PREFIX = "auth:user:"
+
 
 def verify_password(password: str, hashed: str) -> bool:
     """前端已加密，直接比较"""
@@ -29,6 +43,76 @@ def create_access_token(data: dict, expires_minutes: Optional[int] = None) -> st
     return encoded_jwt
 
 
+def _store_local(user_id: int, fields: dict):
+    """写入进程内缓存，超过容量时淘汰最久未使用的用户"""
+    _user_cache[user_id] = (fields, time.monotonic() + settings.auth_user_cache_ttl)
+    _user_cache.move_to_end(user_id)
+    while len(_user_cache) > settings.auth_user_cache_size:
+        _user_cache.popitem(last=False)
+
+
+async def _get_cached_user(user_id: int) -> Optional[models.User]:
+    """从缓存读取用户，未命中或已过期时返回 None"""
+    if settings.auth_user_cache_ttl <= 0:
+        return None
+
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        fields, expires_at = cached
+        if expires_at > time.monotonic():
+            _user_cache.move_to_end(user_id)
+            return models.User(**fields)
+        _user_cache.pop(user_id, None)
+
+    if settings.auth_user_cache_redis:
+        try:
+            raw = await get_async_redis().get(f"{USER_CACHE_REDIS_PREFIX}{user_id}")
+        except Exception as e:
+            logger.warning(f"读取 Redis 用户缓存失败: {str(e)}")
+            return None
+        if raw:
+            fields = {name: value for name, value in json.loads(raw).items() if name in USER_CACHE_FIELDS}
+            if fields.get("created_at"):
+                fields["created_at"] = dt.datetime.fromisoformat(fields["created_at"])
+            _store_local(user_id, fields)
+            return models.User(**fields)
+    return None
+
+
+async def _cache_user(user: models.User):
+    """把用户字段写入缓存"""
+    if settings.auth_user_cache_ttl <= 0:
+        return
+    fields = {name: getattr(user, name) for name in USER_CACHE_FIELDS}
+    _store_local(user.id, fields)
+
+    if settings.auth_user_cache_redis:
+        payload = dict(fields)
+        if payload.get("created_at"):
+            payload["created_at"] = payload["created_at"].isoformat()
+        try:
+            await get_async_redis().set(
+                f"{USER_CACHE_REDIS_PREFIX}{user.id}",
+                json.dumps(payload),
+                ex=settings.auth_user_cache_ttl,
+            )
+        except Exception as e:
+            logger.warning(f"写入 Redis 用户缓存失败: {str(e)}")
+
+
+async def invalidate_user_cache(user_id: int):
+    """
+    使用户缓存失效（修改密码等变更用户信息后调用）
+    其他进程的进程内缓存最多在 auth_user_cache_ttl 秒后过期
+    """
+    _user_cache.pop(user_id, None)
+    if settings.auth_user_cache_redis:
+        try:
+            await get_async_redis().delete(f"{USER_CACHE_REDIS_PREFIX}{user_id}")
+        except Exception as e:
+            logger.warning(f"删除 Redis 用户缓存失败: {str(e)}")
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)
 ) -> models.User:
@@ -45,9 +129,14 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
+    # 先查缓存，命中时不访问数据库
+    cached_user = await _get_cached_user(user_id)
+    if cached_user is not None:
+        return cached_user
+
     result = await session.execute(select(models.User).where(models.User.id == user_id))
     user = result.scalars().first()
     if user is None:
         raise credentials_exception
+    await _cache_user(user)
     return user
-
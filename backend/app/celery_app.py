@@ -1,6 +1,24 @@
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
+from kombu import Queue
 from .config import settings
 
+# 任务队列：ocr（图片识别）、llm（模型调用）、db（写回数据库）、maintenance（定时清理），celery 为默认队列
+CELERY_QUEUES = ("celery", "ocr", "llm", "db", "maintenance")
+
+TASK_ROUTES = {
+    "ocr.extract_text": {"queue": "ocr"},
+    "ledger.analyze_text": {"queue": "llm"},
+    "ledger.wrap_analyze_text": {"queue": "llm"},
+    "ledger.merge_and_analyze": {"queue": "llm"},
+    "ledger.analyze_batch": {"queue": "llm"},
+    # 融合任务默认走 llm 队列，带图片的条目由 build_ledger_pipeline 改投 ocr 队列
+    "ledger.process_entry": {"queue": "llm"},
+    "ledger.update_entry": {"queue": "db"},
+    "ledger.reap_stale_entries": {"queue": "maintenance"},
+    "app.tasks.file_tasks.cleanup_orphan_files": {"queue": "maintenance"},
+}
+
 # 创建 Celery 应用
 celery_app = Celery(
     "xmem_backend",
@@ -16,12 +34,20 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
     task_track_started=True,
+    # 任务默认不写结果后端：记账条目状态以数据库为准，并通过 ledger:events 频道推送，
+    # 不再为每个任务在 Redis 中保存返回值和 STARTED 状态；需要读取返回值的任务单独设置 ignore_result=False
+    task_ignore_result=True,
+    result_expires=settings.celery_result_expires,
     task_time_limit=30 * 60,  # 30 分钟超时
     task_soft_time_limit=25 * 60,  # 25 分钟软超时
     # 自动发现任务
     imports=("app.tasks.ledger_tasks", "app.tasks.test_tasks", "app.tasks.ocr_tasks", "app.tasks.file_tasks"),
-    # 移除 task_routes，所有任务使用默认队列（celery）
-    # 这样 worker 只需要监听默认队列即可
+    # 按负载类型划分队列，OCR（CPU 密集）和 LLM（网络等待）可以分别扩容，
+    # 一批小票图片不会阻塞纯文本记账；未路由的任务仍进入默认队列 celery
+    # 不指定 -Q 的 worker 会消费全部队列（单机部署），run-celery-worker.sh 按类型启动专用 worker
+    task_queues=tuple(Queue(name) for name in CELERY_QUEUES),
+    task_default_queue="celery",
+    task_routes=TASK_ROUTES,
     # 修复弃用警告：设置 broker_connection_retry_on_startup
     broker_connection_retry_on_startup=True,
 )
@@ -33,4 +59,39 @@ celery_app.conf.beat_schedule = {
         "task": "app.tasks.file_tasks.cleanup_orphan_files",
         "schedule": crontab(minute=0),  # 每小时执行一次
     },
-}
\ No newline at end of file
+    "reap-stale-ledger-entries": {
+        "task": "ledger.reap_stale_entries",
+        "schedule": settings.ledger_reaper_interval,  # 默认每 5 分钟执行一次
+    },
+}
+
+
+@worker_init.connect
+def patch_worker_db_driver(**kwargs):
+    """gevent 池中让 psycopg2 访问数据库时让出协程，避免一次 DB 往返阻塞整个 worker"""
+    from .utils.gevent_utils import patch_psycopg2_for_gevent
+    patch_psycopg2_for_gevent()
+
+
+@worker_process_init.connect
+def init_worker_llm_client(**kwargs):
+    """
+    prefork 池的每个子进程预先创建自己的 LLM 客户端（连接池不能跨 fork 共享）
+
+    gevent/solo 池没有子进程，不触发该信号，客户端在第一次调用 get_llm_client 时创建
+    """
+    from .services.llm_client import init_llm_client
+    init_llm_client()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_worker_llm_client(**kwargs):
+    """
+    worker 退出时关闭 LLM 客户端的连接池
+
+    prefork 子进程在 worker_process_shutdown 中关闭；gevent/solo 池的任务在主进程执行，
+    在 worker_shutdown 中关闭
+    """
+    from .services.llm_client import close_llm_clients
+    close_llm_clients()
@@ -8,6 +8,19 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"
     access_token_expire_minutes: int = 60 * 24
     redis_url: str = Field(default="redis://localhost:6379/0", env="REDIS_URL")
+
+    # 数据库连接池配置（API 和 Celery worker 各自按进程生效，需按 PostgreSQL max_connections 规划）
+    db_pool_size: int = Field(default=5, env="DB_POOL_SIZE")  # 常驻连接数
+    db_max_overflow: int = Field(default=10, env="DB_MAX_OVERFLOW")  # 超出 pool_size 后最多额外创建的连接数
+    db_pool_timeout: float = Field(default=30, env="DB_POOL_TIMEOUT")  # 等待空闲连接的秒数
+    db_pool_recycle: int = Field(default=1800, env="DB_POOL_RECYCLE")  # 连接最长复用秒数，-1 表示不回收
+    db_statement_timeout_ms: int = Field(default=0, env="DB_STATEMENT_TIMEOUT_MS")  # PostgreSQL statement_timeout，0 表示不限制
+    db_prepared_statement_cache_size: int = Field(default=100, env="DB_PREPARED_STATEMENT_CACHE_SIZE")  # asyncpg 预编译语句缓存，0 表示禁用（pgbouncer 事务模式需要）
+
+    # 认证用户缓存配置（避免每个请求都查询 users 表）
+    auth_user_cache_ttl: int = Field(default=60, env="AUTH_USER_CACHE_TTL")  # 缓存秒数，0 表示禁用
+    auth_user_cache_size: int = Field(default=10000, env="AUTH_USER_CACHE_SIZE")  # 进程内最多缓存的用户数
+    auth_user_cache_redis: bool = Field(default=False, env="AUTH_USER_CACHE_REDIS")  # 是否使用 Redis 在多个进程间共享缓存
     
     # OCR 配置
     ocr_provider: str = Field(default="local", env="OCR_PROVIDER")  # "local" 或 "remote"
@@ -18,11 +31,62 @@ class Settings(BaseSettings):
     ocr_api_key: str = Field(default="", env="OCR_API_KEY")  # 远程 OCR API 密钥
 
     # LLM 配置
-    llm_provider: str = Field(default="", env="LLM_PROVIDER")  # "local" 或 "remote"
+    llm_provider: str = Field(default="", env="LLM_PROVIDER")  # "deepseek"、"openai"（OpenAI 兼容接口）或 "mock"，空表示不使用 LLM
+    llm_model: str = Field(default="", env="LLM_MODEL")  # 模型名，空则使用提供商默认模型
+    llm_max_concurrency: int = Field(default=8, env="LLM_MAX_CONCURRENCY")  # 每个进程同时进行的 LLM 请求数上限
+    llm_mock_latency: float = Field(default=0.0, env="LLM_MOCK_LATENCY")  # mock 提供商模拟的模型耗时（秒）
 
     # 远程 LLM API 配置
     llm_api_url: str = Field(default="", env="LLM_API_URL")  # 远程 LLM API 地址
     llm_api_key: str = Field(default="", env="LLM_API_KEY")  # 远程 LLM API 密钥
+    llm_timeout: float = Field(default=60, env="LLM_TIMEOUT")  # 单次请求超时秒数
+    llm_connect_timeout: float = Field(default=10, env="LLM_CONNECT_TIMEOUT")  # 建立连接超时秒数
+    llm_max_retries: int = Field(default=2, env="LLM_MAX_RETRIES")  # 连接错误、429 和 5xx 的重试次数
+    llm_max_connections: int = Field(default=20, env="LLM_MAX_CONNECTIONS")  # 每个进程的最大连接数
+    llm_max_keepalive_connections: int = Field(default=10, env="LLM_MAX_KEEPALIVE_CONNECTIONS")  # 保持的空闲长连接数
+    llm_keepalive_expiry: float = Field(default=60, env="LLM_KEEPALIVE_EXPIRY")  # 空闲长连接保留秒数
+
+    # Celery 结果保留秒数（只有需要读取返回值的任务才写入结果后端）
+    celery_result_expires: int = Field(default=3600, env="CELERY_RESULT_EXPIRES")
+
+    # 账本条目处理方式："fused" 单个任务完成 OCR/分析/更新，"chain" 使用三段任务链
+    ledger_pipeline: str = Field(default="fused", env="LEDGER_PIPELINE")
+
+    # 任务发件箱（outbox）：条目与待投递任务在同一事务中写入，由 API 进程内的中继批量投递
+    ledger_outbox_relay_enabled: bool = Field(default=True, env="LEDGER_OUTBOX_RELAY_ENABLED")
+    ledger_outbox_batch_size: int = Field(default=200, env="LEDGER_OUTBOX_BATCH_SIZE")  # 每批最多投递的任务数（批量导入的任务按 task_id 整组投递）
+    ledger_outbox_poll_interval: float = Field(default=1.0, env="LEDGER_OUTBOX_POLL_INTERVAL")  # 没有新条目通知时的轮询秒数
+    ledger_outbox_max_attempts: int = Field(default=10, env="LEDGER_OUTBOX_MAX_ATTEMPTS")  # 超过后把条目标记为 failed
+    ledger_outbox_claim_timeout: int = Field(default=60, env="LEDGER_OUTBOX_CLAIM_TIMEOUT")  # 认领后未完成投递的记录超过该秒数可被重新认领
+    ledger_outbox_retention_hours: int = Field(default=24, env="LEDGER_OUTBOX_RETENTION_HOURS")  # 已投递记录保留小时数
+
+    # 卡住条目回收（定时任务）：长时间停留在 pending/processing 的条目重新投递或标记失败
+    ledger_stale_after_minutes: int = Field(default=35, env="LEDGER_STALE_AFTER_MINUTES")  # 超过任务硬超时（30 分钟）仍未完成视为卡住
+    ledger_max_redispatch: int = Field(default=2, env="LEDGER_MAX_REDISPATCH")  # 最多重新投递次数，超过后标记为 failed
+    ledger_reaper_batch_size: int = Field(default=500, env="LEDGER_REAPER_BATCH_SIZE")  # 每次最多处理的条目数
+    ledger_reaper_interval: int = Field(default=300, env="LEDGER_REAPER_INTERVAL")  # 执行间隔秒数
+
+    # 规则解析快速路径（结构简单的输入不调用 LLM）
+    ledger_fast_path_enabled: bool = Field(default=True, env="LEDGER_FAST_PATH_ENABLED")
+    ledger_fast_path_min_confidence: float = Field(default=0.8, env="LEDGER_FAST_PATH_MIN_CONFIDENCE")  # 低于该置信度时调用 LLM
+    ledger_timezone: str = Field(default="Asia/Shanghai", env="LEDGER_TIMEZONE")  # 规则解析时"今天"、"19:30"等按该时区的本地时间理解，再转换为 UTC
+
+    # LLM 解析结果缓存（Redis）
+    llm_cache_ttl: int = Field(default=30 * 24 * 3600, env="LLM_CACHE_TTL")  # 缓存秒数，0 表示禁用
+    llm_cache_max_entries: int = Field(default=50000, env="LLM_CACHE_MAX_ENTRIES")  # 最多缓存条目数，超出时淘汰最早写入的条目
+
+    # 批量 LLM 分析配置（一次模型调用解析多条记账文本）
+    ledger_batch_size: int = Field(default=20, env="LEDGER_BATCH_SIZE")  # 每批最多条目数
+    ledger_batch_max_chars: int = Field(default=6000, env="LEDGER_BATCH_MAX_CHARS")  # 每批文本总字符数上限
+
+    # 账单批量导入（POST /ledger/import）
+    ledger_import_batch_size: int = Field(default=1000, env="LEDGER_IMPORT_BATCH_SIZE")  # 每次 INSERT/提交的行数
+    ledger_import_task_size: int = Field(default=100, env="LEDGER_IMPORT_TASK_SIZE")  # 每个 ledger.analyze_batch 任务的条目数
+    ledger_import_max_rows: int = Field(default=100000, env="LEDGER_IMPORT_MAX_ROWS")  # 单个文件最多导入行数
+
+    # 记账导出（GET /ledger/export）每次从服务端游标读取的条目数
+    ledger_export_chunk_size: int = Field(default=1000, env="LEDGER_EXPORT_CHUNK_SIZE")
+
     class Config:
         env_file = ".env"
 
@@ -1,9 +1,127 @@
+import threading
+import time
+
+from sqlalchemy import create_engine, event  # pyright: ignore[reportMissingImports]
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # pyright: ignore[reportMissingImports]
 from sqlalchemy.orm import declarative_base  # pyright: ignore[reportMissingImports]
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool  # pyright: ignore[reportMissingImports]
 
 from .config import settings
 
-engine = create_async_engine(settings.database_url, echo=False, future=True)
+
+class PoolMetrics:
+    """连接池指标：借出/归还次数、等待空闲连接的耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+
+    def record_checkin(self):
+        with self._lock:
+            self.checkins += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "wait_avg_ms": (self.wait_total / self.wait_count * 1000) if self.wait_count else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+            }
+
+
+# 按引擎名称记录的连接池指标（"api"、"worker"）
+pool_metrics: dict[str, PoolMetrics] = {}
+
+
+def _timed_pool_class(base: type, name: str) -> type:
+    """创建记录获取连接耗时的连接池子类（pool.recreate() 会沿用该类，指标不会丢失）"""
+    metrics = pool_metrics.setdefault(name, PoolMetrics())
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return base._do_get(self)
+        finally:
+            metrics.record_wait(time.perf_counter() - started)
+
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get})
+
+
+def _engine_options(url: str, pool_base: type, name: str) -> dict:
+    """根据配置生成 create_engine / create_async_engine 的连接池与连接参数"""
+    options = {"pool_pre_ping": True}
+    if url.startswith("postgresql"):
+        options.update(
+            poolclass=_timed_pool_class(pool_base, name),
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+        )
+        connect_args: dict = {}
+        if "+asyncpg" in url:
+            connect_args["prepared_statement_cache_size"] = settings.db_prepared_statement_cache_size
+            if settings.db_statement_timeout_ms > 0:
+                connect_args["server_settings"] = {"statement_timeout": str(settings.db_statement_timeout_ms)}
+        elif settings.db_statement_timeout_ms > 0:
+            connect_args["options"] = f"-c statement_timeout={settings.db_statement_timeout_ms}"
+        options["connect_args"] = connect_args
+    return options
+
+
+def _instrument_pool_events(sync_engine, name: str):
+    """统计连接借出/归还次数"""
+    metrics = pool_metrics.setdefault(name, PoolMetrics())
+    event.listen(sync_engine, "checkout", lambda *args: metrics.record_checkout())
+    event.listen(sync_engine, "checkin", lambda *args: metrics.record_checkin())
+
+
+def create_sync_engine(name: str = "worker"):
+    """创建同步数据库引擎（Celery 任务使用），与 API 使用同一组连接池配置"""
+    sync_db_url = settings.database_url.replace("+asyncpg", "+psycopg2")
+    sync_engine = create_engine(sync_db_url, **_engine_options(sync_db_url, QueuePool, name))
+    _instrument_pool_events(sync_engine, name)
+    return sync_engine
+
+
+def get_pool_stats(target_engine, name: str) -> dict:
+    """返回连接池当前状态和累计指标（借出/溢出等字段只有 QueuePool 提供，其他连接池只返回类型和累计指标）"""
+    pool = target_engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=settings.db_max_overflow,
+        )
+    stats.update(pool_metrics.get(name, PoolMetrics()).snapshot())
+    return stats
+
+
+engine = create_async_engine(
+    settings.database_url,
+    echo=False,
+    future=True,
+    **_engine_options(settings.database_url, AsyncAdaptedQueuePool, "api"),
+)
+_instrument_pool_events(engine.sync_engine, "api")
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 Base = declarative_base()
 
@@ -11,4 +129,3 @@ Base = declarative_base()
 async def get_session() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         yield session
-
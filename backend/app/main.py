@@ -1,9 +1,13 @@
 from fastapi import FastAPI, Depends
 import logging
 
-from .db import engine, Base
+from .db import engine, Base, get_pool_stats
 from .routers import auth, notes, ledger, todos
 from .auth import get_current_user
+from .redis_client import get_async_redis
+from .services.llm_cache import get_llm_cache_stats
+from .services.ledger_outbox import outbox_relay
+from .config import settings
 
 # 配置日志
 logging.basicConfig(
@@ -24,6 +28,13 @@ async def on_startup():
             await conn.run_sync(Base.metadata.create_all)
     except Exception as e:
         print(f"Error creating tables: {e}")
+    if settings.ledger_outbox_relay_enabled:
+        outbox_relay.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await outbox_relay.stop()
 
 
 
@@ -32,6 +43,17 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/health/db")
+async def health_db():
+    """数据库连接池状态（借出连接数、溢出连接数、获取连接等待耗时）"""
+    return {"status": "ok", "pool": get_pool_stats(engine.sync_engine, "api")}
+
+
+@app.get("/health/llm-cache")
+async def health_llm_cache():
+    """LLM 解析结果缓存的命中/未命中计数"""
+    return {"status": "ok", "cache": await get_llm_cache_stats(get_async_redis())}
+
 
 app.include_router(auth.router)
 
@@ -1,5 +1,5 @@
 import datetime as dt
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String, Text, JSON
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String, Text, JSON, Index, DDL, UniqueConstraint, event, text
 from sqlalchemy.orm import relationship
 
 from .db import Base
@@ -17,6 +17,7 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     user_name = Column(String(64), nullable=True)
     hashed_password = Column(String(255), nullable=False)
+    ledger_count = Column(Integer, default=0, server_default="0", nullable=False)  # 记账条目数（新增/删除时维护，避免 COUNT(*)）
     created_at = Column(DateTime, default=utc_now)
 
     notes = relationship("Note", back_populates="owner", cascade="all, delete-orphan")
@@ -30,6 +31,7 @@ class Note(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     body_md = Column(Text, nullable=False)  # Markdown 格式内容
+    search_text = Column(Text, nullable=True)  # 去除图片/链接语法后的小写纯文本，用于搜索
     is_pinned = Column(Boolean, default=False, nullable=False)  # 是否置顶
     created_at = Column(DateTime, default=utc_now)
     updated_at = Column(DateTime, default=utc_now, onupdate=utc_now) 
@@ -37,6 +39,26 @@ class Note(Base):
     owner = relationship("User", back_populates="notes")
     managed_files = relationship("File", back_populates="note", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # 列表按 (is_pinned, created_at, id) 倒序做游标分页
+        Index("ix_notes_user_pinned_created", "user_id", "is_pinned", "created_at", "id"),
+        # PostgreSQL 使用 pg_trgm 的 GIN 索引加速 LIKE '%关键词%'，其他数据库退化为普通索引
+        Index(
+            "ix_notes_search_text_trgm",
+            "search_text",
+            postgresql_using="gin",
+            postgresql_ops={"search_text": "gin_trgm_ops"},
+        ),
+    )
+
+
+# 建表前确保 pg_trgm 扩展存在（仅 PostgreSQL）
+event.listen(
+    Note.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 
 class File(Base):
     __tablename__ = "files"
@@ -47,12 +69,24 @@ class File(Base):
     file_path = Column(String(512), nullable=False)  # 物理路径
     url_path = Column(String(512), nullable=False)   # Web访问路径 (用于匹配)
     file_type = Column(String(16), nullable=False)   # 'image' or 'file'
+    content_hash = Column(String(64), nullable=True, index=True)  # 内容 SHA-256（指向 file_blobs；旧记录为空，独占物理文件）
     created_at = Column(DateTime, default=utc_now)
 
     owner = relationship("User", backref="uploaded_files")
     note = relationship("Note", back_populates="managed_files")
 
 
+class FileBlob(Base):
+    """按内容寻址存储的物理文件，相同内容的上传共用一个 blob，ref_count 为引用它的 File 记录数"""
+    __tablename__ = "file_blobs"
+
+    content_hash = Column(String(64), primary_key=True)  # SHA-256 十六进制
+    file_path = Column(String(512), nullable=False)      # 物理路径
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, server_default="0", nullable=False)
+    created_at = Column(DateTime, default=utc_now)
+
+
 class LedgerEntry(Base):
     __tablename__ = "ledger_entries"
 
@@ -67,11 +101,66 @@ class LedgerEntry(Base):
     meta = Column(JSON, nullable=True)
     status = Column(String(16), default="pending", nullable=False)  # pending, processing, completed, failed
     task_id = Column(String(255), nullable=True)  # Celery 任务 ID
+    redispatch_attempts = Column(Integer, default=0, server_default="0", nullable=False)  # 被回收任务重新投递的次数
     created_at = Column(DateTime, default=utc_now)
     updated_at = Column(DateTime, default=utc_now, onupdate=utc_now)
 
     owner = relationship("User", back_populates="ledgers")
 
+    __table_args__ = (
+        # 列表按 (created_at, id) 倒序做游标分页
+        Index("ix_ledger_entries_user_created", "user_id", "created_at", "id"),
+        # 回收任务按状态查找长时间未更新的条目
+        Index("ix_ledger_entries_status_updated", "status", "updated_at"),
+    )
+
+
+class LedgerTaskOutbox(Base):
+    """记账任务发件箱：与条目在同一事务中写入，由中继投递到 Celery 后标记 sent_at"""
+    __tablename__ = "ledger_task_outbox"
+
+    id = Column(Integer, primary_key=True)
+    entry_id = Column(Integer, ForeignKey("ledger_entries.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(String(255), nullable=False)  # 与 LedgerEntry.task_id 相同
+    payload = Column(JSON, nullable=False)  # raw_text / image_path / original_text
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)
+    last_error = Column(Text, nullable=True)
+    claimed_until = Column(DateTime, nullable=True)  # 中继认领后正在投递，到期前其他中继不会再次认领
+    created_at = Column(DateTime, default=utc_now)
+    sent_at = Column(DateTime, nullable=True)  # 为空表示尚未投递
+
+    entry = relationship("LedgerEntry")
+
+    __table_args__ = (
+        # 中继只扫描未投递的记录
+        Index(
+            "ix_ledger_task_outbox_unsent",
+            "id",
+            postgresql_where=text("sent_at IS NULL"),
+            sqlite_where=text("sent_at IS NULL"),
+        ),
+        Index("ix_ledger_task_outbox_sent_at", "sent_at"),
+    )
+
+
+class LedgerMonthlyRollup(Base):
+    """记账月度汇总：每个 (用户, 年, 月, 分类, 货币) 一行，随已完成条目的变化增量维护"""
+    __tablename__ = "ledger_monthly_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    category = Column(String(64), nullable=False, default="")  # 无分类时为空字符串
+    currency = Column(String(16), nullable=False, default="CNY")
+    amount = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+    nonzero_count = Column(Integer, nullable=False, default=0)  # 金额不为 0 的条数（用于分类统计）
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "year", "month", "category", "currency", name="uq_ledger_monthly_rollups_key"),
+    )
+
 
 class Todo(Base):
     __tablename__ = "todos"
@@ -0,0 +1,25 @@
+"""
+共享的 Redis 客户端（与 Celery broker/backend 使用同一个 REDIS_URL）
+"""
+from .config import settings
+
+_redis_client = None
+_sync_redis_client = None
+
+
+def get_async_redis():
+    """延迟创建进程内共享的 redis.asyncio 客户端"""
+    global _redis_client
+    if _redis_client is None:
+        import redis.asyncio as redis_asyncio
+        _redis_client = redis_asyncio.from_url(settings.redis_url)
+    return _redis_client
+
+
+def get_sync_redis():
+    """延迟创建进程内共享的同步 Redis 客户端（Celery 任务和后台线程使用）"""
+    global _sync_redis_client
+    if _sync_redis_client is None:
+        import redis
+        _sync_redis_client = redis.Redis.from_url(settings.redis_url, socket_connect_timeout=2, socket_timeout=2)
+    return _sync_redis_client
@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 
 from .. import models, schemas
-from ..auth import create_access_token, verify_password, get_current_user
+from ..auth import create_access_token, verify_password, get_current_user, invalidate_user_cache
 from ..db import get_session
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -57,12 +57,20 @@ async def change_password(
     current_user: models.User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session)
 ):
-    # 验证旧密码
-    if not verify_password(payload.old_password, current_user.hashed_password):
+    # 验证旧密码（current_user 来自缓存时不含 hashed_password，只依赖下面的条件更新）
+    if current_user.hashed_password is not None and not verify_password(payload.old_password, current_user.hashed_password):
         raise HTTPException(status_code=400, detail="原密码错误")
     
     # 更新密码（前端已加密）
-    current_user.hashed_password = payload.new_password
+    # 以数据库中的原密码为条件更新，原密码错误时不会更新任何行
+    result = await session.execute(
+        update(models.User)
+        .where(models.User.id == current_user.id, models.User.hashed_password == payload.old_password)
+        .values(hashed_password=payload.new_password)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=400, detail="原密码错误")
     await session.commit()
+    await invalidate_user_cache(current_user.id)
     return {"message": "密码修改成功"}
 
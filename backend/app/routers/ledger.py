@@ -1,20 +1,26 @@
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Query, UploadFile, File
+from fastapi.responses import StreamingResponse
 from typing import Optional
+import codecs
 import json
 import logging
+import uuid
 import datetime as dt
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, extract
-from celery import chain
+from sqlalchemy import select, func, extract, update, tuple_
 
 from .. import models, schemas
 from ..db import get_session
 from ..auth import get_current_user
-from ..tasks.ocr_tasks import extract_text_from_image_task
-from ..tasks.ledger_tasks import analyze_ledger_text, wrap_analyze_text_with_entry_id, merge_text_and_analyze, update_ledger_entry
 from ..utils.file_utils import save_uploaded_img
 from ..utils.exchange_rate import get_exchange_rate_to_cny, convert_to_cny
+from ..utils.pagination import encode_cursor, decode_cursor
+from ..services.ledger_rollup import rollup_contribution, apply_rollup_delta
+from ..services.ledger_events import ledger_event_stream
+from ..services.ledger_outbox import add_outbox_task, outbox_relay
+from ..services.ledger_import import LedgerImportError, detect_import_format, import_ledger_file
+from ..services.ledger_export import EXPORT_FORMATS, build_export_query, ledger_export_stream
 from ..constants import LEDGER_CATEGORIES
 
 logger = logging.getLogger(__name__)
@@ -25,6 +31,17 @@ router = APIRouter(prefix="/ledger", tags=["ledger"])
 UPLOAD_DIR = Path("uploads")
 IMAGE_DIR = UPLOAD_DIR / "images"
 IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+# 图片大小限制：20MB
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+
+async def adjust_ledger_count(session: AsyncSession, user_id: int, delta: int):
+    """在当前事务中调整用户的记账条目计数（users.ledger_count）"""
+    await session.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(ledger_count=models.User.ledger_count + delta)
+    )
+
 
 #用于获取当前用户的所有记账条目（支持分页）
 @router.get("", response_model=schemas.LedgerListResponse)
@@ -32,6 +49,8 @@ async def list_ledgers(
     page: int = Query(1, ge=1, description="页码，从1开始"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
     category: Optional[str] = Query(None, description="分类筛选"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，提供时忽略 page"),
+    include_total: bool = Query(True, description="是否返回总数和总页数"),
     session: AsyncSession = Depends(get_session), 
     current_user: models.User = Depends(get_current_user)
 ):
@@ -42,11 +61,13 @@ async def list_ledgers(
         page: 页码，从1开始
         page_size: 每页数量，最大100
         category: 可选的分类筛选参数
+        cursor: 游标分页，按 (created_at, id) 定位，不使用 OFFSET
+        include_total: 为 false 时跳过总数统计
     """
     try:
         from ..constants import LEDGER_CATEGORIES
         
-        logger.info(f"获取记账列表，user_id: {current_user.id}, page: {page}, page_size: {page_size}, category: {category}")
+        logger.info(f"获取记账列表，user_id: {current_user.id}, page: {page}, page_size: {page_size}, category: {category}, cursor: {bool(cursor)}")
         
         # 构建查询
         query = select(models.LedgerEntry).where(models.LedgerEntry.user_id == current_user.id)
@@ -60,31 +81,56 @@ async def list_ledgers(
                 )
             query = query.where(models.LedgerEntry.category == category)
         
-        # 计算总数（使用原始查询，不包含 order_by, offset, limit）
-        count_query = select(func.count(models.LedgerEntry.id)).where(models.LedgerEntry.user_id == current_user.id)
-        if category is not None:
-            count_query = count_query.where(models.LedgerEntry.category == category)
-        total_result = await session.execute(count_query)
-        total = total_result.scalar() or 0
-        logger.info(f"查询到总数: {total}")
+        # 计算总数：无筛选时直接读取用户上的计数器，有筛选时才执行 COUNT
+        total = None
+        if include_total:
+            if category is None:
+                count_query = select(models.User.ledger_count).where(models.User.id == current_user.id)
+            else:
+                count_query = select(func.count(models.LedgerEntry.id)).where(
+                    models.LedgerEntry.user_id == current_user.id,
+                    models.LedgerEntry.category == category,
+                )
+            total_result = await session.execute(count_query)
+            total = max(total_result.scalar() or 0, 0)
+            logger.info(f"查询到总数: {total}")
         
-        # 分页查询
-        offset = (page - 1) * page_size
-        query = query.order_by(models.LedgerEntry.created_at.desc()).offset(offset).limit(page_size)
+        # 分页查询：有游标时按 (created_at, id) 定位，否则使用 OFFSET
+        if cursor:
+            values = decode_cursor(cursor, datetime_keys=("created_at",))
+            try:
+                query = query.where(
+                    tuple_(models.LedgerEntry.created_at, models.LedgerEntry.id)
+                    < tuple_(values["created_at"], int(values["id"]))
+                )
+            except (KeyError, TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="无效的分页游标")
+        else:
+            query = query.offset((page - 1) * page_size)
+        # 多取一条用于判断是否还有下一页
+        query = query.order_by(models.LedgerEntry.created_at.desc(), models.LedgerEntry.id.desc()).limit(page_size + 1)
         
         result = await session.execute(query)
-        items = result.scalars().all()
+        items = list(result.scalars().all())
+        
+        next_cursor = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            next_cursor = encode_cursor({"created_at": items[-1].created_at, "id": items[-1].id})
         logger.info(f"查询到 {len(items)} 条记录")
         
         # 计算总页数
-        total_pages = (total + page_size - 1) // page_size if total > 0 else 0
+        total_pages = None
+        if total is not None:
+            total_pages = (total + page_size - 1) // page_size if total > 0 else 0
         
         return schemas.LedgerListResponse(
             items=items,
             total=total,
             page=page,
             page_size=page_size,
-            total_pages=total_pages
+            total_pages=total_pages,
+            next_cursor=next_cursor,
         )
     except HTTPException:
         raise
@@ -96,7 +142,6 @@ async def list_ledgers(
 @router.post("", response_model=schemas.LedgerOut)
 async def create_ledger(
     request: Request,
-    background_tasks: BackgroundTasks,
     session: AsyncSession = Depends(get_session),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -137,7 +182,7 @@ async def create_ledger(
                 image_file = form["image"]
                 if hasattr(image_file, "file"):  # UploadFile 对象
                     # 使用通用函数保存图片文件
-                    image_path = await save_uploaded_img(image_file, IMAGE_DIR)
+                    image_path = await save_uploaded_img(image_file, IMAGE_DIR, max_size=MAX_IMAGE_SIZE)
                     logger.info(f"图片已保存: {image_path}")
             # 检查是否有文本字段
             if "text" in form:
@@ -160,98 +205,66 @@ async def create_ledger(
     # 保存原始的 raw_text（如果存在，用于后续合并）
     original_text = raw_text if raw_text else None
     
+    # 预先生成 Celery 任务 ID，与条目、发件箱记录在同一事务中写入
+    task_id = str(uuid.uuid4())
+
     # 创建账本条目（初始状态为 pending）
     logger.info(f"创建账本条目，user_id: {current_user.id}, has_text: {bool(raw_text)}, has_image: {bool(image_path)}")
     entry = models.LedgerEntry(
         user_id=current_user.id,
         raw_text=raw_text or "",  # 如果没有文本，先设为空字符串
         status="pending",
+        task_id=task_id,
     )
     session.add(entry)
+    add_outbox_task(session, entry, raw_text, image_path, original_text)
+    await adjust_ledger_count(session, current_user.id, 1)
     await session.commit()
     await session.refresh(entry)
-    logger.info(f"账本条目已创建，entry_id: {entry.id}, status: {entry.status}")
-    
-    # 立即返回 pending 状态的 entry，让前端可以立即显示
-    entry_id = entry.id
-    
-    # 保存变量到局部作用域，避免闭包问题
-    task_image_path = image_path
-    task_raw_text = raw_text
-    task_original_text = original_text
-    
-    def start_celery_task():
-        """后台任务：启动 Celery 任务链并更新状态"""
-        try:
-            logger.info(f"[后台任务] 开始启动 Celery 任务链，entry_id: {entry_id}, has_image: {bool(task_image_path)}")
-            
-            # 构建任务链
-            if task_image_path:
-                # 有图片：OCR -> 合并文本并分析 -> 更新数据库
-                logger.info(f"[后台任务] 构建 OCR 任务链，image_path: {task_image_path}")
-                task_chain = chain(
-                    extract_text_from_image_task.s(task_image_path),
-                    merge_text_and_analyze.s(task_original_text, entry_id),
-                    update_ledger_entry.s()
-                )
-            else:
-                # 只有文本：直接 LLM -> 更新数据库
-                logger.info(f"[后台任务] 构建文本分析任务链，text: {task_raw_text[:50] if task_raw_text else 'None'}...")
-                task_chain = chain(
-                    wrap_analyze_text_with_entry_id.s(task_raw_text, entry_id),
-                    update_ledger_entry.s()
-                )
-            
-            # 启动任务链（在后台线程中执行，不会阻塞主请求）
-            celery_result = task_chain.apply_async()
-            logger.info(f"[后台任务] Celery 任务链已启动，task_id: {celery_result.id}, entry_id: {entry_id}")
-            
-            # 在后台线程中更新数据库状态（使用同步数据库连接）
-            from ..tasks.ledger_tasks import SyncSessionLocal
-            from sqlalchemy.orm import Session
-            sync_session: Session = SyncSessionLocal()
-            try:
-                entry_to_update = sync_session.query(models.LedgerEntry).filter(models.LedgerEntry.id == entry_id).first()
-                if entry_to_update:
-                    entry_to_update.task_id = celery_result.id
-                    entry_to_update.status = "processing"
-                    sync_session.commit()
-                    logger.info(f"[后台任务] 已更新 entry {entry_id} 状态为 processing，task_id: {celery_result.id}")
-                else:
-                    logger.error(f"[后台任务] 无法找到 entry_id: {entry_id}")
-            finally:
-                sync_session.close()
-                
-        except Exception as e:
-            logger.error(f"[后台任务] 启动 Celery 任务链失败，entry_id: {entry_id}, 错误: {str(e)}", exc_info=True)
-            # 尝试更新状态为失败
-            try:
-                from ..tasks.ledger_tasks import SyncSessionLocal
-                sync_session = SyncSessionLocal()
-                try:
-                    entry_error = sync_session.query(models.LedgerEntry).filter(models.LedgerEntry.id == entry_id).first()
-                    if entry_error:
-                        entry_error.status = "failed"
-                        sync_session.commit()
-                        logger.info(f"[后台任务] 已将 entry {entry_id} 状态更新为 failed")
-                finally:
-                    sync_session.close()
-            except Exception as update_error:
-                logger.error(f"[后台任务] 更新失败状态时出错: {str(update_error)}", exc_info=True)
-    
-    # 使用 FastAPI 的 BackgroundTasks 添加后台任务
-    # BackgroundTasks 会在响应返回后执行，不会阻塞主请求
-    background_tasks.add_task(start_celery_task)
-    logger.info(f"已添加后台任务，entry_id: {entry_id}，将在响应返回后执行")
-    
+    logger.info(f"账本条目已创建，entry_id: {entry.id}, task_id: {task_id}")
+
+    # 由发件箱中继批量投递；请求中不直接访问 broker，投递失败或进程退出后中继会重试
+    outbox_relay.notify()
+
     return entry
 
 
+@router.post("/import", response_model=schemas.LedgerImportResponse)
+async def import_ledgers(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="csv 或 ofx，默认根据文件扩展名判断"),
+    encoding: str = Query("utf-8-sig", description="文件编码，例如 gbk"),
+    session: AsyncSession = Depends(get_session),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    批量导入账单（CSV / OFX）
+
+    逐行解析上传文件，每批一次多行 INSERT 和一次提交；
+    带金额和有效分类的行直接完成，其余行投递批量分析任务，条目状态通过 /ledger/events 推送
+    """
+    try:
+        fmt = detect_import_format(file.filename, format)
+        codecs.lookup(encoding)
+    except LookupError:
+        raise HTTPException(status_code=400, detail=f"不支持的文件编码: {encoding}")
+    except LedgerImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        stats = await import_ledger_file(session, current_user.id, file.file, fmt, encoding)
+    except LedgerImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return stats
+
+
 @router.get("/summary")
 async def summary(
     session: AsyncSession = Depends(get_session), current_user: models.User = Depends(get_current_user)
 ):
     """获取账本摘要（必须在 /{ledger_id} 之前定义，避免路由冲突）"""
+    # total_amount 保持原有语义：所有状态的条目金额直接相加（不换算币种），
+    # 与只包含已完成条目的月度汇总不同，因此不读取 ledger_monthly_rollups
     total_amount = await session.execute(
         select(func.coalesce(func.sum(models.LedgerEntry.amount), 0)).where(
             models.LedgerEntry.user_id == current_user.id
@@ -267,27 +280,26 @@ async def summary(
     return {"total_amount": total, "recent": recent.scalars().all()}
 
 
-@router.get("/statistics", response_model=schemas.LedgerStatisticsResponse)
-async def get_ledger_statistics(
-    session: AsyncSession = Depends(get_session),
-    current_user: models.User = Depends(get_current_user),
-):
-    """获取记账统计数据（必须在 /{ledger_id} 之前定义，避免路由冲突）"""
-    from ..constants import LEDGER_CATEGORIES
-    
-    now = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+async def load_ledger_rollups(session: AsyncSession, user_id: int) -> list:
+    """
+    读取用户的记账月度汇总行（ledger_monthly_rollups）
     
-    # 获取所有已完成的记账条目
-    query = select(models.LedgerEntry).where(
-        models.LedgerEntry.user_id == current_user.id,
-        models.LedgerEntry.status == "completed",
-        models.LedgerEntry.amount.isnot(None)
+    Returns:
+        汇总行，包含 year, month, currency, category, amount, count, nonzero_count
+    """
+    result = await session.execute(
+        select(models.LedgerMonthlyRollup).where(
+            models.LedgerMonthlyRollup.user_id == user_id,
+            models.LedgerMonthlyRollup.count > 0,
+        )
     )
-    result = await session.execute(query)
-    entries = result.scalars().all()
-    
-    # 获取所有需要的汇率（批量获取，减少API调用）
-    currencies_needed = set(entry.currency for entry in entries if entry.currency)
+    return result.scalars().all()
+
+
+async def build_ledger_statistics(groups: list, now: dt.datetime) -> schemas.LedgerStatisticsResponse:
+    """根据 (年, 月, 货币, 分类) 汇总行计算统计数据，金额统一转换为人民币"""
+    # 获取所有需要的汇率（每种货币只获取一次）
+    currencies_needed = set(group.currency for group in groups if group.currency)
     exchange_rates: dict[str, float] = {}
     for currency in currencies_needed:
         try:
@@ -296,84 +308,45 @@ async def get_ledger_statistics(
             logger.warning(f"获取 {currency} 汇率失败: {str(e)}，使用默认值")
             exchange_rates[currency] = await get_exchange_rate_to_cny(currency)  # 会使用默认值
     
+    # 按月份和分类累加（转换为人民币）
+    month_totals: dict[tuple[int, int], dict] = {}
+    category_stats_dict: dict[str, dict] = {}
+    total_amount = 0.0
+    for group in groups:
+        currency = group.currency or "CNY"
+        rate = exchange_rates.get(currency, 1.0)
+        amount_cny = convert_to_cny(float(group.amount or 0), currency, rate)
+        
+        month_key = (int(group.year), int(group.month))
+        month_data = month_totals.setdefault(month_key, {"amount": 0.0, "count": 0})
+        month_data["amount"] += amount_cny
+        month_data["count"] += int(group.count)
+        
+        if not group.category or not group.nonzero_count:
+            continue
+        category_data = category_stats_dict.setdefault(group.category, {"amount": 0.0, "count": 0})
+        category_data["amount"] += amount_cny
+        category_data["count"] += int(group.nonzero_count)
+        total_amount += amount_cny
+    
+    def month_stats(year: int, month: int) -> schemas.MonthlyStats:
+        data = month_totals.get((year, month), {"amount": 0.0, "count": 0})
+        return schemas.MonthlyStats(month=f"{year}-{month:02d}", amount=data["amount"], count=data["count"])
+    
     # 计算近6个月数据
     monthly_data: list[schemas.MonthlyStats] = []
     for i in range(5, -1, -1):  # 从5个月前到当前月
-        # 计算月份
         target_month = now.month - i
         target_year = now.year
         while target_month < 1:
             target_month += 12
             target_year -= 1
-        while target_month > 12:
-            target_month -= 12
-            target_year += 1
-        
-        month_str = f"{target_year}-{target_month:02d}"
-        
-        month_amount = 0.0
-        month_count = 0
-        
-        for entry in entries:
-            entry_date = entry.event_time or entry.created_at
-            if entry_date.year == target_year and entry_date.month == target_month:
-                if entry.amount:
-                    # 转换为人民币
-                    currency = entry.currency or "CNY"
-                    rate = exchange_rates.get(currency, 1.0)
-                    month_amount += convert_to_cny(entry.amount, currency, rate)
-                month_count += 1
-        
-        monthly_data.append(schemas.MonthlyStats(
-            month=month_str,
-            amount=month_amount,
-            count=month_count
-        ))
+        monthly_data.append(month_stats(target_year, target_month))
     
     # 计算全年数据
-    yearly_data: list[schemas.MonthlyStats] = []
-    current_year = now.year
-    for month in range(1, 13):
-        month_str = f"{current_year}-{month:02d}"
-        month_amount = 0.0
-        month_count = 0
-        
-        for entry in entries:
-            entry_date = entry.event_time or entry.created_at
-            if entry_date.year == current_year and entry_date.month == month:
-                if entry.amount:
-                    # 转换为人民币
-                    currency = entry.currency or "CNY"
-                    rate = exchange_rates.get(currency, 1.0)
-                    month_amount += convert_to_cny(entry.amount, currency, rate)
-                month_count += 1
-        
-        yearly_data.append(schemas.MonthlyStats(
-            month=month_str,
-            amount=month_amount,
-            count=month_count
-        ))
+    yearly_data = [month_stats(now.year, month) for month in range(1, 13)]
     
     # 计算分类统计
-    category_stats_dict: dict[str, dict] = {}
-    total_amount = 0.0
-    
-    for entry in entries:
-        if not entry.category or not entry.amount:
-            continue
-        
-        # 转换为人民币
-        currency = entry.currency or "CNY"
-        rate = exchange_rates.get(currency, 1.0)
-        amount_cny = convert_to_cny(entry.amount, currency, rate)
-        
-        if entry.category not in category_stats_dict:
-            category_stats_dict[entry.category] = {"amount": 0.0, "count": 0}
-        
-        category_stats_dict[entry.category]["amount"] += amount_cny
-        category_stats_dict[entry.category]["count"] += 1
-        total_amount += amount_cny
-    
     category_stats: list[schemas.CategoryStats] = []
     for category, data in category_stats_dict.items():
         percentage = (data["amount"] / total_amount * 100) if total_amount > 0 else 0
@@ -404,6 +377,69 @@ async def get_ledger_statistics(
     )
 
 
+@router.get("/statistics", response_model=schemas.LedgerStatisticsResponse)
+async def get_ledger_statistics(
+    session: AsyncSession = Depends(get_session),
+    current_user: models.User = Depends(get_current_user),
+):
+    """获取记账统计数据（必须在 /{ledger_id} 之前定义，避免路由冲突）"""
+    now = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+    
+    # 读取增量维护的月度汇总行，不再扫描全部记账条目
+    groups = await load_ledger_rollups(session, current_user.id)
+    return await build_ledger_statistics(groups, now)
+
+
+@router.get("/events")
+async def ledger_events(
+    request: Request,
+    user: models.User = Depends(get_current_user),
+):
+    """
+    记账条目状态推送（Server-Sent Events）
+
+    条目从 pending/processing 变为 completed/failed 时推送 `event: ledger`，
+    data 为与 GET /ledger/{id} 相同结构的条目 JSON
+    """
+    return StreamingResponse(
+        ledger_event_stream(user.id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/export")
+async def export_ledgers(
+    format: str = Query("csv", description="csv 或 jsonl"),
+    category: Optional[str] = Query(None, description="分类筛选"),
+    start: Optional[dt.date] = Query(None, description="开始日期（包含）"),
+    end: Optional[dt.date] = Query(None, description="结束日期（包含）"),
+    status: Optional[str] = Query(None, description="状态筛选：pending/processing/completed/failed"),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    流式导出记账条目（必须在 /{ledger_id} 之前定义，避免路由冲突）
+
+    使用服务端游标分块读取并边读边发送，导出大量条目时内存占用不随条目数增长
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}，支持: {', '.join(EXPORT_FORMATS)}")
+    if category is not None and category not in LEDGER_CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"分类必须是以下之一: {', '.join(LEDGER_CATEGORIES)}")
+    if status is not None and status not in ("pending", "processing", "completed", "failed"):
+        raise HTTPException(status_code=400, detail=f"无效的状态: {status}")
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+
+    query = build_export_query(current_user.id, category, start, end, status)
+    filename = f"ledger-{dt.datetime.now(dt.timezone.utc):%Y%m%d}.{format}"
+    return StreamingResponse(
+        ledger_export_stream(query, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get("/{ledger_id}", response_model=schemas.LedgerOut)
 async def get_ledger(
     ledger_id: int,
@@ -439,6 +475,9 @@ async def update_ledger(
     if not entry:
         raise HTTPException(status_code=404, detail="账本条目不存在")
     
+    # 记录修改前对月度汇总的贡献
+    rollup_before = rollup_contribution(entry)
+    
     # 更新字段
     if payload.amount is not None:
         entry.amount = payload.amount
@@ -466,6 +505,8 @@ async def update_ledger(
             # 如果没有时区信息，直接使用
             entry.event_time = payload.event_time
     
+    # 与条目修改在同一事务中更新月度汇总
+    await apply_rollup_delta(session, rollup_before, rollup_contribution(entry))
     await session.commit()
     await session.refresh(entry)
     return entry
@@ -487,7 +528,9 @@ async def delete_ledger(
     if not entry:
         raise HTTPException(status_code=404, detail="账本条目不存在")
     
+    await apply_rollup_delta(session, rollup_contribution(entry), None)
     await session.delete(entry)
+    await adjust_ledger_count(session, current_user.id, -1)
     await session.commit()
     return {"message": "账本条目已删除"}
 
@@ -1,17 +1,22 @@
 import os
 import re
 import inspect
+import uuid
+import mimetypes
+import datetime as dt
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, and_, or_, tuple_
 from sqlalchemy.exc import IntegrityError
 
 from .. import models, schemas
 from ..db import get_session
 from ..auth import get_current_user
-from ..utils.file_utils import save_uploaded_img, save_uploaded_file
+from ..utils.pagination import encode_cursor, decode_cursor
+from ..services.notes_export import notes_archive_stream
+from ..services.file_store import store_upload, commit_uploads, release_files
 
 router = APIRouter(prefix="/notes", tags=["notes"])
 
@@ -25,6 +30,12 @@ FILE_DIR.mkdir(exist_ok=True)
 
 # 文件大小限制：5MB
 MAX_FILE_SIZE = 5 * 1024 * 1024
+# 图片大小限制：20MB
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+
+# 游标分页：默认每页数量和上限
+DEFAULT_NOTES_PAGE_SIZE = 20
+MAX_NOTES_PAGE_SIZE = 100
 
 
 def clean_markdown_for_search(markdown_text: str) -> str:
@@ -41,6 +52,11 @@ def clean_markdown_for_search(markdown_text: str) -> str:
     return text
 
 
+def build_search_text(markdown_text: str) -> str:
+    """生成持久化到 notes.search_text 的搜索文本（清理 markdown 语法并转小写）"""
+    return clean_markdown_for_search(markdown_text or "").lower()
+
+
 def markdown_references_uploaded_files(markdown_text: str) -> bool:
     """判断 markdown 是否引用了已上传的 notes 文件资源路径"""
     if not markdown_text:
@@ -133,9 +149,28 @@ async def link_files_to_note(session: AsyncSession, note_id: int, body_md: str,
         f.note_id = note_id
 
 
-@router.get("", response_model=list[schemas.NoteOut])
+def apply_note_cursor(query, cursor: str):
+    """在 (is_pinned, created_at, id) 倒序上追加“位于游标之后”的条件"""
+    values = decode_cursor(cursor, datetime_keys=("created_at",))
+    try:
+        is_pinned = bool(values["is_pinned"])
+        after_in_group = tuple_(models.Note.created_at, models.Note.id) < tuple_(values["created_at"], int(values["id"]))
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    if is_pinned:
+        # 置顶笔记之后：剩余的置顶笔记，然后是全部非置顶笔记
+        return query.where(or_(
+            models.Note.is_pinned.is_(False),
+            and_(models.Note.is_pinned.is_(True), after_in_group),
+        ))
+    return query.where(models.Note.is_pinned.is_(False), after_in_group)
+
+
+@router.get("", response_model=list[schemas.NoteOut] | schemas.NotePageResponse)
 async def list_notes(
     q: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_NOTES_PAGE_SIZE, description="每页数量，提供时返回游标分页结果"),
+    cursor: str | None = Query(None, description="上一页返回的 next_cursor"),
     session: AsyncSession = Depends(get_session), 
     current_user: models.User = Depends(get_current_user)
 ):
@@ -143,27 +178,48 @@ async def list_notes(
     获取所有笔记 如果有搜索关键词则过滤
     Args:
         q: 搜索关键词
+        limit: 每页数量，提供 limit 或 cursor 时启用游标分页
+        cursor: 上一页返回的 next_cursor
     Returns:
-        list[schemas.NoteOut]: 笔记列表
+        list[schemas.NoteOut]: 笔记列表（未分页）
+        schemas.NotePageResponse: 分页结果（启用游标分页时）
     """
-    # 先获取所有笔记，按置顶优先，然后按创建时间倒序
+    # 按置顶优先，然后按创建时间倒序（id 作为同一时间的决胜字段）
     query = select(models.Note).where(models.Note.user_id == current_user.id)
-    query = query.order_by(models.Note.is_pinned.desc(), models.Note.created_at.desc())
-    result = await session.execute(query)
-    notes = result.scalars().all()
     
-    # 如果有搜索关键词，在 Python 层面过滤（排除 markdown 图片和链接语法）
+    # 如果有搜索关键词，在数据库中匹配预先清理好的 search_text（PostgreSQL 下走 pg_trgm 索引）
     if q is not None and q.strip():
         q_trimmed = q.strip().lower()
-        filtered_notes = []
-        for note in notes:
-            # 清理 markdown 语法后搜索
-            cleaned_text = clean_markdown_for_search(note.body_md or "")
-            if q_trimmed in cleaned_text.lower():
-                filtered_notes.append(note)
-        return [build_note_out(n) for n in filtered_notes]
+        query = query.where(models.Note.search_text.contains(q_trimmed, autoescape=True))
+    
+    query = query.order_by(models.Note.is_pinned.desc(), models.Note.created_at.desc(), models.Note.id.desc())
+    
+    if limit is None and cursor is None:
+        result = await session.execute(query)
+        notes = result.scalars().all()
+        return [build_note_out(n) for n in notes]
+    
+    # 游标分页：多取一条用于判断是否还有下一页
+    page_size = limit or DEFAULT_NOTES_PAGE_SIZE
+    if cursor:
+        query = apply_note_cursor(query, cursor)
+    result = await session.execute(query.limit(page_size + 1))
+    notes = list(result.scalars().all())
     
-    return [build_note_out(n) for n in notes]
+    next_cursor = None
+    if len(notes) > page_size:
+        notes = notes[:page_size]
+        last = notes[-1]
+        next_cursor = encode_cursor({
+            "is_pinned": bool(last.is_pinned),
+            "created_at": last.created_at,
+            "id": last.id,
+        })
+    
+    return schemas.NotePageResponse(
+        items=[build_note_out(n) for n in notes],
+        next_cursor=next_cursor,
+    )
 
 
 @router.post("", response_model=schemas.NoteOut)
@@ -176,7 +232,8 @@ async def create_note(
         raise HTTPException(status_code=400, detail="笔记内容不能为空")
     note = models.Note(
         user_id=current_user.id,
-        body_md=payload.body_md
+        body_md=payload.body_md,
+        search_text=build_search_text(payload.body_md),
     )
     session.add(note)
     await session.commit()
@@ -196,26 +253,28 @@ async def upload_image(
     session: AsyncSession = Depends(get_session),
     current_user: models.User = Depends(get_current_user),
 ):
-    """上传图片（暂不校验大小）"""
-    # 使用通用函数保存图片文件
-    file_path = await save_uploaded_img(file, IMAGE_DIR)
+    """上传图片（校验大小，相同内容的图片只保存一份）"""
+    # 按块写入并计算内容摘要（超过大小限制时中止），重复内容复用已有的 blob
+    file_path, content_hash, _ = await store_upload(session, file, max_size=MAX_IMAGE_SIZE)
     
-    # 从完整路径中提取文件名
-    file_name = Path(file_path).name
-    url_path = f"/notes/files/images/{file_name}"
+    # 每次上传使用独立的访问路径，物理文件按内容共用
+    file_ext = Path(file.filename).suffix if file.filename else ".jpg"
+    url_path = f"/notes/files/images/{uuid.uuid4()}{file_ext}"
     
     # 记录到数据库
     db_file = models.File(
         user_id=current_user.id,
-        file_path=str(file_path),
+        file_path=file_path,
         url_path=url_path,
-        file_type="image"
+        file_type="image",
+        content_hash=content_hash,
     )
     session.add(db_file)
     try:
-        await session.commit()
+        await commit_uploads(session)
     except IntegrityError:
-        await session.rollback()
+        # commit_uploads 已回滚并删除本次新建的 blob 文件
+        pass
     
     # 返回URL（使用相对路径，前端会拼接baseURL）
     return {"url": url_path}
@@ -227,35 +286,53 @@ async def upload_file(
     session: AsyncSession = Depends(get_session),
     current_user: models.User = Depends(get_current_user),
 ):
-    """上传文件（校验大小）"""
-    # 使用通用函数保存文件（包含大小验证）
+    """上传文件（校验大小，相同内容的文件只保存一份）"""
+    # 按块写入并计算内容摘要（包含大小验证），重复内容复用已有的 blob
     original_name = file.filename or "file"
-    file_path, content = await save_uploaded_file(file, FILE_DIR, max_size=MAX_FILE_SIZE, default_ext=Path(original_name).suffix)
+    file_path, content_hash, size = await store_upload(session, file, max_size=MAX_FILE_SIZE)
     
-    # 从完整路径中提取文件名
-    file_name = Path(file_path).name
-    url_path = f"/notes/files/files/{file_name}"
+    # 每次上传使用独立的访问路径，物理文件按内容共用
+    url_path = f"/notes/files/files/{uuid.uuid4()}{Path(original_name).suffix}"
     
     # 记录到数据库
     db_file = models.File(
         user_id=current_user.id,
-        file_path=str(file_path),
+        file_path=file_path,
         url_path=url_path,
-        file_type="file"
+        file_type="file",
+        content_hash=content_hash,
     )
     session.add(db_file)
     try:
-        await session.commit()
+        await commit_uploads(session)
     except IntegrityError:
-        await session.rollback()
+        # commit_uploads 已回滚并删除本次新建的 blob 文件
+        pass
     
     # 返回文件信息（使用相对路径，前端会拼接baseURL）
     return {
         "name": original_name,
         "url": url_path,
-        "size": len(content)
+        "size": size
     }
 
+@router.get("/export")
+async def export_notes(
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    导出全部笔记（zip：notes/*.md + attachments/ 下的附件）
+
+    压缩包边生成边发送，附件较多时也不会在内存中缓存整个文件
+    """
+    filename = f"notes-{dt.datetime.now(dt.timezone.utc):%Y%m%d}.zip"
+    return StreamingResponse(
+        notes_archive_stream(current_user.id),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get("/files/{file_type}/{file_name}")
 async def get_note_file(
     file_type: str,
@@ -282,7 +359,9 @@ async def get_note_file(
     file_path = Path(db_file.file_path)
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="文件不存在")
-    return FileResponse(file_path)
+    # blob 文件没有扩展名，按访问路径中的文件名确定类型
+    media_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    return FileResponse(file_path, media_type=media_type)
 
 
 
@@ -305,6 +384,7 @@ async def update_note(
         raise HTTPException(status_code=400, detail="笔记内容不能为空")
     
     note.body_md = payload.body_md
+    note.search_text = build_search_text(payload.body_md)
     
     # 关联文件
     if payload.body_md is not None and markdown_references_uploaded_files(payload.body_md):
@@ -328,21 +408,23 @@ async def delete_note(
     if not note:
         raise HTTPException(status_code=404, detail="笔记不存在")
         
-    # 查询关联的文件并删除物理文件
+    # 查询关联的文件，释放对 blob 的引用（blob 在最后一个引用释放后由定时任务删除）
     stmt = select(models.File).where(models.File.note_id == note_id)
     result = await session.execute(stmt)
     files_to_delete = result.scalars().all()
+    legacy_paths = await release_files(session, files_to_delete)
+            
+    await session.delete(note)
+    await session.commit()
     
-    for f in files_to_delete:
+    # 旧记录独占物理文件，直接删除
+    for file_path in legacy_paths:
         try:
-            if os.path.exists(f.file_path):
-                os.remove(f.file_path)
+            if os.path.exists(file_path):
+                os.remove(file_path)
         except Exception as e:
             # 记录错误但继续执行
-            print(f"Error deleting file {f.file_path}: {e}")
-            
-    await session.delete(note)
-    await session.commit()
+            print(f"Error deleting file {file_path}: {e}")
     return {"ok": True}
 
 
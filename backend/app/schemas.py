@@ -4,7 +4,8 @@ from typing import Optional, List
 from pydantic import BaseModel, EmailStr
 
 
-def _encode_datetime_utc(value: dt.datetime | None):
+def encode_datetime_utc(value: dt.datetime | None):
+    """把时间编码为 UTC ISO 字符串（无时区的时间视为 UTC，以 Z 结尾），接口响应和导出共用"""
     if value is None:
         return None
     if value.tzinfo is None:
@@ -42,7 +43,7 @@ class UserOut(UserBase):
 
     class Config:
         from_attributes = True
-        json_encoders = {dt.datetime: _encode_datetime_utc}
+        json_encoders = {dt.datetime: encode_datetime_utc}
 
 
 class PasswordChange(BaseModel):
@@ -74,7 +75,13 @@ class NoteOut(NoteBase):
 
     class Config:
         from_attributes = True
-        json_encoders = {dt.datetime: _encode_datetime_utc}
+        json_encoders = {dt.datetime: encode_datetime_utc}
+
+
+class NotePageResponse(BaseModel):
+    """游标分页的笔记列表响应"""
+    items: List[NoteOut]
+    next_cursor: Optional[str] = None  # 为空表示没有更多数据
 
 
 class LedgerCreate(BaseModel):
@@ -107,7 +114,7 @@ class LedgerOut(BaseModel):
 
     class Config:
         from_attributes = True
-        json_encoders = {dt.datetime: _encode_datetime_utc}
+        json_encoders = {dt.datetime: encode_datetime_utc}
 
 
 class TodoCreate(BaseModel):
@@ -133,7 +140,7 @@ class TodoOut(BaseModel):
     class Config:
         from_attributes = True
         # 允许延迟评估，解决循环引用
-        json_encoders = {dt.datetime: _encode_datetime_utc}
+        json_encoders = {dt.datetime: encode_datetime_utc}
 
 
 class DashboardSummary(BaseModel):
@@ -146,10 +153,21 @@ class DashboardSummary(BaseModel):
 class LedgerListResponse(BaseModel):
     """分页的记账列表响应"""
     items: List[LedgerOut]
-    total: int
+    total: Optional[int] = None  # include_total=false 时为空
     page: int
     page_size: int
-    total_pages: int
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = None  # 下一页游标，为空表示没有更多数据
+
+
+class LedgerImportResponse(BaseModel):
+    """账单导入结果"""
+    imported: int  # 写入的条目数
+    completed: int  # 带金额和分类、直接完成的条目数
+    pending: int  # 等待分析的条目数
+    skipped: int  # 收入记录或无法解析的行数
+    tasks: int  # 投递的批量分析任务数
+    truncated: bool = False  # 超过单文件行数上限时为 true
 
 
 class MonthlyStats(BaseModel):
@@ -0,0 +1,180 @@
+"""
+笔记附件的内容寻址存储
+上传内容按 SHA-256 存放在 uploads/blobs/<前两位>/<摘要>，相同内容只保存一份。
+每次上传仍然生成独立的 File 记录（独立的 url_path，用于鉴权和关联笔记），
+File.content_hash 指向 file_blobs，file_blobs.ref_count 记录引用数；
+引用数降到 0 的 blob 由 cleanup_orphan_files 删除
+"""
+import hashlib
+import logging
+import os
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..utils.db_utils import insert_for_dialect, session_dialect_name
+from ..utils.file_utils import remove_quietly, stream_upload_to_disk
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = Path("uploads") / "blobs"
+# 上传过程中的临时文件目录（与 blob 在同一文件系统，os.replace 是原子的）
+BLOB_TMP_DIR = BLOB_DIR / "tmp"
+# session.info 中记录本事务新建的 blob 文件，事务回滚时删除
+NEW_BLOBS_KEY = "file_store.new_blobs"
+
+
+def blob_path(content_hash: str) -> Path:
+    """blob 的物理路径：按摘要前两位分目录，避免单个目录下文件过多"""
+    return BLOB_DIR / content_hash[:2] / content_hash
+
+
+def _place_blob(temp_path: Path, target: Path) -> bool:
+    """
+    把临时文件移动到 blob 路径；blob 已存在（重复上传）时丢弃临时文件
+
+    Returns:
+        是否新建了 blob 文件
+    """
+    if target.exists():
+        remove_quietly(temp_path)
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, target)
+    return True
+
+
+async def acquire_blob(session: AsyncSession, temp_path: Path, content_hash: str, size: int) -> str:
+    """
+    在当前事务中为内容增加一次引用，并确保 blob 文件存在
+
+    先执行 upsert 再检查文件：PostgreSQL 上 upsert 会锁住 blob 行，
+    与 purge_unreferenced_blobs 删除同一 blob 互斥，不会把刚引用的文件删掉。
+    新建的 blob 文件记录在 session.info 中，调用方需通过 commit_uploads 提交，
+    提交失败时删除这些文件
+
+    Returns:
+        blob 的物理路径（字符串）
+    """
+    table = models.FileBlob.__table__
+    stmt = insert_for_dialect(session_dialect_name(session))(table).values(
+        content_hash=content_hash,
+        file_path=str(blob_path(content_hash)),
+        size=size,
+        ref_count=1,
+        created_at=models.utc_now(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["content_hash"],
+        set_={"ref_count": table.c.ref_count + 1},
+    ).returning(table.c.file_path)
+    result = await session.execute(stmt)
+    file_path = result.scalar_one()
+    if await run_in_threadpool(_place_blob, temp_path, Path(file_path)):
+        session.info.setdefault(NEW_BLOBS_KEY, []).append(file_path)
+    return file_path
+
+
+async def commit_uploads(session: AsyncSession):
+    """
+    提交包含 acquire_blob 的事务
+
+    提交失败时先删除本事务新建的 blob 文件再回滚：回滚前 blob 行锁仍然持有，
+    等待同一内容的其他上传在回滚后会重新写入文件，不会引用已删除的文件
+
+    Raises:
+        提交时的原始异常
+    """
+    try:
+        await session.commit()
+    except BaseException:
+        for file_path in session.info.pop(NEW_BLOBS_KEY, []):
+            await run_in_threadpool(remove_quietly, Path(file_path))
+        await session.rollback()
+        raise
+    session.info.pop(NEW_BLOBS_KEY, None)
+
+
+async def store_upload(
+    session: AsyncSession,
+    file,
+    max_size: Optional[int] = None,
+) -> tuple[str, str, int]:
+    """
+    按块写入上传文件并计算 SHA-256，写入完成后放入内容寻址存储（引用数 +1，调用方通过 commit_uploads 提交）
+
+    Returns:
+        tuple: (blob 的物理路径, 内容摘要, 文件大小字节数)
+
+    Raises:
+        HTTPException: 如果文件大小超过限制
+    """
+    BLOB_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = BLOB_TMP_DIR / f"{uuid.uuid4()}.part"
+    hasher = hashlib.sha256()
+    size = await stream_upload_to_disk(file, temp_path, max_size=max_size, hasher=hasher)
+    content_hash = hasher.hexdigest()
+    try:
+        file_path = await acquire_blob(session, temp_path, content_hash, size)
+    except BaseException:
+        await run_in_threadpool(remove_quietly, temp_path)
+        raise
+    return file_path, content_hash, size
+
+
+async def release_files(session: AsyncSession, files: Iterable[models.File]) -> list[str]:
+    """
+    在当前事务中释放一批 File 记录对 blob 的引用（不删除 File 记录本身）
+
+    Returns:
+        旧记录（没有 content_hash，独占物理文件）的路径，由调用方在删除记录后自行删除
+    """
+    counts: Counter = Counter()
+    legacy_paths = []
+    for f in files:
+        if f.content_hash:
+            counts[f.content_hash] += 1
+        else:
+            legacy_paths.append(f.file_path)
+    blob = models.FileBlob
+    for content_hash, count in counts.items():
+        await session.execute(
+            update(blob)
+            .where(blob.content_hash == content_hash)
+            .values(ref_count=blob.ref_count - count)
+        )
+    return legacy_paths
+
+
+async def purge_unreferenced_blobs(session: AsyncSession) -> int:
+    """
+    删除引用数降到 0 的 blob 文件和记录
+
+    PostgreSQL 上用 FOR UPDATE SKIP LOCKED 认领：正在被 acquire_blob 重新引用的 blob 会被跳过。
+    先删文件再提交：提交失败时记录仍为 0 引用，下次上传相同内容会重新写入文件
+
+    Returns:
+        删除的 blob 数
+    """
+    blob = models.FileBlob
+    result = await session.execute(
+        select(blob).where(blob.ref_count <= 0).with_for_update(skip_locked=True)
+    )
+    blobs = result.scalars().all()
+    for b in blobs:
+        try:
+            await run_in_threadpool(remove_quietly, Path(b.file_path))
+        except OSError as e:
+            logger.warning(f"删除 blob 文件失败，已跳过: {b.file_path}, 错误: {str(e)}")
+            continue
+        await session.delete(b)
+    await session.commit()
+    if blobs:
+        logger.info(f"已删除 {len(blobs)} 个无引用的附件 blob")
+    return len(blobs)
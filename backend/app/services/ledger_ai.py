@@ -1,7 +1,64 @@
 import asyncio
-from datetime import datetime, timezone
+import logging
+import time
+
+from celery import states
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from celery.result import AsyncResult
+
+from ..redis_client import get_async_redis
 from ..tasks.ledger_tasks import analyze_ledger_text
 
+logger = logging.getLogger(__name__)
+
+# 等待 Celery 结果的默认超时（秒）
+ANALYZE_TIMEOUT = 300
+# 轮询结果后端的初始间隔和最大间隔（秒），每次未就绪时间隔翻倍
+POLL_INITIAL_INTERVAL = 0.05
+POLL_MAX_INTERVAL = 1.0
+
+
+async def _fetch_task_meta(task_result: AsyncResult) -> dict | None:
+    """
+    在事件循环中读取任务结果元数据
+
+    Redis 结果后端直接用 redis.asyncio 读取结果键，不占用线程；
+    其他结果后端退回到 AsyncResult 自带的查询
+    """
+    backend = task_result.backend
+    if hasattr(backend, "get_key_for_task"):
+        raw = await get_async_redis().get(backend.get_key_for_task(task_result.id))
+        if raw is None:
+            return None
+        return backend.decode_result(raw)
+    return {"status": task_result.state, "result": task_result.result}
+
+
+async def wait_for_result(task_result: AsyncResult, timeout: float = ANALYZE_TIMEOUT):
+    """
+    异步等待 Celery 任务结果（按指数退避轮询结果后端，不为每个请求占用线程）
+
+    Raises:
+        celery.exceptions.TimeoutError: 超时仍未完成
+        任务抛出的异常: 任务执行失败
+    """
+    deadline = time.monotonic() + timeout
+    interval = POLL_INITIAL_INTERVAL
+    while True:
+        meta = await _fetch_task_meta(task_result)
+        if meta is not None and meta["status"] in states.READY_STATES:
+            if meta["status"] == states.SUCCESS:
+                return meta["result"]
+            result = meta["result"]
+            if isinstance(result, BaseException):
+                raise result
+            raise task_result.backend.exception_to_python(result)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise CeleryTimeoutError(f"等待任务 {task_result.id} 结果超时")
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * 2, POLL_MAX_INTERVAL)
 
 
 async def analyze(text: str, use_celery: bool = True) -> dict:
@@ -16,12 +73,9 @@ async def analyze(text: str, use_celery: bool = True) -> dict:
         分析结果字典
     """
     if use_celery:
-        # 使用 Celery 异步任务队列
-        # 使用 .delay() 提交任务到队列
+        # 使用 .delay() 提交任务到队列，在事件循环上异步等待结果
         task_result = analyze_ledger_text.delay(text)
-        # 使用 asyncio.to_thread 在后台线程中等待结果，避免阻塞事件循环
-        result = await asyncio.to_thread(task_result.get, timeout=300)  # 5 分钟超时
-        return result
+        return await wait_for_result(task_result, timeout=ANALYZE_TIMEOUT)
     else:
         # 同步调用（用于测试或不需要队列的场景）
-        return analyze_ledger_text(text)
\ No newline at end of file
+        return analyze_ledger_text(text)
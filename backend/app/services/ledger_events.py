@@ -0,0 +1,62 @@
+"""
+记账条目状态推送
+Celery 任务和后台任务在条目状态变化后通过 Redis pub/sub 发布事件，
+API 进程为每个用户提供 SSE（text/event-stream）订阅，客户端无需轮询条目
+"""
+import logging
+from typing import AsyncIterator
+
+from .. import models, schemas
+from ..redis_client import get_async_redis, get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+# SSE 空闲时发送心跳注释的间隔（秒），避免代理断开长连接
+HEARTBEAT_INTERVAL = 15
+# 建议客户端断线后重连的间隔（毫秒）
+RECONNECT_DELAY_MS = 3000
+
+
+def ledger_events_channel(user_id: int) -> str:
+    """用户记账事件的 Redis 频道名"""
+    return f"ledger:events:{user_id}"
+
+
+def publish_ledger_event(entry: models.LedgerEntry):
+    """
+    发布记账条目的最新状态（在事务提交之后调用）
+
+    推送失败只记录日志，不影响条目本身的处理
+    """
+    try:
+        payload = schemas.LedgerOut.model_validate(entry).model_dump_json()
+        get_sync_redis().publish(ledger_events_channel(entry.user_id), payload)
+    except Exception as e:
+        logger.warning(f"发布记账状态事件失败，entry_id: {getattr(entry, 'id', None)}, 错误: {str(e)}")
+
+
+async def ledger_event_stream(user_id: int, is_disconnected) -> AsyncIterator[str]:
+    """
+    订阅用户的记账事件并生成 SSE 消息
+
+    Args:
+        user_id: 用户 ID
+        is_disconnected: 返回客户端是否已断开的协程函数（通常为 request.is_disconnected）
+    """
+    pubsub = get_async_redis().pubsub()
+    channel = ledger_events_channel(user_id)
+    await pubsub.subscribe(channel)
+    try:
+        yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+        while not await is_disconnected():
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=HEARTBEAT_INTERVAL)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            data = message["data"]
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            yield f"event: ledger\ndata: {data}\n\n"
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.aclose()
@@ -0,0 +1,113 @@
+"""
+记账流式导出（CSV / JSONL）
+使用服务端游标按块读取条目，边读边写入 StreamingResponse，内存中最多保留一块数据
+"""
+import csv
+import datetime as dt
+import io
+import json
+import logging
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .. import models
+from ..config import settings
+from ..db import AsyncSessionLocal
+from ..schemas import encode_datetime_utc
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+}
+
+EXPORT_COLUMNS = (
+    "id", "event_time", "amount", "currency", "category", "merchant", "raw_text", "status", "created_at",
+)
+
+
+def build_export_query(
+    user_id: int,
+    category: Optional[str] = None,
+    start: Optional[dt.date] = None,
+    end: Optional[dt.date] = None,
+    status: Optional[str] = None,
+):
+    """
+    构建导出查询，按 (created_at, id) 排序以使用 ix_ledger_entries_user_created 索引
+
+    日期范围按账单时间（没有时使用创建时间）过滤，start 和 end 都包含在内
+    """
+    entry = models.LedgerEntry
+    query = select(entry).where(entry.user_id == user_id)
+    if category is not None:
+        query = query.where(entry.category == category)
+    if status is not None:
+        query = query.where(entry.status == status)
+    entry_date = func.coalesce(entry.event_time, entry.created_at)
+    if start is not None:
+        query = query.where(entry_date >= dt.datetime.combine(start, dt.time.min))
+    if end is not None:
+        query = query.where(entry_date < dt.datetime.combine(end + dt.timedelta(days=1), dt.time.min))
+    return query.order_by(entry.created_at, entry.id)
+
+
+def _export_values(entry: models.LedgerEntry) -> dict:
+    return {
+        "id": entry.id,
+        "event_time": encode_datetime_utc(entry.event_time),
+        "amount": entry.amount,
+        "currency": entry.currency,
+        "category": entry.category,
+        "merchant": entry.merchant,
+        "raw_text": entry.raw_text,
+        "status": entry.status,
+        "created_at": encode_datetime_utc(entry.created_at),
+    }
+
+
+def format_export_chunk(entries, fmt: str) -> str:
+    """把一块条目格式化为 CSV 行或 JSONL 行"""
+    if fmt == "jsonl":
+        return "".join(json.dumps(_export_values(entry), ensure_ascii=False) + "\n" for entry in entries)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writerows(_export_values(entry) for entry in entries)
+    return buffer.getvalue()
+
+
+def export_header(fmt: str) -> str:
+    """导出文件头：CSV 带 BOM（Excel 正确识别中文）和表头，JSONL 没有文件头"""
+    if fmt != "csv":
+        return ""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_COLUMNS)
+    return "\ufeff" + buffer.getvalue()
+
+
+async def ledger_export_stream(
+    query,
+    fmt: str,
+    session_factory: Optional[async_sessionmaker] = None,
+    chunk_size: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """
+    流式产出导出内容
+
+    生成器自己打开会话：请求依赖中的会话在响应开始发送前就会关闭，不能用于 StreamingResponse
+    """
+    session_factory = session_factory or AsyncSessionLocal
+    chunk_size = chunk_size or settings.ledger_export_chunk_size
+    header = export_header(fmt)
+    if header:
+        yield header
+    exported = 0
+    async with session_factory() as session:
+        result = await session.stream_scalars(query.execution_options(yield_per=chunk_size))
+        async for entries in result.partitions():
+            exported += len(entries)
+            yield format_export_chunk(entries, fmt)
+    logger.info(f"记账导出完成，format: {fmt}, 条目数: {exported}")
@@ -0,0 +1,395 @@
+"""
+记账批量导入（CSV / OFX 账单）
+上传文件逐行解析，按批用多行 INSERT ... RETURNING 写入条目，每批提交一次；
+带金额和有效分类的行直接记为 completed，其余行按组投递 ledger.analyze_batch 分析；
+只导入支出：CSV 按收/支列（没有时按金额符号）、OFX 按 TRNAMT 符号跳过收入；
+导入的条目在 meta 中标记 source=import，分析时保留账单中的金额、币种、时间和商户，只补充分类
+"""
+import csv
+import datetime as dt
+import io
+import logging
+import re
+import uuid
+from itertools import islice
+from typing import Iterator, Optional, TextIO
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..config import settings
+from ..constants import LEDGER_CATEGORIES
+from .ledger_outbox import add_outbox_batches, outbox_relay
+from .ledger_rollup import NO_CATEGORY, apply_rollup_delta
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ("csv", "ofx")
+
+# CSV 表头别名（小写），兼容常见银行/支付平台导出的中英文列名
+CSV_COLUMNS = {
+    "event_time": ("date", "time", "datetime", "日期", "时间", "交易时间", "交易日期", "记账日期", "交易创建时间"),
+    "amount": ("amount", "金额", "交易金额", "金额(元)", "金额（元）"),
+    "currency": ("currency", "币种", "货币"),
+    "category": ("category", "分类", "类别"),
+    "merchant": ("merchant", "payee", "name", "商户", "商家", "交易对方", "对方"),
+    "description": ("description", "memo", "note", "text", "备注", "摘要", "商品", "商品说明", "说明"),
+    "direction": ("type", "direction", "收/支", "收支", "交易类型"),
+}
+
+# 表示收入的收/支取值，记账只导入支出
+INCOME_MARKERS = ("收入", "income", "credit", "收")
+
+DATE_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d %H:%M",
+    "%Y/%m/%d",
+    "%Y%m%d%H%M%S",
+    "%Y%m%d",
+)
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.IGNORECASE | re.DOTALL)
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+OFX_CURRENCY = re.compile(r"<CURDEF>\s*([A-Za-z]{3})", re.IGNORECASE)
+
+
+class LedgerImportError(ValueError):
+    """导入文件格式错误"""
+
+
+def detect_import_format(filename: Optional[str], fmt: Optional[str] = None) -> str:
+    """根据显式参数或文件扩展名确定导入格式"""
+    fmt = (fmt or "").lower().lstrip(".")
+    if not fmt and filename:
+        fmt = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+        if fmt == "qfx":
+            fmt = "ofx"
+    if fmt not in IMPORT_FORMATS:
+        raise LedgerImportError(f"不支持的导入格式: {fmt or '未知'}，支持: {', '.join(IMPORT_FORMATS)}")
+    return fmt
+
+
+def parse_import_amount(value: Optional[str]) -> Optional[float]:
+    """解析金额字符串（去掉货币符号和千分位），无法解析时返回 None"""
+    if value is None:
+        return None
+    cleaned = re.sub(r"[¥￥$,\s]|元|RMB|CNY", "", str(value), flags=re.IGNORECASE)
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def parse_import_time(value: Optional[str]) -> Optional[dt.datetime]:
+    """解析导入文件中的时间（OFX 时间带有毫秒和时区后缀时只取日期时间部分）"""
+    if not value:
+        return None
+    value = value.strip()
+    digits = re.match(r"^(\d{14}|\d{8})", value)
+    if digits:
+        value = digits.group(1)
+    for fmt in DATE_FORMATS:
+        try:
+            return dt.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    try:
+        parsed = dt.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def build_import_row(
+    amount: Optional[float],
+    event_time: Optional[dt.datetime],
+    currency: Optional[str] = None,
+    category: Optional[str] = None,
+    merchant: Optional[str] = None,
+    description: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    把一条账单记录转换为待插入的条目字段，金额和描述都为空时返回 None
+
+    raw_text 中包含日期、商户和金额，交给模型分析时不会丢失原始信息
+    """
+    merchant = (merchant or "").strip() or None
+    description = (description or "").strip() or None
+    if amount is None and not (merchant or description):
+        return None
+    currency = (currency or "").strip().upper() or "CNY"
+    amount = abs(amount) if amount is not None else None
+    parts = [
+        event_time.strftime("%Y-%m-%d %H:%M") if event_time else None,
+        merchant,
+        description,
+        f"{amount:.2f} {currency}" if amount is not None else None,
+    ]
+    category = (category or "").strip()
+    return {
+        "raw_text": " ".join(part for part in parts if part),
+        "amount": amount,
+        "currency": currency,
+        "category": category if category in LEDGER_CATEGORIES else None,
+        "merchant": merchant,
+        "event_time": event_time,
+    }
+
+
+def _csv_amounts_signed(stream: TextIO, start: int, amount_index: int) -> bool:
+    """
+    预读一遍金额列，判断没有收/支列的 CSV 是否使用带符号金额（出现负数即视为带符号），
+    读完后回到文件开头
+    """
+    reader = csv.reader(stream)
+    next(reader, None)
+    try:
+        for values in reader:
+            amount = parse_import_amount(values[amount_index]) if amount_index < len(values) else None
+            if amount is not None and amount < 0:
+                return True
+        return False
+    finally:
+        stream.seek(start)
+
+
+def iter_csv_rows(stream: TextIO) -> Iterator[Optional[dict]]:
+    """
+    逐行解析 CSV 账单，无法使用的行产出 None（计入跳过数）
+
+    有收/支列时按该列跳过收入；没有收/支列时按金额符号判断：
+    出现负数金额的账单视为带符号账单（负数为支出，正数为收入并跳过），
+    全部为非负金额的账单视为支出明细
+    """
+    if not stream.seekable():
+        raise LedgerImportError("CSV 文件不支持重新读取")
+    start = stream.tell()
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        raise LedgerImportError("CSV 文件为空")
+    normalized = [column.strip().lower() for column in header]
+    positions = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in normalized:
+                positions[field] = normalized.index(alias)
+                break
+    if "amount" not in positions and "description" not in positions:
+        raise LedgerImportError("CSV 表头缺少金额（amount/金额）或描述（description/备注）列")
+
+    signed = False
+    if "direction" not in positions and "amount" in positions:
+        signed = _csv_amounts_signed(stream, start, positions["amount"])
+        reader = csv.reader(stream)
+        next(reader, None)
+
+    for values in reader:
+        def get(field):
+            index = positions.get(field)
+            return values[index] if index is not None and index < len(values) else None
+
+        direction = (get("direction") or "").strip().lower()
+        if direction and direction in INCOME_MARKERS:
+            yield None
+            continue
+        amount = parse_import_amount(get("amount"))
+        if signed and amount is not None and amount > 0:
+            yield None
+            continue
+        yield build_import_row(
+            amount=amount,
+            event_time=parse_import_time(get("event_time")),
+            currency=get("currency"),
+            category=get("category"),
+            merchant=get("merchant"),
+            description=get("description"),
+        )
+
+
+def iter_ofx_rows(stream: TextIO, chunk_size: int = 64 * 1024) -> Iterator[Optional[dict]]:
+    """
+    按块读取 OFX（SGML 或 XML）账单并逐条解析 <STMTTRN> 交易
+
+    只导入支出（TRNAMT 为负数），收入记录产出 None
+    """
+    buffer = ""
+    currency = None
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        if currency is None:
+            match = OFX_CURRENCY.search(buffer)
+            if match:
+                currency = match.group(1)
+        last_end = 0
+        for match in OFX_TRANSACTION.finditer(buffer):
+            last_end = match.end()
+            fields = {name.upper(): value.strip() for name, value in OFX_FIELD.findall(match.group(1))}
+            amount = parse_import_amount(fields.get("TRNAMT"))
+            if amount is not None and amount > 0:
+                yield None
+                continue
+            yield build_import_row(
+                amount=amount,
+                event_time=parse_import_time(fields.get("DTPOSTED") or fields.get("DTUSER")),
+                currency=currency,
+                merchant=fields.get("NAME") or fields.get("PAYEE"),
+                description=fields.get("MEMO"),
+            )
+        buffer = buffer[last_end:]
+        if not chunk:
+            return
+
+
+def iter_import_rows(stream: TextIO, fmt: str) -> Iterator[Optional[dict]]:
+    """按格式逐条产出导入记录"""
+    if fmt == "ofx":
+        return iter_ofx_rows(stream)
+    return iter_csv_rows(stream)
+
+
+def iter_import_batches(stream: TextIO, fmt: str, batch_size: int) -> Iterator[list[Optional[dict]]]:
+    """把导入记录按 batch_size 分批"""
+    rows = iter_import_rows(stream, fmt)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _rollup_totals(rows: list[dict], user_id: int) -> list[dict]:
+    """汇总一批已完成条目对月度汇总的贡献（每个汇总键一条，减少 upsert 次数）"""
+    totals: dict[tuple, dict] = {}
+    for row in rows:
+        event_time = row["event_time"]
+        key = (event_time.year, event_time.month, row["category"] or NO_CATEGORY, row["currency"])
+        total = totals.setdefault(key, {
+            "user_id": user_id,
+            "year": key[0],
+            "month": key[1],
+            "category": key[2],
+            "currency": key[3],
+            "amount": 0.0,
+            "count": 0,
+            "nonzero_count": 0,
+        })
+        total["amount"] += row["amount"]
+        total["count"] += 1
+        total["nonzero_count"] += 1 if row["amount"] != 0 else 0
+    return list(totals.values())
+
+
+async def insert_import_batch(
+    session: AsyncSession,
+    user_id: int,
+    rows: list[dict],
+    task_size: int,
+) -> tuple[int, list[tuple[str, list[int]]]]:
+    """
+    在一个事务中写入一批导入记录
+
+    带金额和有效分类的记录直接记为 completed 并计入月度汇总；
+    其余记录为 pending，每 task_size 条共用一个预先生成的 task_id，
+    对应的批量分析任务在同一事务中写入发件箱，由中继投递
+
+    Returns:
+        (completed 条数, [(task_id, 待分析条目 ID 列表)])
+    """
+    now = models.utc_now()
+    completed, pending = [], []
+    for row in rows:
+        if row["amount"] is not None and row["category"]:
+            row["event_time"] = row["event_time"] or now
+            completed.append(row)
+        else:
+            pending.append(row)
+
+    base = {"user_id": user_id, "meta": {"source": "import"}, "created_at": now, "updated_at": now}
+    values = [{**base, **row, "status": "completed", "task_id": None} for row in completed]
+    task_ids = [str(uuid.uuid4()) for _ in range(0, len(pending), task_size)]
+    values += [
+        {**base, **row, "status": "pending", "task_id": task_ids[position // task_size]}
+        for position, row in enumerate(pending)
+    ]
+
+    entry = models.LedgerEntry
+    result = await session.execute(
+        insert(entry).returning(entry.id, sort_by_parameter_order=True),
+        values,
+    )
+    entry_ids = list(result.scalars().all())
+    pending_ids = entry_ids[len(completed):]
+
+    for totals in _rollup_totals(completed, user_id):
+        await apply_rollup_delta(session, None, totals)
+    await session.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(ledger_count=models.User.ledger_count + len(entry_ids))
+    )
+    groups = [
+        (task_id, pending_ids[index * task_size:(index + 1) * task_size])
+        for index, task_id in enumerate(task_ids)
+    ]
+    await add_outbox_batches(session, groups)
+    await session.commit()
+    return len(completed), groups
+
+
+async def import_ledger_file(
+    session: AsyncSession,
+    user_id: int,
+    binary_stream,
+    fmt: str,
+    encoding: str = "utf-8-sig",
+) -> dict:
+    """
+    流式导入账单文件
+
+    文件读取和解析在线程池中按批进行，内存中最多保留一批记录；
+    每批的分析任务与条目在同一事务中写入发件箱，提交后唤醒中继投递
+
+    Returns:
+        导入统计：imported、completed、pending、skipped、tasks、truncated
+    """
+    stats = {"imported": 0, "completed": 0, "pending": 0, "skipped": 0, "tasks": 0, "truncated": False}
+    stream = io.TextIOWrapper(binary_stream, encoding=encoding, errors="replace", newline="")
+    batches = iter_import_batches(stream, fmt, settings.ledger_import_batch_size)
+    try:
+        while True:
+            batch = await run_in_threadpool(next, batches, None)
+            if batch is None:
+                break
+            remaining = settings.ledger_import_max_rows - stats["imported"]
+            rows = [row for row in batch if row is not None]
+            stats["skipped"] += len(batch) - len(rows)
+            if len(rows) > remaining:
+                rows = rows[:remaining]
+                stats["truncated"] = True
+
+            if rows:
+                completed, groups = await insert_import_batch(
+                    session, user_id, rows, settings.ledger_import_task_size
+                )
+                stats["imported"] += len(rows)
+                stats["completed"] += completed
+                stats["pending"] += len(rows) - completed
+                if groups:
+                    stats["tasks"] += len(groups)
+                    outbox_relay.notify()
+            if stats["truncated"]:
+                break
+    finally:
+        stream.detach()
+
+    logger.info(f"账单导入完成，user_id: {user_id}, format: {fmt}, 统计: {stats}")
+    return stats
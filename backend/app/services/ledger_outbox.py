@@ -0,0 +1,322 @@
+"""
+记账任务发件箱（transactional outbox）
+create_ledger 把待投递任务和条目写在同一个事务中，API 进程内的中继批量读取未投递记录、
+投递到 Celery 后标记 sent_at。进程在提交后、投递前退出时，重启后的中继会继续投递，
+条目不会永远停留在 pending。投递是至少一次的：标记失败时同一任务可能被再次投递
+"""
+import asyncio
+import datetime as dt
+import logging
+import time
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .. import models
+from ..config import settings
+from ..db import AsyncSessionLocal
+from .ledger_events import publish_ledger_event
+
+logger = logging.getLogger(__name__)
+
+# 批量分析任务的发件箱 payload（条目内容从数据库读取，不需要保存输入）
+BATCH_PAYLOAD = {"batch": True}
+
+
+def add_outbox_task(
+    session: AsyncSession,
+    entry: models.LedgerEntry,
+    raw_text: Optional[str] = None,
+    image_path: Optional[str] = None,
+    original_text: Optional[str] = None,
+) -> models.LedgerTaskOutbox:
+    """在当前事务中为条目登记待投递任务（条目的 task_id 需已生成）"""
+    outbox = models.LedgerTaskOutbox(
+        entry=entry,
+        task_id=entry.task_id,
+        payload={"raw_text": raw_text, "image_path": image_path, "original_text": original_text},
+    )
+    session.add(outbox)
+    return outbox
+
+
+async def add_outbox_batches(session: AsyncSession, groups: list[tuple[str, list[int]]]):
+    """
+    在当前事务中为批量分析任务登记待投递记录（批量导入使用）
+
+    每个条目一行（回收任务按条目查找未投递记录），同一任务的条目共用 task_id，
+    中继投递时按 task_id 合并为一个 ledger.analyze_batch 任务
+
+    Args:
+        groups: [(task_id, 条目 ID 列表)]，task_id 已随条目写入
+    """
+    values = [
+        {"entry_id": entry_id, "task_id": task_id, "payload": dict(BATCH_PAYLOAD)}
+        for task_id, entry_ids in groups
+        for entry_id in entry_ids
+    ]
+    if values:
+        await session.execute(insert(models.LedgerTaskOutbox), values)
+
+
+def _publish_batch(rows: list, producer) -> Optional[str]:
+    """把同一 task_id 的批量分析记录投递为一个任务，返回错误信息"""
+    from ..tasks.dispatch import dispatch_ledger_batch
+
+    try:
+        dispatch_ledger_batch(rows[0].task_id, [row.entry_id for row in rows], producer=producer)
+        return None
+    except Exception as e:
+        logger.warning(f"投递批量分析任务失败，task_id: {rows[0].task_id}, 条目数: {len(rows)}, 错误: {str(e)}")
+        return str(e) or e.__class__.__name__
+
+
+def publish_outbox_rows(rows: list) -> dict[int, Optional[str]]:
+    """
+    把一批发件箱记录投递到 broker（同步执行，整批共用一个 producer 和 broker 连接）
+
+    Returns:
+        {outbox_id: 错误信息}，投递成功时错误信息为 None
+    """
+    from ..celery_app import celery_app
+    from ..tasks.dispatch import dispatch_ledger_pipeline
+
+    results: dict[int, Optional[str]] = {}
+    batches: dict[str, list] = {}
+    with celery_app.producer_or_acquire() as producer:
+        for row in rows:
+            payload = row.payload or {}
+            if payload.get("batch"):
+                batches.setdefault(row.task_id, []).append(row)
+                continue
+            try:
+                dispatch_ledger_pipeline(
+                    row.task_id,
+                    row.entry_id,
+                    payload.get("raw_text"),
+                    payload.get("image_path"),
+                    payload.get("original_text"),
+                    producer=producer,
+                )
+                results[row.id] = None
+            except Exception as e:
+                logger.warning(f"投递发件箱记录失败，outbox_id: {row.id}, entry_id: {row.entry_id}, 错误: {str(e)}")
+                results[row.id] = str(e) or e.__class__.__name__
+        for batch_rows in batches.values():
+            error = _publish_batch(batch_rows, producer)
+            for row in batch_rows:
+                results[row.id] = error
+    return results
+
+
+async def _mark_entries_failed(session: AsyncSession, entry_ids: list[int]) -> list[models.LedgerEntry]:
+    """把多次投递失败的条目标记为 failed，返回被更新的条目"""
+    result = await session.execute(
+        select(models.LedgerEntry).where(
+            models.LedgerEntry.id.in_(entry_ids),
+            models.LedgerEntry.status == "pending",
+        )
+    )
+    entries = list(result.scalars().all())
+    for entry in entries:
+        entry.status = "failed"
+    return entries
+
+
+async def relay_outbox_batch(
+    session_factory: async_sessionmaker = AsyncSessionLocal,
+    batch_size: Optional[int] = None,
+) -> tuple[int, int]:
+    """
+    投递一批未发送的发件箱记录
+
+    分三步执行，投递期间不持有行锁和数据库连接（broker 变慢时不会占住连接池）：
+    1. 按 task_id 整组认领最多 batch_size 个任务的记录（批量导入的一个任务对应多行，
+       拆开认领会投递出多个 task_id 相同、条目不同的批量任务）。PostgreSQL 上用
+       FOR UPDATE SKIP LOCKED 锁定，部分记录被其他中继锁定的任务留到下一轮；
+       设置 claimed_until 后提交，到期前其他中继不会再次认领（进程在投递中途退出时，到期后由其他中继重试）
+    2. 投递到 broker
+    3. 标记投递成功的记录，失败的记录增加重试次数并释放认领
+
+    Returns:
+        (本批读取的记录数, 投递成功的记录数)
+    """
+    batch_size = batch_size or settings.ledger_outbox_batch_size
+    outbox = models.LedgerTaskOutbox
+    failed_entries: list[models.LedgerEntry] = []
+    now = models.utc_now()
+    claimable = (
+        outbox.sent_at.is_(None),
+        outbox.attempts < settings.ledger_outbox_max_attempts,
+        or_(outbox.claimed_until.is_(None), outbox.claimed_until < now),
+    )
+    async with session_factory() as session:
+        groups = await session.execute(
+            select(outbox.task_id, func.count())
+            .where(*claimable)
+            .group_by(outbox.task_id)
+            .order_by(func.min(outbox.id))
+            .limit(batch_size)
+        )
+        group_sizes = {task_id: size for task_id, size in groups.all()}
+        if not group_sizes:
+            return 0, 0
+        result = await session.execute(
+            select(outbox)
+            .where(outbox.task_id.in_(list(group_sizes)), *claimable)
+            .order_by(outbox.id)
+            .with_for_update(skip_locked=True)
+        )
+        locked: dict[str, list] = {}
+        for row in result.scalars().all():
+            locked.setdefault(row.task_id, []).append(row)
+        rows = sorted(
+            (row for task_id, task_rows in locked.items() if len(task_rows) == group_sizes[task_id] for row in task_rows),
+            key=lambda row: row.id,
+        )
+        if not rows:
+            return 0, 0
+        claimed_until = now + dt.timedelta(seconds=settings.ledger_outbox_claim_timeout)
+        await session.execute(
+            update(outbox).where(outbox.id.in_([row.id for row in rows])).values(claimed_until=claimed_until)
+        )
+        await session.commit()
+
+    errors = await run_in_threadpool(publish_outbox_rows, rows)
+
+    sent_ids = [row.id for row in rows if errors.get(row.id) is None]
+    failed_by_error: dict[str, list[int]] = {}
+    exhausted_entry_ids = []
+    for row in rows:
+        error = errors.get(row.id)
+        if error is None:
+            continue
+        row.attempts += 1
+        row.last_error = error
+        failed_by_error.setdefault(error, []).append(row.id)
+        if row.attempts >= settings.ledger_outbox_max_attempts:
+            exhausted_entry_ids.append(row.entry_id)
+
+    async with session_factory() as session:
+        if sent_ids:
+            await session.execute(
+                update(outbox).where(outbox.id.in_(sent_ids)).values(sent_at=models.utc_now(), claimed_until=None)
+            )
+        for error, row_ids in failed_by_error.items():
+            await session.execute(
+                update(outbox)
+                .where(outbox.id.in_(row_ids))
+                .values(attempts=outbox.attempts + 1, last_error=error, claimed_until=None)
+            )
+        if exhausted_entry_ids:
+            failed_entries = await _mark_entries_failed(session, exhausted_entry_ids)
+        await session.commit()
+
+    for entry in failed_entries:
+        logger.error(f"任务多次投递失败，已将 entry {entry.id} 标记为 failed")
+        await run_in_threadpool(publish_ledger_event, entry)
+    logger.info(f"发件箱中继已处理 {len(rows)} 条记录，投递成功: {len(sent_ids)}")
+    return len(rows), len(sent_ids)
+
+
+async def purge_sent_outbox(session_factory: async_sessionmaker = AsyncSessionLocal) -> int:
+    """删除超过保留时间的已投递记录"""
+    cutoff = models.utc_now() - dt.timedelta(hours=settings.ledger_outbox_retention_hours)
+    outbox = models.LedgerTaskOutbox
+    async with session_factory() as session:
+        result = await session.execute(
+            delete(outbox).where(outbox.sent_at.isnot(None), outbox.sent_at < cutoff)
+        )
+        await session.commit()
+    return result.rowcount or 0
+
+
+class OutboxRelay:
+    """
+    API 进程内的发件箱中继
+
+    create_ledger 提交后调用 notify() 立即唤醒中继；没有通知时按 poll_interval 轮询，
+    用于接手其他进程崩溃前留下的记录和重试投递失败的记录。
+    整批投递失败（通常是 broker 不可用）时按指数退避延长轮询间隔，避免很快耗尽重试次数
+    """
+
+    # 清理已投递记录的间隔（秒），按时钟计算，与中继是否空闲无关
+    PURGE_INTERVAL = 600
+    # 投递失败后的最长轮询间隔（秒）
+    MAX_BACKOFF = 60
+
+    def __init__(self, session_factory: async_sessionmaker = AsyncSessionLocal):
+        self.session_factory = session_factory
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """有新的发件箱记录时唤醒中继（中继未启动时忽略）"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """在当前事件循环中启动中继"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("发件箱中继已启动")
+
+    async def stop(self):
+        """停止中继"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self._wakeup = None
+        logger.info("发件箱中继已停止")
+
+    async def drain(self) -> tuple[int, int]:
+        """
+        连续投递直到没有满批的未发送记录
+
+        Returns:
+            (读取的记录数, 投递成功的记录数)；某批全部失败时立即返回
+        """
+        total_claimed = total_sent = 0
+        while True:
+            claimed, sent = await relay_outbox_batch(self.session_factory)
+            total_claimed += claimed
+            total_sent += sent
+            if claimed < settings.ledger_outbox_batch_size or sent == 0:
+                return total_claimed, total_sent
+
+    async def _run(self):
+        next_purge = time.monotonic() + self.PURGE_INTERVAL
+        interval = settings.ledger_outbox_poll_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                claimed, sent = await self.drain()
+                if claimed and not sent:
+                    interval = min(interval * 2, self.MAX_BACKOFF)
+                else:
+                    interval = settings.ledger_outbox_poll_interval
+                if time.monotonic() >= next_purge:
+                    next_purge = time.monotonic() + self.PURGE_INTERVAL
+                    purged = await purge_sent_outbox(self.session_factory)
+                    if purged:
+                        logger.info(f"已清理 {purged} 条已投递的发件箱记录")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"发件箱中继出错: {str(e)}", exc_info=True)
+
+
+outbox_relay = OutboxRelay()
@@ -0,0 +1,227 @@
+"""
+记账文本的规则解析（快速路径）
+对 "午饭 35"、"taxi $12.5"、"2024-03-01 超市 128.4元" 这类结构简单的输入，
+用正则和关键词直接提取金额、货币、时间和分类，并给出置信度；
+置信度足够高时不再调用 LLM。
+输入中的日期和时间是用户的本地时间，按 LEDGER_TIMEZONE 解析后转换为 UTC
+"""
+import re
+import unicodedata
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from ..config import settings
+from ..constants import LEDGER_CATEGORIES
+
+# 分类关键词（中文按子串匹配，英文按单词匹配，不区分大小写）
+CATEGORY_KEYWORDS: dict[str, tuple[str, ...]] = {
+    "餐饮美食": (
+        "早饭", "午饭", "晚饭", "早餐", "午餐", "晚餐", "夜宵", "宵夜", "外卖", "咖啡", "奶茶", "饮料",
+        "火锅", "烧烤", "零食", "水果", "食堂", "饭", "面条", "星巴克", "麦当劳", "肯德基",
+        "coffee", "lunch", "dinner", "breakfast", "meal", "restaurant", "starbucks", "snack", "food",
+    ),
+    "交通出行": (
+        "打车", "出租车", "滴滴", "地铁", "公交", "高铁", "火车", "动车", "机票", "车费", "共享单车",
+        "交通费", "taxi", "uber", "subway", "metro", "bus", "train", "flight",
+    ),
+    "爱车养车": ("加油", "停车", "洗车", "保养", "过路费", "gas", "parking"),
+    "日用百货": ("超市", "便利店", "日用品", "纸巾", "洗衣液", "supermarket", "grocery", "groceries"),
+    "住房物业": ("房租", "租金", "物业费", "rent"),
+    "充值缴费": ("话费", "电费", "水费", "燃气费", "宽带", "充值", "缴费"),
+    "医疗健康": ("医院", "药店", "买药", "挂号", "体检", "看病", "hospital", "pharmacy", "doctor"),
+    "文化休闲": ("电影", "门票", "演唱会", "游戏", "ktv", "movie", "cinema", "concert"),
+    "教育培训": ("学费", "培训", "课程", "教材", "tuition", "course"),
+    "服装装扮": ("衣服", "裤子", "鞋子", "外套", "裙子", "clothes", "shoes"),
+    "数码电器": ("手机", "电脑", "耳机", "充电器", "phone", "laptop"),
+    "运动户外": ("健身", "游泳", "球馆", "gym"),
+    "美容美发": ("理发", "剪发", "美甲", "haircut"),
+    "宠物": ("猫粮", "狗粮", "宠物", "pet"),
+    "酒店旅游": ("酒店", "住宿", "民宿", "旅游", "hotel", "airbnb"),
+}
+
+# 货币符号/单位 -> 货币代码（¥ 在国内输入中按人民币处理）
+CURRENCY_MARKERS = {
+    "¥": "CNY", "rmb": "CNY", "cny": "CNY", "元": "CNY", "块": "CNY", "块钱": "CNY",
+    "$": "USD", "us$": "USD", "usd": "USD", "美元": "USD", "美金": "USD", "刀": "USD",
+    "€": "EUR", "eur": "EUR", "欧元": "EUR",
+    "jpy": "JPY", "日元": "JPY", "円": "JPY",
+}
+
+# 跟在数字后面表示数量而不是金额的单位
+QUANTITY_UNITS = "个杯次斤份人件瓶包盒张箱只天晚夜袋碗串"
+
+# 货币前缀可以紧贴数字（"rmb35"、"usd12.5"）；没有前缀时数字不能紧跟在字母或数字后面（"iphone15"）
+AMOUNT_PATTERN = re.compile(
+    r"(?:(?<![a-z])(?P<prefix>us\$|\$|¥|€|rmb|cny|usd|eur|jpy)\s*|(?<![a-z0-9.]))"
+    r"(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?![0-9])"
+    r"\s*(?P<suffix>块钱|元|块|刀|美元|美金|欧元|日元|円|rmb|cny|usd|eur|jpy)?",
+    re.IGNORECASE,
+)
+FULL_DATE_PATTERN = re.compile(r"(?P<year>\d{4})\s*[-/.年]\s*(?P<month>\d{1,2})\s*[-/.月]\s*(?P<day>\d{1,2})\s*[日号]?")
+MONTH_DAY_PATTERN = re.compile(r"(?P<month>\d{1,2})\s*月\s*(?P<day>\d{1,2})\s*[日号]")
+TIME_PATTERN = re.compile(r"(?<!\d)(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?(?!\d)")
+RELATIVE_DAYS = {"今天": 0, "昨天": 1, "前天": 2}
+
+# 文本较长时（通常是 OCR 小票），规则解析不可靠
+MAX_FAST_PATH_TEXT_LENGTH = 40
+
+
+def local_timezone() -> tzinfo:
+    """规则解析使用的本地时区（LEDGER_TIMEZONE 无效时使用 UTC）"""
+    try:
+        return ZoneInfo(settings.ledger_timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+
+def _extract_datetime(text: str, now: datetime) -> tuple[Optional[datetime], str]:
+    """
+    提取日期和时间，返回 (时间, 去掉日期时间后的文本)
+
+    now 为用户时区的当前时间，返回的时间是同一时区的本地时间（naive）
+    """
+    date = None
+    match = FULL_DATE_PATTERN.search(text)
+    if match:
+        try:
+            date = datetime(int(match["year"]), int(match["month"]), int(match["day"]))
+        except ValueError:
+            date = None
+        text = text[:match.start()] + " " + text[match.end():]
+    else:
+        match = MONTH_DAY_PATTERN.search(text)
+        if match:
+            try:
+                date = datetime(now.year, int(match["month"]), int(match["day"]))
+            except ValueError:
+                date = None
+            text = text[:match.start()] + " " + text[match.end():]
+    if date is None:
+        for word, days in RELATIVE_DAYS.items():
+            if word in text:
+                date = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+                break
+
+    match = TIME_PATTERN.search(text)
+    clock = None
+    if match and int(match["hour"]) < 24 and int(match["minute"]) < 60:
+        clock = (int(match["hour"]), int(match["minute"]), int(match["second"] or 0))
+        text = text[:match.start()] + " " + text[match.end():]
+
+    if date is None and clock is None:
+        return None, text
+    date = date or now.replace(tzinfo=None)
+    if clock is None:
+        clock = (now.hour, now.minute, now.second)
+    return date.replace(hour=clock[0], minute=clock[1], second=clock[2], microsecond=0), text
+
+
+def _extract_amounts(text: str) -> list[tuple[float, Optional[str]]]:
+    """提取候选金额，返回 [(金额, 货币代码或 None)]"""
+    candidates = []
+    for match in AMOUNT_PATTERN.finditer(text):
+        marker = (match["prefix"] or match["suffix"] or "").lower()
+        if not marker:
+            following = text[match.end():].lstrip()
+            if following and following[0] in QUANTITY_UNITS:
+                continue
+        amount = float(match["number"].replace(",", ""))
+        candidates.append((amount, CURRENCY_MARKERS.get(marker)))
+    return candidates
+
+
+def _match_categories(text: str) -> set[str]:
+    """返回文本命中的分类集合"""
+    lowered = text.lower()
+    matched = set()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword.isascii():
+                if re.search(rf"\b{re.escape(keyword)}\b", lowered):
+                    matched.add(category)
+                    break
+            elif keyword in lowered:
+                matched.add(category)
+                break
+    return matched
+
+
+def parse_ledger_text_fast(
+    text: str,
+    now: Optional[datetime] = None,
+    tz: Optional[tzinfo] = None,
+) -> Optional[dict]:
+    """
+    规则解析记账文本
+
+    Args:
+        text: 用户原文
+        now: 当前 UTC 时间（测试时可指定）
+        tz: 用户输入的日期时间所在时区，默认 LEDGER_TIMEZONE
+
+    Returns:
+        与 LLM 分析结果结构相同的字典，meta.confidence 为 0~1 的置信度；
+        没有可用金额时返回 None
+    """
+    now = now or datetime.now(timezone.utc)
+    tz = tz or local_timezone()
+    normalized = unicodedata.normalize("NFKC", text or "").strip()
+    if not normalized:
+        return None
+
+    local_event_time, remaining = _extract_datetime(normalized, now.astimezone(tz))
+    event_time = None
+    if local_event_time is not None:
+        event_time = local_event_time.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+    candidates = _extract_amounts(remaining)
+    marked = [candidate for candidate in candidates if candidate[1] is not None]
+    if len(candidates) == 1:
+        amount, currency = candidates[0]
+        confidence = 0.5
+    elif len(marked) == 1:
+        # 多个数字但只有一个带货币单位
+        amount, currency = marked[0]
+        confidence = 0.4
+    else:
+        return None
+    if amount <= 0:
+        return None
+    if currency is not None:
+        confidence += 0.1
+
+    categories = _match_categories(remaining)
+    if len(categories) == 1:
+        category = categories.pop()
+        confidence += 0.3
+    else:
+        category = "其他"
+        confidence += 0.1 if categories else 0.0
+
+    if len(normalized) > MAX_FAST_PATH_TEXT_LENGTH:
+        confidence -= 0.3
+    confidence = round(max(0.0, min(confidence, 1.0)), 2)
+
+    return {
+        "amount": amount,
+        "currency": currency or "CNY",
+        "category": category if category in LEDGER_CATEGORIES else "其他",
+        "merchant": None,
+        "event_time": (event_time or now.replace(tzinfo=None)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "meta": {
+            "model": "rules",
+            "text_length": len(text),
+            "description": text,
+            "confidence": confidence,
+        },
+    }
+
+
+def try_fast_parse(text: str) -> Optional[dict]:
+    """规则解析置信度达到 ledger_fast_path_min_confidence 时返回结果，否则返回 None（需要调用 LLM）"""
+    if not settings.ledger_fast_path_enabled:
+        return None
+    result = parse_ledger_text_fast(text)
+    if result is None or result["meta"]["confidence"] < settings.ledger_fast_path_min_confidence:
+        return None
+    return result
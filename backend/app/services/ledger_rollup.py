@@ -0,0 +1,159 @@
+"""
+记账月度汇总（ledger_monthly_rollups）维护
+每个 (用户, 年, 月, 分类, 货币) 一行，记录金额合计和条数
+统计接口直接读取汇总行，不再扫描用户的全部记账条目
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import Integer, cast, delete, func, extract, case, select, literal
+from .. import models
+from ..utils.db_utils import insert_for_dialect, session_dialect_name
+
+logger = logging.getLogger(__name__)
+
+# 汇总表中分类为空时使用的占位值（唯一约束中不能使用 NULL）
+NO_CATEGORY = ""
+
+
+def rollup_contribution(entry: models.LedgerEntry) -> Optional[dict]:
+    """
+    计算记账条目对月度汇总的贡献
+
+    只有已完成且金额不为空的条目计入汇总
+
+    Returns:
+        包含汇总键和金额的字典；不计入汇总时返回 None
+    """
+    if entry.status != "completed" or entry.amount is None:
+        return None
+    entry_date = entry.event_time or entry.created_at
+    if entry_date is None:
+        return None
+    amount = float(entry.amount)
+    return {
+        "user_id": entry.user_id,
+        "year": entry_date.year,
+        "month": entry_date.month,
+        "category": entry.category or NO_CATEGORY,
+        "currency": entry.currency or "CNY",
+        "amount": amount,
+        "count": 1,
+        "nonzero_count": 1 if amount != 0 else 0,
+    }
+
+
+def _upsert_statement(dialect_name: str, values: dict, sign: int):
+    """构造把 values 累加（sign=1）或扣减（sign=-1）到汇总行的 upsert 语句"""
+    table = models.LedgerMonthlyRollup.__table__
+    stmt = insert_for_dialect(dialect_name)(table).values(
+        user_id=values["user_id"],
+        year=values["year"],
+        month=values["month"],
+        category=values["category"],
+        currency=values["currency"],
+        amount=sign * values["amount"],
+        count=sign * values["count"],
+        nonzero_count=sign * values["nonzero_count"],
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "year", "month", "category", "currency"],
+        set_={
+            "amount": table.c.amount + stmt.excluded.amount,
+            "count": table.c.count + stmt.excluded.count,
+            "nonzero_count": table.c.nonzero_count + stmt.excluded.nonzero_count,
+        },
+    )
+
+
+def rollup_delta_statements(dialect_name: str, before: Optional[dict], after: Optional[dict]) -> list:
+    """
+    根据条目修改前后的贡献生成需要执行的汇总更新语句
+
+    Args:
+        dialect_name: 数据库方言名（postgresql / sqlite）
+        before: 修改前的 rollup_contribution 结果
+        after: 修改后的 rollup_contribution 结果
+    """
+    if before == after:
+        return []
+    statements = []
+    if before is not None:
+        statements.append(_upsert_statement(dialect_name, before, -1))
+    if after is not None:
+        statements.append(_upsert_statement(dialect_name, after, 1))
+    return statements
+
+
+def apply_rollup_delta_sync(session, before: Optional[dict], after: Optional[dict]):
+    """在同步会话的当前事务中更新汇总（Celery 任务使用）"""
+    for stmt in rollup_delta_statements(session_dialect_name(session), before, after):
+        session.execute(stmt)
+
+
+async def apply_rollup_delta(session, before: Optional[dict], after: Optional[dict]):
+    """在异步会话的当前事务中更新汇总（API 路由使用）"""
+    for stmt in rollup_delta_statements(session_dialect_name(session), before, after):
+        await session.execute(stmt)
+
+
+def rollup_source_query(user_id: Optional[int] = None):
+    """从 ledger_entries 重新计算汇总行的 SELECT（用于回填/重建）"""
+    entry = models.LedgerEntry
+    entry_date = func.coalesce(entry.event_time, entry.created_at)
+    year = cast(extract("year", entry_date), Integer)
+    month = cast(extract("month", entry_date), Integer)
+    category = func.coalesce(entry.category, literal(NO_CATEGORY))
+    currency = func.coalesce(entry.currency, literal("CNY"))
+    query = (
+        select(
+            entry.user_id,
+            year.label("year"),
+            month.label("month"),
+            category.label("category"),
+            currency.label("currency"),
+            func.sum(entry.amount).label("amount"),
+            func.count(entry.id).label("count"),
+            func.sum(case((entry.amount != 0, 1), else_=0)).label("nonzero_count"),
+        )
+        .where(
+            entry.status == "completed",
+            entry.amount.isnot(None),
+        )
+        .group_by(entry.user_id, year, month, category, currency)
+    )
+    if user_id is not None:
+        query = query.where(entry.user_id == user_id)
+    return query
+
+
+def rebuild_rollups(session, user_id: Optional[int] = None) -> int:
+    """
+    从记账条目重建月度汇总（同步执行，调用方负责提交）
+
+    Args:
+        session: 同步数据库会话或连接
+        user_id: 只重建指定用户，None 表示全部用户
+
+    Returns:
+        重建后的汇总行数
+    """
+    rollup = models.LedgerMonthlyRollup
+    delete_stmt = delete(rollup)
+    if user_id is not None:
+        delete_stmt = delete_stmt.where(rollup.user_id == user_id)
+    session.execute(delete_stmt)
+
+    source = rollup_source_query(user_id)
+    session.execute(
+        rollup.__table__.insert().from_select(
+            ["user_id", "year", "month", "category", "currency", "amount", "count", "nonzero_count"],
+            source,
+        )
+    )
+    count_query = select(func.count(rollup.id))
+    if user_id is not None:
+        count_query = count_query.where(rollup.user_id == user_id)
+    total = session.execute(count_query).scalar() or 0
+    logger.info(f"已重建记账月度汇总，user_id: {user_id}, 行数: {total}")
+    return total
@@ -0,0 +1,119 @@
+"""
+LLM 解析结果缓存
+以 "规范化文本 + 提示词 + 模型" 的哈希为键，把 LLM 原始 JSON 结果保存在 Redis 中。
+缓存的是校验前的原始结果，命中后重新走 normalize_llm_result，
+因此没有消费时间的输入仍会得到当前时间，而不是首次解析时的时间
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+from typing import Optional
+
+from ..config import settings
+from ..redis_client import get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "llm:ledger:"
+# 按写入时间记录缓存键的有序集合，用于限制缓存条目数
+CACHE_INDEX_KEY = "llm:ledger:index"
+CACHE_HITS_KEY = "llm:ledger:stats:hits"
+CACHE_MISSES_KEY = "llm:ledger:stats:misses"
+
+
+def normalize_cache_text(text: str) -> str:
+    """规范化输入文本：全角转半角、去首尾空白、合并连续空白、转小写"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def llm_cache_key(text: str, prompt: str, model: str) -> str:
+    """
+    计算缓存键
+
+    提示词（包含分类列表）或模型变化时键随之变化，旧结果自然失效
+    """
+    digest = hashlib.sha256()
+    for part in (model, prompt, normalize_cache_text(text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return f"{CACHE_KEY_PREFIX}{digest.hexdigest()}"
+
+
+def _cache_enabled() -> bool:
+    return settings.llm_cache_ttl > 0
+
+
+def get_cached_llm_result(key: str) -> Optional[dict]:
+    """读取缓存的 LLM 原始结果，未命中或 Redis 不可用时返回 None"""
+    if not _cache_enabled():
+        return None
+    try:
+        client = get_sync_redis()
+        raw = client.get(key)
+        client.incr(CACHE_HITS_KEY if raw is not None else CACHE_MISSES_KEY)
+        return json.loads(raw) if raw is not None else None
+    except Exception as e:
+        logger.warning(f"读取 LLM 结果缓存失败: {str(e)}")
+        return None
+
+
+def get_cached_llm_results(keys: list[str]) -> list[Optional[dict]]:
+    """批量读取缓存的 LLM 原始结果（一次 MGET），与 keys 等长；Redis 不可用时全部视为未命中"""
+    if not _cache_enabled() or not keys:
+        return [None] * len(keys)
+    try:
+        client = get_sync_redis()
+        raws = client.mget(keys)
+        hits = sum(1 for raw in raws if raw is not None)
+        pipe = client.pipeline()
+        if hits:
+            pipe.incrby(CACHE_HITS_KEY, hits)
+        if hits < len(keys):
+            pipe.incrby(CACHE_MISSES_KEY, len(keys) - hits)
+        pipe.execute()
+        return [json.loads(raw) if raw is not None else None for raw in raws]
+    except Exception as e:
+        logger.warning(f"读取 LLM 结果缓存失败: {str(e)}")
+        return [None] * len(keys)
+
+
+def set_cached_llm_result(key: str, llm_result: dict):
+    """写入 LLM 原始结果，超过 llm_cache_max_entries 时淘汰最早写入的条目"""
+    if not _cache_enabled():
+        return
+    try:
+        client = get_sync_redis()
+        pipe = client.pipeline()
+        pipe.set(key, json.dumps(llm_result, ensure_ascii=False), ex=settings.llm_cache_ttl)
+        pipe.zadd(CACHE_INDEX_KEY, {key: time.time()})
+        pipe.zcard(CACHE_INDEX_KEY)
+        size = pipe.execute()[-1]
+
+        overflow = size - settings.llm_cache_max_entries
+        if overflow > 0:
+            evicted = client.zrange(CACHE_INDEX_KEY, 0, overflow - 1)
+            if evicted:
+                pipe = client.pipeline()
+                pipe.delete(*evicted)
+                pipe.zrem(CACHE_INDEX_KEY, *evicted)
+                pipe.execute()
+    except Exception as e:
+        logger.warning(f"写入 LLM 结果缓存失败: {str(e)}")
+
+
+async def get_llm_cache_stats(redis_client) -> dict:
+    """读取缓存命中/未命中计数（API 进程使用异步 Redis 客户端）"""
+    raw_hits, raw_misses = await redis_client.mget(CACHE_HITS_KEY, CACHE_MISSES_KEY)
+    hits, misses = int(raw_hits or 0), int(raw_misses or 0)
+    size = await redis_client.zcard(CACHE_INDEX_KEY)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+        "entries": size,
+    }
@@ -0,0 +1,88 @@
+"""
+进程级 LLM 客户端注册表
+每个 Celery worker 进程在 worker_process_init 时创建一个 OpenAI 兼容客户端，
+底层 httpx 连接池保持长连接，后续分析任务复用已建立的 TCP/TLS 连接
+"""
+import logging
+import threading
+from typing import Optional
+
+import httpx
+from openai import OpenAI
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# DeepSeek API 默认地址（兼容 OpenAI 接口）
+DEFAULT_LLM_API_URL = "https://api.deepseek.com"
+
+# (api_key, base_url) -> 客户端，配置变化时会创建新的客户端
+_clients: dict[tuple[str, str], OpenAI] = {}
+_lock = threading.Lock()
+
+
+def _http_options() -> tuple[httpx.Timeout, httpx.Limits]:
+    """客户端共用的超时和连接池配置"""
+    timeout = httpx.Timeout(settings.llm_timeout, connect=settings.llm_connect_timeout)
+    limits = httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_keepalive_connections,
+        keepalive_expiry=settings.llm_keepalive_expiry,
+    )
+    return timeout, limits
+
+
+def _resolve(api_key: Optional[str], base_url: Optional[str]) -> tuple[str, str]:
+    return api_key or settings.llm_api_key, base_url or settings.llm_api_url or DEFAULT_LLM_API_URL
+
+
+def _build_client(api_key: str, base_url: str) -> OpenAI:
+    """创建带连接池、超时和重试配置的客户端"""
+    timeout, limits = _http_options()
+    http_client = httpx.Client(timeout=timeout, limits=limits)
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=timeout,
+        max_retries=settings.llm_max_retries,
+        http_client=http_client,
+    )
+
+
+def get_llm_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> OpenAI:
+    """
+    获取当前进程共享的 LLM 客户端（不存在时创建）
+
+    Args:
+        api_key: API 密钥，默认使用 settings.llm_api_key
+        base_url: API 地址，默认使用 settings.llm_api_url
+    """
+    key = _resolve(api_key, base_url)
+    api_key, base_url = key
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _build_client(api_key, base_url)
+                _clients[key] = client
+                logger.info(f"已创建 LLM 客户端，base_url: {base_url}")
+    return client
+
+
+def init_llm_client():
+    """在 worker 进程启动时预先创建客户端（未配置 API 密钥时跳过）"""
+    if settings.llm_provider and settings.llm_api_key:
+        get_llm_client()
+
+
+def close_llm_clients():
+    """关闭并清空所有客户端（worker 进程退出时调用）"""
+    with _lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"关闭 LLM 客户端失败: {str(e)}")
+        _clients.clear()
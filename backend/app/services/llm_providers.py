@@ -0,0 +1,156 @@
+"""
+LLM 提供商接口
+分析任务只依赖 LLMProvider.complete（系统提示词 + 用户输入 -> 模型输出文本），
+具体提供商（DeepSeek、其他 OpenAI 兼容接口、本地 mock）在这里实现
+
+并发控制：
+- 同步调用共享进程级信号量；Celery 使用 gevent 池时信号量和 HTTP 连接都是协程友好的，
+  一个进程可同时处理多个分析，最多 llm_max_concurrency 个请求同时等待模型
+- complete_many 用 gevent 协程池（worker 已打补丁时）或线程池并发调用 complete，
+  不创建事件循环，并发同样受 _sync_slots 限制
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from ..config import settings
+from ..utils.gevent_utils import gevent_patched
+from .llm_client import DEFAULT_LLM_API_URL, get_llm_client
+
+logger = logging.getLogger(__name__)
+
+_sync_slots = threading.BoundedSemaphore(max(1, settings.llm_max_concurrency))
+
+
+class LLMProvider:
+    """LLM 提供商基类"""
+
+    name = ""
+    model = ""
+    # 是否需要配置 LLM_API_KEY 才能使用
+    requires_api_key = True
+
+    def complete(self, system_prompt: str, user_content: str) -> str:
+        """同步调用模型，返回模型输出的文本"""
+        raise NotImplementedError
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """OpenAI Chat Completions 兼容接口"""
+
+    name = "openai"
+    default_base_url = "https://api.openai.com/v1"
+    default_model = "gpt-4o-mini"
+
+    def __init__(self, api_key: Optional[str], base_url: Optional[str] = None, model: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url or self.default_base_url
+        self.model = model or self.default_model
+
+    def _messages(self, system_prompt: str, user_content: str) -> list[dict]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def complete(self, system_prompt: str, user_content: str) -> str:
+        with _sync_slots:
+            response = get_llm_client(self.api_key, self.base_url).chat.completions.create(
+                model=self.model,
+                messages=self._messages(system_prompt, user_content),
+                stream=False,
+            )
+        return response.choices[0].message.content
+
+
+class DeepSeekProvider(OpenAICompatibleProvider):
+    """DeepSeek（OpenAI 兼容接口）"""
+
+    name = "deepseek"
+    default_base_url = DEFAULT_LLM_API_URL
+    default_model = "deepseek-chat"
+
+
+class MockLLMProvider(LLMProvider):
+    """
+    本地 mock 提供商（开发和压测使用，不访问网络）
+
+    用规则解析生成结果；llm_mock_latency 可模拟模型耗时
+    """
+
+    name = "mock"
+    model = "mock"
+    requires_api_key = False
+
+    def _result(self, user_content: str) -> str:
+        from .ledger_parser import parse_ledger_text_fast
+
+        parsed = parse_ledger_text_fast(user_content) or {"amount": None, "currency": "CNY", "category": "其他"}
+        return json.dumps({
+            "amount": parsed["amount"],
+            "currency": parsed["currency"],
+            "category": parsed["category"],
+            "description": user_content,
+        }, ensure_ascii=False)
+
+    def complete(self, system_prompt: str, user_content: str) -> str:
+        with _sync_slots:
+            if settings.llm_mock_latency > 0:
+                time.sleep(settings.llm_mock_latency)
+        return self._result(user_content)
+
+
+PROVIDERS: dict[str, type[LLMProvider]] = {
+    DeepSeekProvider.name: DeepSeekProvider,
+    OpenAICompatibleProvider.name: OpenAICompatibleProvider,
+    MockLLMProvider.name: MockLLMProvider,
+}
+
+
+def create_llm_provider(name: str, api_key: Optional[str] = None, base_url: Optional[str] = None) -> LLMProvider:
+    """
+    根据 LLM_PROVIDER 创建提供商
+
+    Raises:
+        ValueError: 不支持的提供商
+    """
+    provider_class = PROVIDERS.get(name)
+    if provider_class is None:
+        raise ValueError(f"不支持的 LLM 提供商: {name}")
+    if provider_class is MockLLMProvider:
+        return MockLLMProvider()
+    return provider_class(api_key, base_url, settings.llm_model or None)
+
+
+def complete_many(provider: LLMProvider, requests: list[tuple[str, str]]) -> list:
+    """
+    并发发送多条请求（最多 llm_max_concurrency 个同时进行）
+
+    gevent 池中用协程池，否则用线程池；每个请求走同步 complete，
+    复用进程级客户端的连接池，并发由 _sync_slots 统一限制
+
+    Args:
+        provider: LLM 提供商
+        requests: [(系统提示词, 用户输入)]
+
+    Returns:
+        与 requests 等长的列表，元素为模型输出文本，失败时为对应的异常
+    """
+    def one(request: tuple[str, str]):
+        try:
+            return provider.complete(*request)
+        except Exception as e:
+            return e
+
+    if not requests:
+        return []
+    workers = max(1, min(len(requests), settings.llm_max_concurrency))
+    if gevent_patched():
+        from gevent.pool import Pool
+
+        return Pool(workers).map(one, requests)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(one, requests))
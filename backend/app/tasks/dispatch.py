@@ -0,0 +1,75 @@
+"""
+API 进程使用的任务投递工具
+按任务名构建签名，不导入任务模块，API 进程因此不会创建 Celery 任务使用的同步数据库引擎
+"""
+from celery import chain
+
+from ..celery_app import celery_app
+from ..config import settings
+
+
+def build_ledger_pipeline(
+    entry_id: int,
+    raw_text: str | None = None,
+    image_path: str | None = None,
+    original_text: str | None = None,
+):
+    """
+    构建处理账本条目的 Celery 签名
+
+    LEDGER_PIPELINE=fused（默认）使用单个 process_ledger_entry 任务；
+    LEDGER_PIPELINE=chain 使用 OCR/分析/更新三段任务链（各阶段需要在不同队列执行时使用）
+    """
+    if settings.ledger_pipeline != "chain":
+        signature = celery_app.signature(
+            "ledger.process_entry", args=(entry_id, raw_text, image_path, original_text)
+        )
+        # 带图片的条目包含 OCR，交给 ocr 队列的 worker
+        return signature.set(queue="ocr") if image_path else signature
+    if image_path:
+        # 有图片：OCR -> 合并文本并分析 -> 更新数据库
+        return chain(
+            celery_app.signature("ocr.extract_text", args=(image_path,)),
+            celery_app.signature("ledger.merge_and_analyze", args=(original_text, entry_id)),
+            celery_app.signature("ledger.update_entry"),
+        )
+    # 只有文本：直接 LLM -> 更新数据库
+    return chain(
+        celery_app.signature("ledger.wrap_analyze_text", args=(raw_text, entry_id)),
+        celery_app.signature("ledger.update_entry"),
+    )
+
+
+def dispatch_ledger_pipeline(
+    task_id: str,
+    entry_id: int,
+    raw_text: str | None = None,
+    image_path: str | None = None,
+    original_text: str | None = None,
+    producer=None,
+) -> str:
+    """
+    使用预先生成的 task_id 投递账本处理任务
+
+    task_id 已与条目在同一事务中写入数据库，投递后不需要再回写；
+    任务链时 task_id 对应链中最后一个任务。批量投递时传入同一个 producer 复用 broker 连接
+
+    Returns:
+        task_id
+    """
+    pipeline = build_ledger_pipeline(entry_id, raw_text, image_path, original_text)
+    pipeline.apply_async(task_id=task_id, producer=producer)
+    return task_id
+
+
+def dispatch_ledger_batch(task_id: str, entry_ids: list[int], producer=None) -> str:
+    """
+    使用预先生成的 task_id 投递批量分析任务（批量导入的发件箱记录使用）
+
+    Returns:
+        task_id
+    """
+    celery_app.signature("ledger.analyze_batch", args=(entry_ids,)).apply_async(
+        task_id=task_id, producer=producer
+    )
+    return task_id
@@ -4,6 +4,7 @@ import datetime as dt
 from sqlalchemy import select
 from .. import models
 from ..db import AsyncSessionLocal
+from ..services.file_store import release_files, purge_unreferenced_blobs
 from ..celery_app import celery_app
 
 @celery_app.task
@@ -27,21 +28,24 @@ async def _cleanup_logic():
         result = await session.execute(stmt)
         files_to_delete = result.scalars().all()
         
-        if not files_to_delete:
-            return
+        if files_to_delete:
+            print(f"Found {len(files_to_delete)} orphan files to cleanup.")
             
-        print(f"Found {len(files_to_delete)} orphan files to cleanup.")
-        
-        for f in files_to_delete:
-            # 删除物理文件
-            try:
-                if os.path.exists(f.file_path):
-                    os.remove(f.file_path)
-                    print(f"Deleted file: {f.file_path}")
-            except Exception as e:
-                print(f"Error deleting file {f.file_path}: {e}")
+            # 释放对 blob 的引用；没有 content_hash 的旧记录独占物理文件，直接删除
+            legacy_paths = set(await release_files(session, files_to_delete))
+            for f in files_to_delete:
+                if f.file_path in legacy_paths:
+                    try:
+                        if os.path.exists(f.file_path):
+                            os.remove(f.file_path)
+                            print(f"Deleted file: {f.file_path}")
+                    except Exception as e:
+                        print(f"Error deleting file {f.file_path}: {e}")
+                
+                # 删除数据库记录
+                await session.delete(f)
             
-            # 删除数据库记录
-            await session.delete(f)
+            await session.commit()
         
-        await session.commit()
+        # 最后一个引用释放后才删除 blob（包括删除笔记时释放的引用）
+        await purge_unreferenced_blobs(session)
@@ -1,23 +1,33 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import logging
 import json
 import re
 import math
-from openai import OpenAI
-from sqlalchemy import create_engine
+import time
+import uuid
+from sqlalchemy import exists
 from sqlalchemy.orm import sessionmaker, Session
 from ..celery_app import celery_app
 from ..config import settings
+from ..db import create_sync_engine
 from .. import models
+from .ocr_tasks import extract_text_from_image_task
+from ..services.ledger_rollup import rollup_contribution, apply_rollup_delta_sync
+from ..services.ledger_events import publish_ledger_event
+from ..services.ledger_parser import try_fast_parse
+from ..services.llm_providers import LLMProvider, create_llm_provider, complete_many
+from ..services.llm_cache import llm_cache_key, get_cached_llm_result, get_cached_llm_results, set_cached_llm_result
 
 
 logger = logging.getLogger(__name__)
 
-# 创建同步数据库引擎用于 Celery 任务
-sync_db_url = settings.database_url.replace("+asyncpg", "+psycopg2")
-sync_engine = create_engine(sync_db_url, pool_pre_ping=True)
+# 创建同步数据库引擎用于 Celery 任务（连接池参数见 Settings.db_*）
+sync_engine = create_sync_engine()
 SyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
 
+# DeepSeek 使用的模型名
+LLM_MODEL = "deepseek-chat"
+
 
 def parse_utc_time(time_str: str | None) -> str | None:
     """
@@ -56,6 +66,104 @@ def parse_utc_time(time_str: str | None) -> str | None:
         return None
 
 
+def normalize_llm_result(llm_result: dict, text: str, model: str = LLM_MODEL) -> dict:
+    """
+    校验并修正 LLM 返回的单条解析结果（单条分析和批量分析共用）
+
+    Args:
+        llm_result: LLM 返回的 JSON 对象
+        text: 对应的用户原文
+        model: 生成结果的模型名（记录在 meta 中）
+
+    Returns:
+        分析结果字典，包含 amount, currency, category, merchant, event_time, meta
+    """
+    from ..constants import LEDGER_CATEGORIES
+
+    # 处理 event_time：验证是否为严格的 UTC 时间格式
+    llm_event_time = llm_result.get("event_time")
+    validated_event_time = parse_utc_time(llm_event_time)
+
+    # 如果验证失败或为空，使用当前 UTC 时间
+    if validated_event_time is None:
+        validated_event_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        if llm_event_time:
+            logger.info(f"LLM 返回的时间格式无效 ({llm_event_time})，使用当前 UTC 时间: {validated_event_time}")
+
+    # 验证并修正分类
+    category = llm_result.get("category", "其他")
+    if category not in LEDGER_CATEGORIES:
+        # 如果 AI 返回的分类不在固定列表中，使用"其他"
+        logger.warning(f"AI 返回的分类 '{category}' 不在固定列表中，使用'其他'")
+        category = "其他"
+
+    # 验证并修正金额：确保为正数
+    raw_amount = llm_result.get("amount")
+    amount: float | None = None
+    if isinstance(raw_amount, bool):
+        amount = None
+    elif isinstance(raw_amount, (int, float)):
+        amount = float(raw_amount)
+    elif isinstance(raw_amount, str):
+        cleaned = raw_amount.strip()
+        cleaned = cleaned.replace(",", "")
+        cleaned = re.sub(r"[^\d\.\-+]", "", cleaned)
+        try:
+            amount = float(cleaned)
+        except ValueError:
+            amount = None
+
+    if amount is None or not math.isfinite(amount) or amount == 0:
+        logger.warning(f"LLM 返回的金额无效 ({raw_amount})，使用默认值 None")
+        amount = None
+    elif amount < 0:
+        logger.warning(f"LLM 返回的金额为负数 ({raw_amount})，取绝对值")
+        amount = abs(amount)
+
+    # 验证并修正货币单位
+    currency = llm_result.get("currency", "CNY")
+    if isinstance(currency, str):
+        parts = currency.strip().upper().split()
+        currency = parts[0] if parts else "CNY"
+    if currency not in ["CNY", "USD", "EUR", "JPY"]:
+        logger.warning(f"LLM 返回的货币单位 '{currency}' 不在固定列表中，使用默认值 CNY")
+        currency = "CNY"
+
+    # 映射字段到需要的格式
+    result = {
+        "amount": amount,
+        "currency": currency,
+        "category": category,
+        "merchant": None,  # 可以从 description 中提取，暂时留空
+        "event_time": validated_event_time,
+        "meta": {
+            "model": model,
+            "text_length": len(text),
+            "description": llm_result.get("description", text),
+        },
+    }
+    return result
+
+
+def build_ledger_prompt() -> str:
+    """单条解析的系统提示词（也用于计算缓存键，批量分析与单条分析共用缓存）"""
+    from ..constants import LEDGER_CATEGORIES
+
+    return f"""
+你是记账助手。请把下面用户输入的消费或收款信息解析成 JSON，不要解释，直接输出 JSON，字段如下：
+- amount: 金额数字，数字类型 金额必须为正数
+- currency: 货币单位，从CNY、USD、EUR、JPY中选择 默认CNY
+- category: 消费类别，必须是以下固定分类之一：{', '.join(LEDGER_CATEGORIES)}。请根据消费内容选择最合适的分类，如果都不合适则选择"其他"。
+- description: 用户原文文本
+- event_time: 消费时间,没有就不填写,有则填写utc时间格式即YYYY-MM-DDTHH:MM:SSZ
+"""
+
+
+def ledger_cache_key(text: str, provider: LLMProvider) -> str:
+    """记账文本的 LLM 结果缓存键"""
+    return llm_cache_key(text, build_ledger_prompt(), f"{provider.name}:{provider.model}")
+
+
 @celery_app.task(name="ledger.merge_and_analyze")
 def merge_text_and_analyze(ocr_text: str, original_text: str | None = None, entry_id: int | None = None) -> dict:
     """
@@ -68,6 +176,9 @@ def merge_text_and_analyze(ocr_text: str, original_text: str | None = None, entr
     Returns:
         LLM 分析结果，包含合并后的文本（在 meta 中）
     """
+    if entry_id is not None:
+        mark_entry_processing(entry_id)
+
     # 合并文本
     if original_text:
         processed_text = "备注remark: "" + original_text + """
@@ -103,16 +214,18 @@ def wrap_analyze_text_with_entry_id(text: str, entry_id: int) -> dict:
     Returns:
         LLM 分析结果，包含 entry_id
     """
+    mark_entry_processing(entry_id)
     result = analyze_ledger_text(text)
     result["_entry_id"] = entry_id
     return result
 
 
-@celery_app.task(name="ledger.analyze_text")
+@celery_app.task(name="ledger.analyze_text", ignore_result=False)
 def analyze_ledger_text(text: str) -> dict:
     """
     Celery 任务：分析账本文本
     这个任务会在后台异步执行，调用 LLM 服务分析文本
+    （ledger_ai.analyze 需要读取返回值，因此保留结果，结果在 CELERY_RESULT_EXPIRES 秒后过期）
     
     Args:
         text: 要分析的文本
@@ -121,6 +234,12 @@ def analyze_ledger_text(text: str) -> dict:
         分析结果字典，包含 amount, currency, category, merchant, event_time, meta
     """
     try:
+        # 结构简单的输入直接用规则解析，不调用 LLM
+        fast_result = try_fast_parse(text)
+        if fast_result is not None:
+            logger.info(f"规则解析命中，置信度: {fast_result['meta']['confidence']}")
+            return fast_result
+        
         llm_provider = settings.llm_provider if settings.llm_provider else None
         if not llm_provider:
             # LLM 未配置时，返回默认结果，让用户可以手动编辑
@@ -139,163 +258,79 @@ def analyze_ledger_text(text: str) -> dict:
                 },
             }
         
-        #API提供商是Deepseek的实现
-        if llm_provider == "deepseek":        
-            logger.info(f"开始 LLM 分析任务，文本长度: {len(text)}")
-            
-            # 调用 Deepseek 进行分析
-            # 获取 API 配置，如果没有配置则使用默认的 DeepSeek API
-            api_key = settings.llm_api_key if settings.llm_api_key else None
-            base_url = settings.llm_api_url if settings.llm_api_url else "https://api.deepseek.com"
+        # 根据 LLM_PROVIDER 创建提供商（不支持的提供商抛出 ValueError）
+        api_key = settings.llm_api_key if settings.llm_api_key else None
+        base_url = settings.llm_api_url if settings.llm_api_url else None
+        provider = create_llm_provider(llm_provider, api_key, base_url)
+        logger.info(f"开始 LLM 分析任务，提供商: {provider.name}，文本长度: {len(text)}")
+        
+        if provider.requires_api_key and not api_key:
+            # API 密钥未配置，返回默认结果
+            logger.warning("LLM_API_KEY 未配置，返回默认结果")
+            return {
+                "amount": None,
+                "currency": "CNY",
+                "category": "其他",
+                "merchant": None,
+                "event_time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "meta": {
+                    "model": "none",
+                    "text_length": len(text),
+                    "description": text,
+                    "note": "LLM_API_KEY 未配置，请手动填写金额和分类"
+                },
+            }
+        
+        hint = build_ledger_prompt()
+        
+        # 相同输入（规范化后）和相同提示词直接使用缓存的 LLM 结果
+        cache_key = ledger_cache_key(text, provider)
+        cached_result = get_cached_llm_result(cache_key)
+        if cached_result is not None:
+            result = normalize_llm_result(cached_result, text, provider.model)
+            result["meta"]["cached"] = True
+            logger.info("LLM 结果缓存命中")
+            return result
+        
+        # 调用 LLM（捕获所有可能的错误）
+        try:
+            response_content = provider.complete(hint, text).strip()
             
-            if not api_key:
-                # API 密钥未配置，返回默认结果
-                logger.warning("LLM_API_KEY 未配置，返回默认结果")
-                return {
-                    "amount": None,
-                    "currency": "CNY",
-                    "category": "其他",
-                    "merchant": None,
-                    "event_time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-                    "meta": {
-                        "model": "none",
-                        "text_length": len(text),
-                        "description": text,
-                        "note": "LLM_API_KEY 未配置，请手动填写金额和分类"
-                    },
-                }
+            # 尝试提取 JSON（可能包含 markdown 代码块）
+            if response_content.startswith("```"):
+                # 移除 markdown 代码块标记
+                lines = response_content.split("\n")
+                response_content = "\n".join(lines[1:-1]) if len(lines) > 2 else response_content
             
-            # 创建客户端（DeepSeek API兼容 OpenAI）
-            client = OpenAI(
-                api_key=api_key,
-                base_url=base_url
-            )
+            # 解析 JSON
+            try:
+                llm_result = json.loads(response_content)
+            except json.JSONDecodeError as e:
+                logger.error(f"解析 LLM 返回的 JSON 失败: {response_content}, 错误: {str(e)}")
+                raise ValueError(f"LLM 返回的 JSON 格式无效: {str(e)}")
             
+            result = normalize_llm_result(llm_result, text, provider.model)
+            set_cached_llm_result(cache_key, llm_result)
 
-            # 导入分类常量
-            from ..constants import LEDGER_CATEGORIES
-            
-            hint = f"""
-你是记账助手。请把下面用户输入的消费或收款信息解析成 JSON，不要解释，直接输出 JSON，字段如下：
-- amount: 金额数字，数字类型 金额必须为正数
-- currency: 货币单位，从CNY、USD、EUR、JPY中选择 默认CNY
-- category: 消费类别，必须是以下固定分类之一：{', '.join(LEDGER_CATEGORIES)}。请根据消费内容选择最合适的分类，如果都不合适则选择"其他"。
-- description: 用户原文文本
-- event_time: 消费时间,没有就不填写,有则填写utc时间格式即YYYY-MM-DDTHH:MM:SSZ
-"""
-            
-            # 调用 DeepSeek API（捕获所有可能的错误）
-            try:
-                response = client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[
-                        {"role": "system", "content": hint},
-                        {"role": "user", "content": text},
-                    ],
-                    stream=False
-                )
-                
-                # 解析返回的 JSON
-                response_content = response.choices[0].message.content.strip()
-                
-                # 尝试提取 JSON（可能包含 markdown 代码块）
-                if response_content.startswith("```"):
-                    # 移除 markdown 代码块标记
-                    lines = response_content.split("\n")
-                    response_content = "\n".join(lines[1:-1]) if len(lines) > 2 else response_content
-                
-                # 解析 JSON
-                try:
-                    llm_result = json.loads(response_content)
-                except json.JSONDecodeError as e:
-                    logger.error(f"解析 LLM 返回的 JSON 失败: {response_content}, 错误: {str(e)}")
-                    raise ValueError(f"LLM 返回的 JSON 格式无效: {str(e)}")
-                
-                # 处理 event_time：验证是否为严格的 UTC 时间格式
-                llm_event_time = llm_result.get("event_time")
-                validated_event_time = parse_utc_time(llm_event_time)
-                
-                # 如果验证失败或为空，使用当前 UTC 时间
-                if validated_event_time is None:
-                    validated_event_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-                    if llm_event_time:
-                        logger.info(f"LLM 返回的时间格式无效 ({llm_event_time})，使用当前 UTC 时间: {validated_event_time}")
-                
-                # 验证并修正分类
-                category = llm_result.get("category", "其他")
-                if category not in LEDGER_CATEGORIES:
-                    # 如果 AI 返回的分类不在固定列表中，使用"其他"
-                    logger.warning(f"AI 返回的分类 '{category}' 不在固定列表中，使用'其他'")
-                    category = "其他"
-                
-                # 验证并修正金额：确保为正数
-                raw_amount = llm_result.get("amount")
-                amount: float | None = None
-                if isinstance(raw_amount, bool):
-                    amount = None
-                elif isinstance(raw_amount, (int, float)):
-                    amount = float(raw_amount)
-                elif isinstance(raw_amount, str):
-                    cleaned = raw_amount.strip()
-                    cleaned = cleaned.replace(",", "")
-                    cleaned = re.sub(r"[^\d\.\-+]", "", cleaned)
-                    try:
-                        amount = float(cleaned)
-                    except ValueError:
-                        amount = None
-
-                if amount is None or not math.isfinite(amount) or amount == 0:
-                    logger.warning(f"LLM 返回的金额无效 ({raw_amount})，使用默认值 None")
-                    amount = None
-                elif amount < 0:
-                    logger.warning(f"LLM 返回的金额为负数 ({raw_amount})，取绝对值")
-                    amount = abs(amount)
-                
-                # 验证并修正货币单位
-                currency = llm_result.get("currency", "CNY")
-                if isinstance(currency, str):
-                    currency = currency.strip().upper().split()[0]
-                if currency not in ["CNY", "USD", "EUR", "JPY"]:
-                    logger.warning(f"LLM 返回的货币单位 '{currency}' 不在固定列表中，使用默认值 CNY")
-                    currency = "CNY"
-                
-                # 映射字段到需要的格式
-                result = {
-                    "amount": amount,
-                    "currency": currency,
-                    "category": category,
-                    "merchant": None,  # 可以从 description 中提取，暂时留空
-                    "event_time": validated_event_time,
-                    "meta": {
-                        "model": "deepseek-chat",
-                        "text_length": len(text),
-                        "description": llm_result.get("description", text),
-                    },
-                }
-
-                logger.info(f"LLM 分析任务完成")
-                return result
-            except Exception as api_error:
-                # API 调用失败（认证失败、网络错误、JSON 解析失败等），返回默认结果
-                error_msg = str(api_error)
-                logger.error(f"LLM API 调用失败: {error_msg}，返回默认结果")
-                return {
-                    "amount": None,
-                    "currency": "CNY",
-                    "category": "其他",
-                    "merchant": None,
-                    "event_time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-                    "meta": {
-                        "model": "none",
-                        "text_length": len(text),
-                        "description": text,
-                        "note": f"LLM API 调用失败，请手动填写金额和分类。错误: {error_msg[:100]}"
-                    },
-                }
-        # elif:
-            #其他API提供商的实现 暂时留空  
-        else:
-            raise ValueError(f"不支持的 LLM 提供商: {llm_provider}")
+            logger.info(f"LLM 分析任务完成")
+            return result
+        except Exception as api_error:
+            # API 调用失败（认证失败、网络错误、JSON 解析失败等），返回默认结果
+            error_msg = str(api_error)
+            logger.error(f"LLM API 调用失败: {error_msg}，返回默认结果")
+            return {
+                "amount": None,
+                "currency": "CNY",
+                "category": "其他",
+                "merchant": None,
+                "event_time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "meta": {
+                    "model": "none",
+                    "text_length": len(text),
+                    "description": text,
+                    "note": f"LLM API 调用失败，请手动填写金额和分类。错误: {error_msg[:100]}"
+                },
+            }
     except Exception as e:
         logger.error(f"LLM 分析任务失败: {str(e)}")
         raise
@@ -306,6 +341,7 @@ def update_ledger_entry(
     ai_result: dict,
     entry_id: int | None = None,
     original_text: str | None = None,
+    timings: dict | None = None,
 ) -> dict:
     """
     Celery 任务：更新账本条目
@@ -314,10 +350,12 @@ def update_ledger_entry(
         ai_result: LLM 分析结果（可能包含 _entry_id 和 _original_text）
         entry_id: 账本条目 ID（如果不在 ai_result 中）
         original_text: 原始文本（用于合并文本的情况，如果不在 ai_result 中）
+        timings: 融合任务各阶段耗时（毫秒），提交前补充 update_ms、total_ms 并写入 meta.timings
         
     Returns:
         更新后的条目信息
     """
+    update_started = time.perf_counter()
     # 如果 ai_result 中包含 _entry_id，优先使用
     if "_entry_id" in ai_result:
         entry_id = ai_result.pop("_entry_id")
@@ -336,6 +374,9 @@ def update_ledger_entry(
         if not entry:
             raise ValueError(f"账本条目 {entry_id} 不存在")
         
+        # 记录更新前对月度汇总的贡献（正常情况下条目尚未完成，贡献为空）
+        rollup_before = rollup_contribution(entry)
+        
         # 如果有原始文本，需要合并
         if original_text and ai_result.get("meta", {}).get("description"):
             # 检查是否需要合并（OCR + 原始文本的情况）
@@ -355,20 +396,32 @@ def update_ledger_entry(
         
         # 导入分类常量并验证
         from ..constants import LEDGER_CATEGORIES
-        
+
+        # 导入的条目以账单中的金额、币种、时间和商户为准，分析只补充分类（以及缺失的字段）
+        imported = is_imported_entry(entry)
+
         # 更新条目
-        entry.amount = ai_result.get("amount")
-        entry.currency = ai_result.get("currency", "CNY")
-        
+        if not (imported and entry.amount is not None):
+            entry.amount = ai_result.get("amount")
+            entry.currency = ai_result.get("currency", "CNY")
+
         # 验证并修正分类
         category = ai_result.get("category")
         if category and category not in LEDGER_CATEGORIES:
             logger.warning(f"AI 返回的分类 '{category}' 不在固定列表中，使用'其他'")
             category = "其他"
         entry.category = category
-        entry.merchant = ai_result.get("merchant")
-        entry.event_time = event_time or datetime.utcnow()
-        entry.meta = ai_result.get("meta")
+        if not (imported and entry.merchant):
+            entry.merchant = ai_result.get("merchant")
+        if not (imported and entry.event_time is not None):
+            entry.event_time = event_time or datetime.utcnow()
+        meta = ai_result.get("meta") or {}
+        if timings is not None:
+            # update_ms 统计到提交之前（查询条目和应用结果），total_ms 为各阶段之和
+            timings["update_ms"] = round((time.perf_counter() - update_started) * 1000, 1)
+            timings["total_ms"] = round(sum(value for name, value in timings.items() if name != "total_ms"), 1)
+            meta = ai_result["meta"] = {**meta, "timings": dict(timings)}
+        entry.meta = {**meta, "source": "import"} if imported else ai_result.get("meta")
         entry.status = "completed"
         
         # 更新 raw_text（优先使用 meta 中的 raw_text，否则使用 description）
@@ -378,8 +431,12 @@ def update_ledger_entry(
         elif meta.get("description") and not entry.raw_text:
             entry.raw_text = meta["description"]
         
+        # 与条目更新在同一事务中维护月度汇总
+        apply_rollup_delta_sync(session, rollup_before, rollup_contribution(entry))
+        
         session.commit()
         session.refresh(entry)
+        publish_ledger_event(entry)
         
         logger.info(f"账本条目 {entry_id} 更新完成")
         return {"status": "completed", "entry_id": entry_id}
@@ -387,13 +444,423 @@ def update_ledger_entry(
         logger.error(f"更新账本条目失败: {str(e)}")
         session.rollback()
         # 更新状态为失败
+        mark_entry_failed(session, entry_id)
+        raise
+    finally:
+        session.close()
+
+
+def is_imported_entry(entry: models.LedgerEntry) -> bool:
+    """条目是否来自账单导入（导入时 meta.source 为 import）"""
+    return isinstance(entry.meta, dict) and entry.meta.get("source") == "import"
+
+
+def mark_entry_processing(entry_id: int) -> bool:
+    """
+    任务开始执行时把条目标记为 processing 并刷新 updated_at
+
+    回收任务据此区分已经开始执行的条目和仍在队列中等待的条目
+
+    Returns:
+        条目是否仍待处理（已完成、已失败或已删除时返回 False）
+    """
+    session: Session = SyncSessionLocal()
+    try:
+        entry = (
+            session.query(models.LedgerEntry)
+            .filter(
+                models.LedgerEntry.id == entry_id,
+                models.LedgerEntry.status.in_(["pending", "processing"]),
+            )
+            .first()
+        )
+        if entry is None:
+            return False
+        entry.status = "processing"
+        entry.updated_at = models.utc_now()
+        session.commit()
+        publish_ledger_event(entry)
+        return True
+    finally:
+        session.close()
+
+
+def mark_entry_failed(session: Session, entry_id: int):
+    """把条目标记为失败（同时从月度汇总中扣除），出错只记录日志"""
+    try:
+        entry = session.query(models.LedgerEntry).filter(models.LedgerEntry.id == entry_id).first()
+        if entry:
+            apply_rollup_delta_sync(session, rollup_contribution(entry), None)
+            entry.status = "failed"
+            session.commit()
+            publish_ledger_event(entry)
+    except Exception as update_error:
+        logger.error(f"更新失败状态时出错: {str(update_error)}")
+
+
+@celery_app.task(name="ledger.process_entry")
+def process_ledger_entry(
+    entry_id: int,
+    raw_text: str | None = None,
+    image_path: str | None = None,
+    original_text: str | None = None,
+) -> dict:
+    """
+    Celery 任务：在一次任务调用中完成 OCR -> 合并文本 -> 分析 -> 更新数据库
+
+    与任务链相比省去中间结果的 broker 往返、结果后端写入和序列化；
+    开始时把条目标记为 processing，各阶段耗时（ocr_ms、analyze_ms、update_ms、total_ms）
+    随结果写入条目 meta.timings（毫秒）；条目已不再待处理时跳过
+
+    Args:
+        entry_id: 账本条目 ID
+        raw_text: 用户输入的文本（纯文本记账）
+        image_path: 图片路径（图片记账）
+        original_text: 与图片一起提交的文本
+
+    Returns:
+        更新后的条目信息和各阶段耗时
+    """
+    if not mark_entry_processing(entry_id):
+        logger.info(f"账本条目 {entry_id} 已不需要处理，跳过")
+        return {"status": "skipped", "entry_id": entry_id}
+
+    timings: dict[str, float] = {}
+    try:
+        if image_path:
+            stage_started = time.perf_counter()
+            ocr_text = extract_text_from_image_task(image_path)
+            timings["ocr_ms"] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+            stage_started = time.perf_counter()
+            ai_result = merge_text_and_analyze(ocr_text, original_text)
+        else:
+            stage_started = time.perf_counter()
+            ai_result = analyze_ledger_text(raw_text or "")
+        timings["analyze_ms"] = round((time.perf_counter() - stage_started) * 1000, 1)
+    except Exception as e:
+        logger.error(f"账本条目 {entry_id} 处理失败: {str(e)}")
+        session: Session = SyncSessionLocal()
         try:
-            entry = session.query(models.LedgerEntry).filter(models.LedgerEntry.id == entry_id).first()
-            if entry:
+            mark_entry_failed(session, entry_id)
+        finally:
+            session.close()
+        raise
+
+    result = update_ledger_entry(ai_result, entry_id=entry_id, timings=timings)
+    logger.info(f"账本条目 {entry_id} 处理完成，耗时: {timings}")
+    return {**result, "timings": timings}
+
+
+def chunk_batch_texts(items: list[tuple[int, str]], max_size: int, max_chars: int) -> list[list[tuple[int, str]]]:
+    """
+    按条目数和文本总长度把 (entry_id, text) 分组，每组对应一次模型调用
+
+    单条文本超过 max_chars 时单独成组
+    """
+    batches: list[list[tuple[int, str]]] = []
+    current: list[tuple[int, str]] = []
+    current_chars = 0
+    for item in items:
+        text_len = len(item[1] or "")
+        if current and (len(current) >= max_size or current_chars + text_len > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(item)
+        current_chars += text_len
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_batch_prompt(texts: list[str]) -> tuple[str, str]:
+    """构造批量解析的系统提示词和用户输入（JSON 数组）"""
+    from ..constants import LEDGER_CATEGORIES
+
+    hint = f"""
+你是记账助手。用户会给出一个 JSON 数组，每个元素包含 index 和 text 两个字段，text 是一条消费或收款信息。
+请逐条解析，直接输出 JSON 数组，不要解释。数组中每个元素对应一条输入，字段如下：
+- index: 对应输入的 index，原样返回
+- amount: 金额数字，数字类型 金额必须为正数
+- currency: 货币单位，从CNY、USD、EUR、JPY中选择 默认CNY
+- category: 消费类别，必须是以下固定分类之一：{', '.join(LEDGER_CATEGORIES)}。请根据消费内容选择最合适的分类，如果都不合适则选择"其他"。
+- description: 用户原文文本
+- event_time: 消费时间,没有就不填写,有则填写utc时间格式即YYYY-MM-DDTHH:MM:SSZ
+"""
+    payload = json.dumps([{"index": i, "text": text} for i, text in enumerate(texts)], ensure_ascii=False)
+    return hint, payload
+
+
+def parse_batch_items(response_content: str, count: int) -> list[dict | None]:
+    """
+    把批量结果按 index 还原为与输入等长的原始结果列表（未校验，用于写入缓存）
+
+    Returns:
+        与输入等长的列表；模型未返回或返回无效的元素为 None
+    """
+    response_content = response_content.strip()
+    if response_content.startswith("```"):
+        lines = response_content.split("\n")
+        response_content = "\n".join(lines[1:-1]) if len(lines) > 2 else response_content
+
+    llm_results = json.loads(response_content)
+    if not isinstance(llm_results, list):
+        raise ValueError("LLM 批量结果不是 JSON 数组")
+
+    items: list[dict | None] = [None] * count
+    for position, llm_result in enumerate(llm_results):
+        if not isinstance(llm_result, dict):
+            continue
+        index = llm_result.pop("index", position)
+        if not isinstance(index, int) or not 0 <= index < count or items[index] is not None:
+            logger.warning(f"LLM 批量结果中的 index 无效: {index}")
+            continue
+        items[index] = llm_result
+    return items
+
+
+def parse_batch_response(response_content: str, texts: list[str], model: str = LLM_MODEL) -> list[dict | None]:
+    """
+    解析批量结果并逐条校验
+
+    Returns:
+        与 texts 等长的结果列表；模型未返回或返回无效的元素为 None，由调用方单独重试
+    """
+    items = parse_batch_items(response_content, len(texts))
+    return [
+        normalize_llm_result(item, text, model) if item is not None else None
+        for item, text in zip(items, texts)
+    ]
+
+
+def analyze_ledger_texts_batch(texts: list[str], provider: LLMProvider | None = None) -> list[dict | None]:
+    """
+    一次模型调用解析多条记账文本
+
+    Args:
+        texts: 用户原文列表
+        provider: LLM 提供商，默认根据 LLM_PROVIDER 创建
+
+    Returns:
+        与 texts 等长的结果列表；模型未返回或返回无效的元素为 None，由调用方单独重试
+    """
+    provider = provider or create_llm_provider(settings.llm_provider, settings.llm_api_key, settings.llm_api_url)
+    hint, payload = build_batch_prompt(texts)
+    return parse_batch_response(provider.complete(hint, payload), texts, provider.model)
+
+
+def _batch_provider() -> LLMProvider | None:
+    """批量分析使用的提供商；未配置 LLM 或缺少 API 密钥时返回 None（逐条走默认处理）"""
+    if not settings.llm_provider:
+        return None
+    try:
+        provider = create_llm_provider(settings.llm_provider, settings.llm_api_key, settings.llm_api_url)
+    except ValueError as e:
+        logger.error(str(e))
+        return None
+    if provider.requires_api_key and not settings.llm_api_key:
+        return None
+    return provider
+
+
+@celery_app.task(name="ledger.analyze_batch", bind=True)
+def analyze_ledger_batch(self, entry_ids: list[int]) -> dict:
+    """
+    Celery 任务：批量分析待处理的账本条目并逐条更新
+
+    规则解析能处理的条目和 LLM 结果缓存命中的条目不进入批次（缓存与单条分析共用）；
+    其余条目按 ledger_batch_size / ledger_batch_max_chars 分组，每组一次模型调用，
+    各组请求并发发送（最多 llm_max_concurrency 个），批量结果逐条写入缓存；
+    批量结果中缺失的条目（或整组调用失败时）退回单条分析，结果交给 update_ledger_entry 写回
+
+    Args:
+        entry_ids: 账本条目 ID 列表
+
+    Returns:
+        处理统计信息
+    """
+    session: Session = SyncSessionLocal()
+    try:
+        entries = (
+            session.query(models.LedgerEntry)
+            .filter(
+                models.LedgerEntry.id.in_(entry_ids),
+                models.LedgerEntry.status.in_(["pending", "processing"]),
+            )
+            .order_by(models.LedgerEntry.id)
+            .all()
+        )
+        for entry in entries:
+            entry.status = "processing"
+            entry.task_id = self.request.id
+        session.commit()
+        items = [(entry.id, entry.raw_text or "") for entry in entries]
+        for entry in entries:
+            publish_ledger_event(entry)
+    finally:
+        session.close()
+
+    stats = {
+        "entries": len(items), "batches": 0, "fast_path": 0, "cached": 0, "llm_calls": 0, "fallbacks": 0, "failed": 0,
+    }
+
+    def write_back(entry_id: int, result: dict):
+        try:
+            update_ledger_entry(result, entry_id=entry_id)
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error(f"批量分析写回条目 {entry_id} 失败: {str(e)}")
+
+    # 规则解析能处理的条目不进入 LLM 批次
+    llm_items = []
+    for entry_id, text in items:
+        fast_result = try_fast_parse(text)
+        if fast_result is not None:
+            stats["fast_path"] += 1
+            write_back(entry_id, fast_result)
+        else:
+            llm_items.append((entry_id, text))
+
+    provider = _batch_provider()
+    cache_keys: dict[int, str] = {}
+    if provider is not None and llm_items:
+        # 一次 MGET 读取缓存，命中的条目不再发送给模型
+        keys = [ledger_cache_key(text, provider) for _, text in llm_items]
+        uncached = []
+        for (entry_id, text), key, cached_result in zip(llm_items, keys, get_cached_llm_results(keys)):
+            if cached_result is None:
+                cache_keys[entry_id] = key
+                uncached.append((entry_id, text))
+                continue
+            stats["cached"] += 1
+            result = normalize_llm_result(cached_result, text, provider.model)
+            result["meta"]["cached"] = True
+            write_back(entry_id, result)
+        llm_items = uncached
+
+    batches = chunk_batch_texts(llm_items, settings.ledger_batch_size, settings.ledger_batch_max_chars)
+    stats["batches"] = len(batches)
+    logger.info(
+        f"开始批量分析账本条目，条目数: {len(items)}, 规则解析: {stats['fast_path']}, "
+        f"缓存命中: {stats['cached']}, 分组数: {len(batches)}"
+    )
+
+    # 多条目的分组并发调用模型
+    batch_results: dict[int, list[dict | None]] = {}
+    if provider is not None:
+        multi = [(position, batch) for position, batch in enumerate(batches) if len(batch) > 1]
+        prompts = [build_batch_prompt([text for _, text in batch]) for _, batch in multi]
+        stats["llm_calls"] += len(prompts)
+        for (position, batch), response in zip(multi, complete_many(provider, prompts)):
+            texts = [text for _, text in batch]
+            if isinstance(response, BaseException):
+                logger.error(f"批量 LLM 调用失败，退回单条分析: {str(response)}")
+                continue
+            try:
+                raw_items = parse_batch_items(response, len(texts))
+            except Exception as e:
+                logger.error(f"解析批量 LLM 结果失败，退回单条分析: {str(e)}")
+                continue
+            results = []
+            for (entry_id, text), raw_item in zip(batch, raw_items):
+                if raw_item is None:
+                    results.append(None)
+                    continue
+                set_cached_llm_result(cache_keys[entry_id], raw_item)
+                results.append(normalize_llm_result(raw_item, text, provider.model))
+            batch_results[position] = results
+
+    for position, batch in enumerate(batches):
+        results = batch_results.get(position, [None] * len(batch))
+        for (entry_id, text), result in zip(batch, results):
+            if result is None:
+                if provider is not None:
+                    stats["llm_calls"] += 1
+                    if len(batch) > 1:
+                        stats["fallbacks"] += 1
+                result = analyze_ledger_text(text)
+            write_back(entry_id, result)
+
+    logger.info(f"批量分析完成: {stats}")
+    return stats
+
+
+@celery_app.task(name="ledger.reap_stale_entries")
+def reap_stale_entries() -> dict:
+    """
+    Celery 定时任务：回收长时间停留在 processing 的条目
+
+    任务开始执行时把条目标记为 processing 并刷新 updated_at，worker 被杀或任务超时时不会再更新。
+    processing 超过 LEDGER_STALE_AFTER_MINUTES（大于任务硬超时）仍未完成的条目，
+    生成新的 task_id 写入发件箱重新投递；重新投递次数超过 LEDGER_MAX_REDISPATCH
+    或缺少可重放的输入时标记为 failed。
+    pending 条目的任务还在 broker 中排队（队列积压时可能等待很久），不在这里处理；
+    发件箱中仍未投递的条目由中继负责
+
+    Returns:
+        统计信息：stale（卡住的条目数）、redispatched、failed
+    """
+    stats = {"stale": 0, "redispatched": 0, "failed": 0}
+    entry_model = models.LedgerEntry
+    outbox = models.LedgerTaskOutbox
+    cutoff = models.utc_now() - timedelta(minutes=settings.ledger_stale_after_minutes)
+
+    session: Session = SyncSessionLocal()
+    try:
+        unsent = exists().where(
+            outbox.entry_id == entry_model.id,
+            outbox.sent_at.is_(None),
+            outbox.attempts < settings.ledger_outbox_max_attempts,
+        )
+        stale = (
+            session.query(entry_model)
+            .filter(
+                entry_model.status == "processing",
+                entry_model.updated_at < cutoff,
+                ~unsent,
+            )
+            .order_by(entry_model.updated_at)
+            .limit(settings.ledger_reaper_batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        stats["stale"] = len(stale)
+        if not stale:
+            return stats
+
+        # 每个条目最近一次投递的输入（图片路径、原始文本只保存在发件箱中）
+        payloads = {
+            row.entry_id: row.payload
+            for row in session.query(outbox)
+            .filter(outbox.entry_id.in_([entry.id for entry in stale]))
+            .order_by(outbox.id)
+        }
+
+        failed = []
+        for entry in stale:
+            payload = payloads.get(entry.id) or {"raw_text": entry.raw_text or None, "image_path": None, "original_text": None}
+            # 批量分析（导入）的 payload 不含输入，任务从数据库读取条目
+            replayable = payload.get("batch") or payload.get("raw_text") or payload.get("image_path")
+            if entry.redispatch_attempts >= settings.ledger_max_redispatch or not replayable:
                 entry.status = "failed"
-                session.commit()
-        except Exception as update_error:
-            logger.error(f"更新失败状态时出错: {str(update_error)}")
+                failed.append(entry)
+                continue
+            entry.task_id = str(uuid.uuid4())
+            entry.status = "pending"
+            entry.redispatch_attempts += 1
+            entry.updated_at = models.utc_now()
+            session.add(outbox(entry_id=entry.id, task_id=entry.task_id, payload=payload))
+            stats["redispatched"] += 1
+        stats["failed"] = len(failed)
+        session.commit()
+
+        for entry in failed:
+            publish_ledger_event(entry)
+        logger.info(f"卡住条目回收完成: {stats}")
+        return stats
+    except Exception as e:
+        logger.error(f"回收卡住条目失败: {str(e)}")
+        session.rollback()
         raise
     finally:
         session.close()
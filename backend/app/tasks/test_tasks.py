@@ -3,7 +3,7 @@ import time
 from ..celery_app import celery_app
 
 
-@celery_app.task(name="test.connection")
+@celery_app.task(name="test.connection", ignore_result=False)
 def test_connection():
     """
     测试 Celery 和 Redis 连接
@@ -17,7 +17,7 @@ def test_connection():
     }
 
 
-@celery_app.task(name="test.echo")
+@celery_app.task(name="test.echo", ignore_result=False)
 def test_echo(message: str = "Hello, Celery!"):
     """
     简单的回显测试任务
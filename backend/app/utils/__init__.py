@@ -1,5 +1,5 @@
 """工具函数模块"""
 from .file_utils import save_uploaded_img, save_uploaded_file
+from .pagination import encode_cursor, decode_cursor
 
-__all__ = ["save_uploaded_img", "save_uploaded_file"]
-
+__all__ = ["save_uploaded_img", "save_uploaded_file", "encode_cursor", "decode_cursor"]
@@ -0,0 +1,17 @@
+"""
+数据库方言相关的工具函数
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+def insert_for_dialect(dialect_name: str):
+    """返回支持 ON CONFLICT 的 insert 构造函数（postgresql / sqlite）"""
+    if dialect_name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def session_dialect_name(session) -> str:
+    """获取会话绑定的数据库方言名（同时支持同步和异步会话）"""
+    dialect = getattr(getattr(session, "bind", None), "dialect", None)
+    return getattr(dialect, "name", "")
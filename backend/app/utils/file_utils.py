@@ -1,56 +1,124 @@
 """
 文件上传工具函数
 """
+import os
 import uuid
 from pathlib import Path
-from fastapi import UploadFile
+from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import Union, Optional
 
+# 每次从上传流读取并写入磁盘的字节数
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _size_limit_error(max_size: int, size: Optional[int] = None) -> HTTPException:
+    """构造文件超过大小限制的错误（流式写入时可能不知道文件的完整大小）"""
+    max_size_mb = max_size / 1024 / 1024
+    detail = f"文件大小不能超过 {max_size_mb:.0f}MB"
+    if size is not None:
+        detail += f"，当前文件: {size / 1024 / 1024:.2f}MB"
+    return HTTPException(status_code=400, detail=detail)
+
+
+async def _read_chunk(file, size: int) -> bytes:
+    """从 UploadFile 或表单中的文件对象读取一块数据"""
+    if hasattr(file, "read"):
+        return await file.read(size)
+    if hasattr(file, "file"):
+        return await run_in_threadpool(file.file.read, size)
+    raise ValueError("不支持的文件对象类型")
+
+
+def remove_quietly(file_path: Path):
+    """删除文件，文件不存在时忽略"""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+async def stream_upload_to_disk(
+    file: Union[UploadFile, any],
+    file_path: Path,
+    max_size: Optional[int] = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    hasher=None,
+) -> int:
+    """
+    把上传文件按块写入磁盘，内存中最多保留一块数据
+
+    磁盘写入在线程池中执行，不阻塞事件循环；超过 max_size 时立即停止并删除已写入的部分。
+    提供 hasher（如 hashlib.sha256()）时边写入边计算内容摘要，不需要再读一遍文件
+
+    Returns:
+        写入的字节数
+
+    Raises:
+        HTTPException: 如果文件大小超过限制
+    """
+    # 已知大小（multipart 解析后 UploadFile.size 可用）时直接拒绝，不写入磁盘
+    known_size = getattr(file, "size", None)
+    if max_size is not None and isinstance(known_size, int) and known_size > max_size:
+        raise _size_limit_error(max_size, known_size)
+
+    written = 0
+    handle = await run_in_threadpool(open, file_path, "wb")
+    try:
+        while True:
+            chunk = await _read_chunk(file, chunk_size)
+            if not chunk:
+                break
+            written += len(chunk)
+            if max_size is not None and written > max_size:
+                raise _size_limit_error(max_size)
+            if hasher is not None:
+                hasher.update(chunk)
+            await run_in_threadpool(handle.write, chunk)
+    except BaseException:
+        await run_in_threadpool(handle.close)
+        await run_in_threadpool(remove_quietly, file_path)
+        raise
+    await run_in_threadpool(handle.close)
+    return written
+
 
 async def save_uploaded_img(
     file: Union[UploadFile, any],
     save_dir: Path,
-    default_ext: str = ".jpg"
+    default_ext: str = ".jpg",
+    max_size: Optional[int] = None,
 ) -> str:
     """
     保存上传的图片到指定目录
-    
+
     Args:
         file: 上传的图片文件对象（UploadFile 或类似对象）
         save_dir: 保存目录的 Path 对象
         default_ext: 默认文件扩展名（如果无法从文件名获取）
-    
+        max_size: 最大文件大小（字节），如果提供则在写入过程中验证
+
     Returns:
         保存后的文件路径（字符串）
-    
+
     Raises:
+        HTTPException: 如果文件大小超过限制
         OSError: 如果目录创建失败或文件写入失败
     """
     # 确保目录存在
     save_dir.mkdir(parents=True, exist_ok=True)
-    
+
     # 获取文件扩展名
     filename = getattr(file, "filename", None)
     file_ext = Path(filename).suffix if filename else default_ext
-    
+
     # 生成唯一文件名
     file_name = f"{uuid.uuid4()}{file_ext}"
     file_path = save_dir / file_name
-    
-    # 读取文件内容
-    if hasattr(file, "read"):
-        # UploadFile 对象
-        content = await file.read()
-    elif hasattr(file, "file"):
-        # 表单中的文件对象
-        content = await file.file.read()
-    else:
-        raise ValueError("不支持的文件对象类型")
-    
-    # 保存文件
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
+
+    # 按块写入文件
+    await stream_upload_to_disk(file, file_path, max_size=max_size)
+
     return str(file_path)
 
 
@@ -59,52 +127,37 @@ async def save_uploaded_file(
     save_dir: Path,
     max_size: Optional[int] = None,
     default_ext: str = ""
-) -> tuple[str, bytes]:
+) -> tuple[str, int]:
     """
     保存上传的文件到指定目录（支持文件大小验证）
-    
+
     Args:
         file: 上传的文件对象（UploadFile）
         save_dir: 保存目录的 Path 对象
-        max_size: 最大文件大小（字节），如果提供则进行验证
+        max_size: 最大文件大小（字节），如果提供则在写入过程中验证
         default_ext: 默认文件扩展名（如果无法从文件名获取）
-    
+
     Returns:
-        tuple: (保存后的文件路径, 文件内容字节)
-    
+        tuple: (保存后的文件路径, 文件大小字节数)
+
     Raises:
         HTTPException: 如果文件大小超过限制
         OSError: 如果目录创建失败或文件写入失败
     """
     # 确保目录存在
     save_dir.mkdir(parents=True, exist_ok=True)
-    
-    # 读取文件内容
-    content = await file.read()
-    
-    # 验证文件大小
-    if max_size is not None and len(content) > max_size:
-        from fastapi import HTTPException
-        size_mb = len(content) / 1024 / 1024
-        max_size_mb = max_size / 1024 / 1024
-        raise HTTPException(
-            status_code=400,
-            detail=f"文件大小不能超过 {max_size_mb:.0f}MB，当前文件: {size_mb:.2f}MB"
-        )
-    
+
     # 获取文件扩展名
     filename = file.filename or "file"
     file_ext = Path(filename).suffix if filename else default_ext
     if not file_ext:
         file_ext = default_ext
-    
+
     # 生成唯一文件名
     file_name = f"{uuid.uuid4()}{file_ext}"
     file_path = save_dir / file_name
-    
-    # 保存文件
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    return str(file_path), content
 
+    # 按块写入文件，超过大小限制时中止
+    size = await stream_upload_to_disk(file, file_path, max_size=max_size)
+
+    return str(file_path), size
@@ -0,0 +1,51 @@
+"""
+gevent 相关的工具函数
+Celery 使用 gevent 池时会在启动时对标准库打 monkey patch，但 psycopg2 是 C 扩展，
+访问数据库时仍会阻塞整个进程，需要额外安装等待回调（与 psycogreen 相同的做法）
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def gevent_patched() -> bool:
+    """当前进程是否运行在打过 monkey patch 的 gevent 下（Celery gevent 池）"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def _gevent_wait_callback(conn, timeout=None):
+    """psycopg2 等待回调：等待数据库读写时让出当前协程"""
+    import psycopg2
+    from psycopg2 import extensions
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"poll() 返回了未知状态: {state!r}")
+
+
+def patch_psycopg2_for_gevent() -> bool:
+    """
+    gevent 已打补丁时让 psycopg2 协程友好（worker 启动时调用）
+
+    Returns:
+        是否安装了等待回调
+    """
+    if not gevent_patched():
+        return False
+    from psycopg2 import extensions
+
+    extensions.set_wait_callback(_gevent_wait_callback)
+    logger.info("已为 gevent 安装 psycopg2 等待回调")
+    return True
@@ -0,0 +1,54 @@
+"""
+游标（keyset）分页工具函数
+"""
+import base64
+import binascii
+import json
+import datetime as dt
+from typing import Any
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values: dict[str, Any]) -> str:
+    """
+    将排序键编码为不透明的游标字符串
+
+    Args:
+        values: 排序键字典，datetime 值会转换为 ISO 格式字符串
+
+    Returns:
+        URL 安全的 base64 游标字符串
+    """
+    payload = {
+        key: value.isoformat() if isinstance(value, dt.datetime) else value
+        for key, value in values.items()
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, datetime_keys: tuple[str, ...] = ()) -> dict[str, Any]:
+    """
+    解码游标字符串
+
+    Args:
+        cursor: encode_cursor 生成的游标
+        datetime_keys: 需要还原为 datetime 的键
+
+    Returns:
+        排序键字典
+
+    Raises:
+        HTTPException: 如果游标格式无效
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(payload, dict):
+            raise ValueError("游标内容必须是对象")
+        for key in datetime_keys:
+            payload[key] = dt.datetime.fromisoformat(payload[key])
+        return payload
+    except (ValueError, KeyError, TypeError, binascii.Error, UnicodeEncodeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
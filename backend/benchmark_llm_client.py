@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+LLM 客户端连接复用基准测试
+
+在本地启动一个模拟 OpenAI chat completions 接口的 HTTP 服务，
+分别用 "每次调用新建客户端"（旧实现）和 "进程级共享客户端"（get_llm_client）发送请求并对比耗时。
+
+使用方法:
+    python benchmark_llm_client.py
+    python benchmark_llm_client.py --requests 500
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from openai import OpenAI
+from app.services.llm_client import get_llm_client, close_llm_clients
+
+STUB_RESPONSE = json.dumps({
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "deepseek-chat",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": '{"amount": 25, "currency": "CNY", "category": "餐饮美食"}'},
+        "finish_reason": "stop",
+    }],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}).encode("utf-8")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """固定返回一条 chat completion 的 HTTP/1.1 服务（支持长连接）"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(STUB_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(STUB_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def call(client: OpenAI):
+    client.chat.completions.create(
+        model="deepseek-chat",
+        messages=[{"role": "user", "content": "咖啡 25"}],
+    )
+
+
+def run(label: str, requests: int, make_client):
+    started = time.perf_counter()
+    for _ in range(requests):
+        call(make_client())
+    elapsed = time.perf_counter() - started
+    print(f"{label}: {requests} 次请求, 总耗时 {elapsed:.3f}s, 平均 {elapsed / requests * 1000:.2f}ms")
+
+
+def main():
+    """主函数"""
+    requests = 200
+    args = sys.argv[1:]
+    if args:
+        if args[0] == "--requests" and len(args) == 2 and args[1].isdigit():
+            requests = int(args[1])
+        else:
+            print("使用方法:")
+            print("  python benchmark_llm_client.py [--requests N]")
+            sys.exit(1)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    print(f"模拟 LLM 服务: {base_url}")
+
+    try:
+        run("每次新建客户端", requests, lambda: OpenAI(api_key="stub", base_url=base_url))
+        run("共享客户端", requests, lambda: get_llm_client("stub", base_url))
+    finally:
+        close_llm_clients()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,7 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     user_name = Column(String(64), nullable=True)
     hashed_password = Column(String(255), nullable=False)
+    ledger_count = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, nullable=False)
 
 class LedgerEntry(Base):
@@ -283,8 +284,13 @@ def main():
             entry = generate_fake_ledger_entry(user.id, days_ago)
             entries.append(entry)
         
-        # 批量插入
+        # 批量插入，并同步用户的记账条目计数
         session.add_all(entries)
+        user.ledger_count = (user.ledger_count or 0) + len(entries)
+        session.flush()
+        # 重建该用户的记账月度汇总，让统计接口能读到新数据
+        from app.services.ledger_rollup import rebuild_rollups
+        rebuild_rollups(session, user.id)
         session.commit()
         
         print(f"成功生成 {count} 条记账数据！")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+重建记账月度汇总（ledger_monthly_rollups）
+
+统计接口读取增量维护的汇总表。首次部署、手动改动数据库或怀疑汇总不一致时，
+可以用此脚本从 ledger_entries 重新计算。
+
+使用方法:
+    python rebuild_ledger_rollups.py
+    python rebuild_ledger_rollups.py --user-id 1
+"""
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.config import settings
+from app.services.ledger_rollup import rebuild_rollups
+
+
+def main():
+    """主函数"""
+    user_id = None
+    args = sys.argv[1:]
+    if args:
+        if args[0] in ("--user-id", "-u") and len(args) == 2:
+            try:
+                user_id = int(args[1])
+            except ValueError:
+                print("错误: --user-id 需要提供数字ID")
+                sys.exit(1)
+        else:
+            print("使用方法:")
+            print("  python rebuild_ledger_rollups.py")
+            print("  python rebuild_ledger_rollups.py --user-id 1")
+            sys.exit(1)
+
+    sync_db_url = settings.database_url.replace("+asyncpg", "+psycopg2")
+    sync_engine = create_engine(sync_db_url, pool_pre_ping=True)
+    SyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+
+    session: Session = SyncSessionLocal()
+    try:
+        target = f"用户 {user_id}" if user_id is not None else "全部用户"
+        print(f"正在重建{target}的记账月度汇总...")
+        total = rebuild_rollups(session, user_id)
+        session.commit()
+        print(f"✓ 重建完成，共 {total} 行汇总")
+    except Exception as e:
+        session.rollback()
+        print(f"错误: 重建失败: {e}")
+        sys.exit(1)
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/bin/bash
+# 按类型启动专用 Celery Worker（需要先启动 Redis 服务）
+#
+# 使用方法:
+#   ./run-celery-worker.sh ocr          # OCR：CPU 密集，prefork 进程数 = CPU 核数，每次只预取 1 个任务
+#   ./run-celery-worker.sh llm          # LLM：网络等待，gevent 高并发（psycopg2 在 worker 启动时打补丁）
+#   ./run-celery-worker.sh db           # 写回数据库：短任务，少量进程
+#   ./run-celery-worker.sh maintenance  # 定时清理任务
+#
+# 可用环境变量覆盖默认值：CELERY_POOL、CELERY_CONCURRENCY、CELERY_PREFETCH（llm 还可覆盖 DB_POOL_SIZE、DB_MAX_OVERFLOW）
+# 单机开发时直接运行 run-celery.sh，一个 worker 消费全部队列
+
+set -e
+
+# 设置工作目录
+cd "$(dirname "$0")"
+
+WORKER_TYPE="$1"
+case "$WORKER_TYPE" in
+    ocr)
+        DEFAULT_POOL=prefork
+        DEFAULT_CONCURRENCY=$(nproc 2>/dev/null || echo 2)
+        DEFAULT_PREFETCH=1
+        ;;
+    llm)
+        DEFAULT_POOL=gevent
+        DEFAULT_CONCURRENCY=50
+        DEFAULT_PREFETCH=4
+        # 融合任务和批量任务在 llm worker 上写回数据库，连接池按并发数配置，
+        # 避免 50 个协程争抢默认的 5+10 个连接而超时
+        export DB_POOL_SIZE="${DB_POOL_SIZE:-10}"
+        export DB_MAX_OVERFLOW="${DB_MAX_OVERFLOW:-${CELERY_CONCURRENCY:-$DEFAULT_CONCURRENCY}}"
+        ;;
+    db)
+        DEFAULT_POOL=prefork
+        DEFAULT_CONCURRENCY=4
+        DEFAULT_PREFETCH=8
+        ;;
+    maintenance)
+        DEFAULT_POOL=solo
+        DEFAULT_CONCURRENCY=1
+        DEFAULT_PREFETCH=1
+        ;;
+    *)
+        echo "使用方法: $0 {ocr|llm|db|maintenance}"
+        exit 1
+        ;;
+esac
+
+# 默认队列 celery 由 db worker 一并处理
+QUEUES="$WORKER_TYPE"
+if [ "$WORKER_TYPE" = "db" ]; then
+    QUEUES="db,celery"
+fi
+
+# 使用 uv run 在 uv 管理的虚拟环境中运行
+exec uv run celery -A app.celery_app:celery_app worker --loglevel=info \
+    -Q "$QUEUES" \
+    -n "${WORKER_TYPE}@%h" \
+    --pool="${CELERY_POOL:-$DEFAULT_POOL}" \
+    --concurrency="${CELERY_CONCURRENCY:-$DEFAULT_CONCURRENCY}" \
+    --prefetch-multiplier="${CELERY_PREFETCH:-$DEFAULT_PREFETCH}"
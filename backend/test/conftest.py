@@ -100,4 +100,26 @@ def setup_test_env(monkeypatch):
     # 如果 TESSERACT_CMD 未设置，尝试使用系统默认路径
     if not os.getenv("TESSERACT_CMD"):
         # 不设置，让代码使用系统默认路径
-        pass
\ No newline at end of file
+        pass
+
+@pytest.fixture(autouse=True)
+def disable_llm_cache(monkeypatch):
+    """默认禁用 LLM 结果缓存，避免测试读写本地 Redis；缓存相关测试自行开启"""
+    from app.config import settings
+    monkeypatch.setattr(settings, "llm_cache_ttl", 0)
+
+
+@pytest.fixture(autouse=True)
+def disable_ledger_fast_path(monkeypatch):
+    """默认关闭规则解析快速路径，让 LLM 相关测试走模型调用；规则解析测试自行开启"""
+    from app.config import settings
+    monkeypatch.setattr(settings, "ledger_fast_path_enabled", False)
+
+
+@pytest.fixture(autouse=True)
+def reset_llm_clients():
+    """每个测试使用新的 LLM 客户端，避免复用上一个测试的 mock"""
+    from app.services import llm_client
+    llm_client._clients.clear()
+    yield
+    llm_client._clients.clear()
@@ -1,6 +1,7 @@
 """
 Auth API 路由测试
 """
+import json
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock, AsyncMock
@@ -9,7 +10,7 @@ from datetime import datetime, timezone
 from app.main import app
 from app import models
 from app.db import get_session
-from app.auth import get_current_user, verify_password, create_access_token
+from app.auth import get_current_user, verify_password, create_access_token, invalidate_user_cache, _user_cache
 
 
 # ========== Fixtures ==========
@@ -338,6 +339,90 @@ class TestGetMe:
         assert response.status_code == 401
 
 
+# ========== 测试认证用户缓存 ==========
+
+class TestCurrentUserCache:
+    """测试 get_current_user 的用户缓存"""
+    
+    @pytest.fixture(autouse=True)
+    def clear_user_cache(self):
+        """每个测试前后清空进程内用户缓存"""
+        _user_cache.clear()
+        yield
+        _user_cache.clear()
+    
+    @pytest.fixture
+    def db_user(self):
+        """数据库中的用户"""
+        return models.User(
+            id=7,
+            email="cache@example.com",
+            user_name="Cache User",
+            hashed_password="hashed_password_123",
+            ledger_count=0,
+            created_at=datetime.now(timezone.utc).replace(tzinfo=None)
+        )
+    
+    @pytest.fixture
+    def user_session(self, db_user):
+        """返回 db_user 的模拟会话"""
+        session = AsyncMock()
+        result = MagicMock()
+        result.scalars.return_value.first.return_value = db_user
+        session.execute = AsyncMock(return_value=result)
+        return session
+    
+    async def test_second_request_uses_cache(self, db_user, user_session):
+        """测试缓存命中时不再查询数据库"""
+        token = create_access_token({"sub": str(db_user.id)})
+        
+        first = await get_current_user(token=token, session=user_session)
+        second = await get_current_user(token=token, session=user_session)
+        
+        assert user_session.execute.await_count == 1
+        assert second.id == db_user.id
+        assert second.email == db_user.email
+        # 命中缓存时返回新的对象，而不是共享同一个实例
+        assert second is not first
+    
+    async def test_cache_excludes_password_and_counter(self, db_user, user_session):
+        """测试缓存（包括 Redis）中不保存密码和记账计数"""
+        token = create_access_token({"sub": str(db_user.id)})
+        redis = AsyncMock()
+        redis.get.return_value = None
+
+        with patch('app.auth.settings.auth_user_cache_redis', True), \
+             patch('app.auth.get_async_redis', return_value=redis):
+            await get_current_user(token=token, session=user_session)
+            cached = await get_current_user(token=token, session=user_session)
+
+        payload = json.loads(redis.set.await_args.args[1])
+        assert "hashed_password" not in payload
+        assert "ledger_count" not in payload
+        assert cached.hashed_password is None
+        assert cached.ledger_count is None
+
+    async def test_invalidate_user_cache(self, db_user, user_session):
+        """测试失效后重新查询数据库"""
+        token = create_access_token({"sub": str(db_user.id)})
+        
+        await get_current_user(token=token, session=user_session)
+        await invalidate_user_cache(db_user.id)
+        await get_current_user(token=token, session=user_session)
+        
+        assert user_session.execute.await_count == 2
+    
+    async def test_cache_disabled(self, db_user, user_session):
+        """测试 TTL 为 0 时禁用缓存"""
+        token = create_access_token({"sub": str(db_user.id)})
+        
+        with patch('app.auth.settings.auth_user_cache_ttl', 0):
+            await get_current_user(token=token, session=user_session)
+            await get_current_user(token=token, session=user_session)
+        
+        assert user_session.execute.await_count == 2
+
+
 # ========== 测试修改密码 ==========
 
 class TestChangePassword:
@@ -412,6 +497,43 @@ class TestChangePassword:
         finally:
             app.dependency_overrides.clear()
     
+    @patch('app.routers.auth.invalidate_user_cache', new_callable=AsyncMock)
+    def test_change_password_stale_cached_password(
+        self,
+        mock_invalidate,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试缓存中的原密码已过期时，以数据库中的密码为准"""
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            mock_session = AsyncMock()
+            mock_result = MagicMock()
+            mock_result.rowcount = 0
+            mock_session.execute = AsyncMock(return_value=mock_result)
+            yield mock_session
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.post(
+                "/auth/change-password",
+                json={
+                    "old_password": "hashed_password_123",
+                    "new_password": "hashed_new_password"
+                },
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            
+            assert response.status_code == 400
+            mock_invalidate.assert_not_awaited()
+        finally:
+            app.dependency_overrides.clear()
+    
     def test_change_password_without_auth(self, client):
         """测试未认证修改密码"""
         response = client.post(
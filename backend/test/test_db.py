@@ -0,0 +1,119 @@
+"""
+数据库引擎与连接池配置测试
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from app.main import app
+from app import db
+from app.db import _engine_options, get_pool_stats, engine
+
+
+@pytest.fixture
+def pool_settings(monkeypatch):
+    """设置一组非默认的连接池配置"""
+    monkeypatch.setattr(db.settings, "db_pool_size", 7)
+    monkeypatch.setattr(db.settings, "db_max_overflow", 3)
+    monkeypatch.setattr(db.settings, "db_pool_timeout", 5)
+    monkeypatch.setattr(db.settings, "db_pool_recycle", 600)
+    monkeypatch.setattr(db.settings, "db_statement_timeout_ms", 15000)
+    monkeypatch.setattr(db.settings, "db_prepared_statement_cache_size", 0)
+
+
+class TestEngineOptions:
+    """测试引擎参数生成"""
+
+    def test_asyncpg_options(self, pool_settings):
+        options = _engine_options("postgresql+asyncpg://u:p@localhost/db", AsyncAdaptedQueuePool, "test")
+
+        assert options["pool_size"] == 7
+        assert options["max_overflow"] == 3
+        assert options["pool_timeout"] == 5
+        assert options["pool_recycle"] == 600
+        assert issubclass(options["poolclass"], AsyncAdaptedQueuePool)
+        assert options["connect_args"] == {
+            "prepared_statement_cache_size": 0,
+            "server_settings": {"statement_timeout": "15000"},
+        }
+
+    def test_psycopg2_options(self, pool_settings):
+        options = _engine_options("postgresql+psycopg2://u:p@localhost/db", QueuePool, "test")
+
+        assert issubclass(options["poolclass"], QueuePool)
+        assert options["connect_args"] == {"options": "-c statement_timeout=15000"}
+
+    def test_statement_timeout_disabled(self, pool_settings, monkeypatch):
+        monkeypatch.setattr(db.settings, "db_statement_timeout_ms", 0)
+
+        options = _engine_options("postgresql+psycopg2://u:p@localhost/db", QueuePool, "test")
+
+        assert options["connect_args"] == {}
+
+    def test_non_postgresql_keeps_default_pool(self):
+        options = _engine_options("sqlite:///test.db", QueuePool, "test")
+
+        assert options == {"pool_pre_ping": True}
+
+
+class TestPoolStats:
+    """测试连接池指标（不依赖 DATABASE_URL 的数据库类型）"""
+
+    def test_pool_stats_fields(self):
+        queue_engine = create_engine("sqlite://", poolclass=QueuePool)
+
+        stats = get_pool_stats(queue_engine, "test")
+
+        assert stats["pool"] == "QueuePool"
+        assert stats["checked_out"] == 0
+        assert stats["overflow"] <= 0
+        assert "wait_avg_ms" in stats
+        assert "wait_max_ms" in stats
+        queue_engine.dispose()
+
+    def test_pool_stats_without_queue_pool(self):
+        null_engine = create_engine("sqlite://", poolclass=NullPool)
+
+        stats = get_pool_stats(null_engine, "test")
+
+        # 只返回连接池实际支持的字段
+        assert stats["pool"] == "NullPool"
+        assert "checked_out" not in stats
+        assert "overflow" not in stats
+        assert "wait_avg_ms" in stats
+        null_engine.dispose()
+
+    def test_health_db_endpoint(self):
+        client = TestClient(app)
+
+        response = client.get("/health/db")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ok"
+        assert data["pool"]["pool"] == type(engine.pool).__name__
+        assert ("checked_out" in data["pool"]) == isinstance(engine.pool, QueuePool)
+
+
+class TestGeventPsycopg2:
+    """测试 gevent 池中的 psycopg2 等待回调"""
+
+    def test_skipped_without_gevent_patch(self, monkeypatch):
+        from app.utils import gevent_utils
+
+        monkeypatch.setattr(gevent_utils, "gevent_patched", lambda: False)
+
+        assert gevent_utils.patch_psycopg2_for_gevent() is False
+
+    def test_installs_wait_callback(self, monkeypatch):
+        from psycopg2 import extensions
+        from app.utils import gevent_utils
+
+        previous = extensions.get_wait_callback()
+        monkeypatch.setattr(gevent_utils, "gevent_patched", lambda: True)
+        try:
+            assert gevent_utils.patch_psycopg2_for_gevent() is True
+            assert extensions.get_wait_callback() is gevent_utils._gevent_wait_callback
+        finally:
+            extensions.set_wait_callback(previous)
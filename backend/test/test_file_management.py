@@ -47,6 +47,7 @@ async def test_cleanup_orphan_files():
     # Mock finding orphan files
     mock_file = MagicMock(spec=models.File)
     mock_file.file_path = "dummy_path.txt"
+    mock_file.content_hash = None
     
     result = MagicMock()
     result.scalars.return_value.all.return_value = [mock_file]
@@ -56,7 +57,8 @@ async def test_cleanup_orphan_files():
     # Patch os functions
     with patch("app.tasks.file_tasks.AsyncSessionLocal", return_value=mock_session), \
          patch("os.path.exists", return_value=True), \
-         patch("os.remove") as mock_remove:
+         patch("os.remove") as mock_remove, \
+         patch("app.tasks.file_tasks.purge_unreferenced_blobs", new_callable=AsyncMock) as mock_purge:
         
         # 因为 AsyncSessionLocal 是作为一个 async context manager 使用的
         # async with AsyncSessionLocal() as session:
@@ -71,3 +73,155 @@ async def test_cleanup_orphan_files():
         # Verify db delete
         mock_session.delete.assert_called_with(mock_file)
         mock_session.commit.assert_called_once()
+        mock_purge.assert_awaited_once_with(mock_session)
+
+
+@pytest.mark.asyncio
+async def test_release_files_merges_blob_references():
+    from app.services.file_store import release_files
+
+    session = AsyncMock()
+    shared = [MagicMock(spec=models.File, content_hash="a" * 64, file_path="uploads/blobs/aa/x") for _ in range(2)]
+    legacy = MagicMock(spec=models.File, content_hash=None, file_path="uploads/files/old.txt")
+
+    legacy_paths = await release_files(session, shared + [legacy])
+
+    # 同一内容的多个引用合并为一次扣减，旧记录的路径交给调用方删除
+    assert legacy_paths == ["uploads/files/old.txt"]
+    assert session.execute.await_count == 1
+    stmt = session.execute.await_args.args[0]
+    assert str(stmt).startswith("UPDATE file_blobs")
+    assert 2 in stmt.compile().params.values()
+
+
+@pytest.mark.asyncio
+async def test_store_upload_deduplicates_content(tmp_path):
+    import io
+    from starlette.datastructures import UploadFile
+    from app.services import file_store
+
+    content = b"same screenshot" * 100
+    digest = __import__("hashlib").sha256(content).hexdigest()
+
+    def make_session():
+        session = AsyncMock()
+        session.info = {}
+        result = MagicMock()
+        result.scalar_one.return_value = str(tmp_path / "blobs" / digest[:2] / digest)
+        session.execute = AsyncMock(return_value=result)
+        return session
+
+    with patch.object(file_store, "BLOB_DIR", tmp_path / "blobs"), \
+         patch.object(file_store, "BLOB_TMP_DIR", tmp_path / "blobs" / "tmp"):
+        first = await file_store.store_upload(make_session(), UploadFile(file=io.BytesIO(content), filename="a.png"))
+        second = await file_store.store_upload(make_session(), UploadFile(file=io.BytesIO(content), filename="b.png"))
+
+    assert first == second == (str(tmp_path / "blobs" / digest[:2] / digest), digest, len(content))
+    assert (tmp_path / "blobs" / digest[:2] / digest).read_bytes() == content
+    # 重复上传的临时文件被丢弃，磁盘上只有一份
+    assert list((tmp_path / "blobs" / "tmp").iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_purge_unreferenced_blobs_removes_files(tmp_path):
+    from app.services.file_store import purge_unreferenced_blobs
+
+    blob_file = tmp_path / "blob"
+    blob_file.write_bytes(b"x")
+    blob = MagicMock(spec=models.FileBlob, file_path=str(blob_file))
+    session = AsyncMock()
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = [blob]
+    session.execute = AsyncMock(return_value=result)
+
+    assert await purge_unreferenced_blobs(session) == 1
+    assert not blob_file.exists()
+    session.delete.assert_awaited_once_with(blob)
+    session.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_save_uploaded_file_streams_in_chunks(tmp_path):
+    import io
+    from starlette.datastructures import UploadFile
+    from app.utils import file_utils
+
+    content = b"0123456789" * 1000
+    upload = UploadFile(file=io.BytesIO(content), filename="report.pdf")
+
+    with patch.object(upload, "read", wraps=upload.read) as mock_read:
+        size = await file_utils.stream_upload_to_disk(upload, tmp_path / "out.pdf", chunk_size=4096)
+
+    assert size == len(content)
+    assert (tmp_path / "out.pdf").read_bytes() == content
+    # 每次只读取一块，不会一次读入整个文件
+    assert all(call.args == (4096,) for call in mock_read.call_args_list)
+
+    path, size = await file_utils.save_uploaded_file(
+        UploadFile(file=io.BytesIO(content), filename="report.pdf"), tmp_path / "files", max_size=len(content)
+    )
+    assert size == len(content)
+    assert path.endswith(".pdf")
+
+
+@pytest.mark.asyncio
+async def test_save_uploaded_file_aborts_over_limit(tmp_path):
+    import io
+    from fastapi import HTTPException
+    from starlette.datastructures import UploadFile
+    from app.utils.file_utils import save_uploaded_file, stream_upload_to_disk
+
+    save_dir = tmp_path / "files"
+    # 大小未知时写入过程中超限，删除已写入的部分
+    upload = UploadFile(file=io.BytesIO(b"x" * 5000), filename="big.bin")
+    with pytest.raises(HTTPException) as exc_info:
+        await stream_upload_to_disk(upload, tmp_path / "big.bin", max_size=3000, chunk_size=1024)
+    assert exc_info.value.status_code == 400
+    assert not (tmp_path / "big.bin").exists()
+
+    # 已知大小时直接拒绝，不创建文件
+    upload = UploadFile(file=io.BytesIO(b"x" * 5000), filename="big.bin", size=5000)
+    with pytest.raises(HTTPException):
+        await save_uploaded_file(upload, save_dir, max_size=3000)
+    assert list(save_dir.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_commit_uploads_removes_new_blob_on_rollback(tmp_path):
+    import io
+    import hashlib
+    from pathlib import Path
+    from sqlalchemy.exc import IntegrityError
+    from starlette.datastructures import UploadFile
+    from app.services import file_store
+
+    def make_session(content):
+        digest = hashlib.sha256(content).hexdigest()
+        session = AsyncMock()
+        session.info = {}
+        result = MagicMock()
+        result.scalar_one.return_value = str(tmp_path / "blobs" / digest[:2] / digest)
+        session.execute = AsyncMock(return_value=result)
+        session.commit = AsyncMock(side_effect=IntegrityError("INSERT", {}, Exception("duplicate")))
+        return session
+
+    with patch.object(file_store, "BLOB_DIR", tmp_path / "blobs"), \
+         patch.object(file_store, "BLOB_TMP_DIR", tmp_path / "blobs" / "tmp"):
+        # 新建的 blob 在提交失败时删除
+        session = make_session(b"new content")
+        path, _, _ = await file_store.store_upload(session, UploadFile(file=io.BytesIO(b"new content"), filename="a.png"))
+        with pytest.raises(IntegrityError):
+            await file_store.commit_uploads(session)
+        assert not Path(path).exists()
+        session.rollback.assert_awaited_once()
+
+        # 已存在的 blob（被其他记录引用）不受影响
+        existing = tmp_path / "blobs" / "existing"
+        existing.parent.mkdir(parents=True, exist_ok=True)
+        session = make_session(b"shared")
+        session.execute.return_value.scalar_one.return_value = str(existing)
+        existing.write_bytes(b"shared")
+        await file_store.store_upload(session, UploadFile(file=io.BytesIO(b"shared"), filename="b.png"))
+        with pytest.raises(IntegrityError):
+            await file_store.commit_uploads(session)
+        assert existing.read_bytes() == b"shared"
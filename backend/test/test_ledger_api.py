@@ -30,6 +30,13 @@ def reset_dependencies():
     app.dependency_overrides.clear()
 
 
+@pytest.fixture(autouse=True)
+def mock_outbox_relay():
+    """替换发件箱中继，测试中不连接 broker"""
+    with patch('app.routers.ledger.outbox_relay') as mock:
+        yield mock
+
+
 @pytest.fixture
 def mock_token():
     """模拟 token"""
@@ -97,6 +104,54 @@ class TestCreateLedger:
             # 清理覆盖
             app.dependency_overrides.clear()
     
+    def _override_create_session(self, mock_user):
+        """创建接口使用的依赖覆盖，返回记录 commit 次数的 mock 会话"""
+        mock_session = AsyncMock()
+        mock_session.add = MagicMock()
+        mock_session.commit = AsyncMock()
+
+        async def mock_refresh(obj):
+            obj.id = 1
+            obj.currency = "CNY"
+            obj.created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+
+        mock_session.refresh = AsyncMock(side_effect=mock_refresh)
+
+        async def override_get_current_user():
+            return mock_user
+
+        async def override_get_session():
+            yield mock_session
+
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        return mock_session
+
+    def test_create_ledger_writes_outbox_in_same_transaction(
+        self, client, mock_user, mock_token, mock_outbox_relay
+    ):
+        """task_id 和发件箱记录随条目在同一次提交中写入，提交后唤醒中继"""
+        mock_session = self._override_create_session(mock_user)
+
+        response = client.post(
+            "/ledger",
+            json={"text": "午饭 35"},
+            headers={"Authorization": f"Bearer {mock_token}"}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "pending"
+        assert data["task_id"]
+        added = [call.args[0] for call in mock_session.add.call_args_list]
+        entry, outbox = added
+        assert isinstance(outbox, models.LedgerTaskOutbox)
+        assert outbox.entry is entry
+        assert entry.task_id == outbox.task_id == data["task_id"]
+        assert outbox.payload == {"raw_text": "午饭 35", "image_path": None, "original_text": "午饭 35"}
+        mock_session.commit.assert_awaited_once()
+        mock_outbox_relay.notify.assert_called_once()
+
     @patch('app.routers.ledger.save_uploaded_img')
     def test_create_ledger_with_image(
         self,
@@ -387,6 +442,112 @@ class TestGetLedger:
         finally:
             app.dependency_overrides.clear()
     
+    def test_list_ledgers_cursor_without_total(
+        self,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试游标分页：不使用 OFFSET，include_total=false 时不统计总数"""
+        created_at = datetime(2024, 1, 1, 12, 0, 0)
+        entries = [
+            models.LedgerEntry(
+                id=i,
+                user_id=1,
+                raw_text=f"条目 {i}",
+                status="completed",
+                currency="CNY",
+                created_at=created_at
+            )
+            for i in (5, 4, 3)
+        ]
+        executed_queries = []
+        
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            mock_session = AsyncMock()
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = entries
+            
+            async def mock_execute(query):
+                executed_queries.append(str(query))
+                return mock_result
+            
+            mock_session.execute = AsyncMock(side_effect=mock_execute)
+            yield mock_session
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.get(
+                "/ledger?page_size=2&include_total=false",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert [item["id"] for item in data["items"]] == [5, 4]
+            assert data["total"] is None
+            assert data["next_cursor"]
+            # 只执行列表查询，不执行 COUNT
+            assert len(executed_queries) == 1
+            
+            response = client.get(
+                f"/ledger?page_size=2&include_total=false&cursor={data['next_cursor']}",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            assert response.status_code == 200
+            assert "OFFSET" not in executed_queries[1]
+            assert "(ledger_entries.created_at, ledger_entries.id) <" in executed_queries[1]
+        finally:
+            app.dependency_overrides.clear()
+    
+    def test_list_ledgers_total_uses_user_counter(
+        self,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试无筛选时总数读取 users.ledger_count 而不是 COUNT(*)"""
+        executed_queries = []
+        
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            mock_session = AsyncMock()
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = []
+            mock_result.scalar.return_value = 42
+            
+            async def mock_execute(query):
+                executed_queries.append(str(query))
+                return mock_result
+            
+            mock_session.execute = AsyncMock(side_effect=mock_execute)
+            yield mock_session
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.get(
+                "/ledger?page_size=20",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["total"] == 42
+            assert data["total_pages"] == 3
+            assert "users.ledger_count" in executed_queries[0]
+            assert "count(" not in executed_queries[0].lower()
+        finally:
+            app.dependency_overrides.clear()
+    
     def test_get_single_ledger(
         self,
         client,
@@ -493,6 +654,7 @@ class TestLedgerSummary:
                 call_count += 1
                 # 根据查询类型返回不同的结果
                 query_str = str(query)
+                executed_queries.append(query_str)
                 if "sum" in query_str.lower() or "coalesce" in query_str.lower():
                     return mock_total_result
                 else:
@@ -501,6 +663,7 @@ class TestLedgerSummary:
             mock_session.execute = mock_execute
             yield mock_session
         
+        executed_queries = []
         app.dependency_overrides[get_current_user] = override_get_current_user
         app.dependency_overrides[get_session] = override_get_session
         
@@ -518,6 +681,10 @@ class TestLedgerSummary:
             assert "recent" in data
             assert data["total_amount"] == 100.0
             assert isinstance(data["recent"], list)
+            # 总金额按所有条目计算，不读取只含已完成条目的月度汇总
+            total_query = next(query for query in executed_queries if "coalesce" in query.lower())
+            assert "ledger_entries" in total_query
+            assert "ledger_monthly_rollups" not in total_query
         finally:
             app.dependency_overrides.clear()
     
@@ -576,6 +743,83 @@ class TestLedgerSummary:
         assert response.status_code == 401
 
 
+# ========== 测试 Ledger 统计 ==========
+
+class TestLedgerStatistics:
+    """测试 ledger 统计端点"""
+    
+    @patch('app.routers.ledger.get_exchange_rate_to_cny', new_callable=AsyncMock)
+    def test_get_statistics_from_grouped_rows(
+        self,
+        mock_get_rate,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试统计基于月度汇总行计算，并按货币转换为人民币"""
+        mock_get_rate.return_value = 7.0
+        now = datetime.now(timezone.utc)
+        
+        def group(currency, category, amount, count, nonzero_count=None):
+            row = MagicMock()
+            row.year = now.year
+            row.month = now.month
+            row.currency = currency
+            row.category = category
+            row.amount = amount
+            row.count = count
+            row.nonzero_count = count if nonzero_count is None else nonzero_count
+            return row
+        
+        groups = [
+            group("CNY", "餐饮美食", 100.0, 3),
+            group("USD", "餐饮美食", 10.0, 1),
+            group("CNY", "交通出行", 30.0, 2),
+        ]
+        executed_queries = []
+        
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            mock_session = AsyncMock()
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = groups
+            
+            async def mock_execute(query):
+                executed_queries.append(str(query))
+                return mock_result
+            
+            mock_session.execute = AsyncMock(side_effect=mock_execute)
+            yield mock_session
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.get(
+                "/ledger/statistics",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert len(executed_queries) == 1
+            assert "FROM ledger_monthly_rollups" in executed_queries[0]
+            # 每种货币只获取一次汇率
+            assert sorted(call.args[0] for call in mock_get_rate.await_args_list) == ["CNY", "USD"]
+            assert data["current_month_total"] == pytest.approx(200.0)
+            assert data["monthly_data"][-1]["count"] == 6
+            assert len(data["yearly_data"]) == 12
+            categories = {item["category"]: item for item in data["category_stats"]}
+            assert categories["餐饮美食"]["amount"] == pytest.approx(170.0)
+            assert categories["餐饮美食"]["count"] == 4
+            assert data["category_stats"][0]["category"] == "餐饮美食"
+            assert categories["交通出行"]["percentage"] == pytest.approx(15.0)
+        finally:
+            app.dependency_overrides.clear()
+
+
 # ========== 测试更新 Ledger ==========
 
 class TestUpdateLedger:
@@ -806,6 +1050,65 @@ class TestDeleteLedger:
         finally:
             app.dependency_overrides.clear()
     
+    def test_delete_completed_ledger_updates_rollup(
+        self,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试删除已完成条目时在同一事务中扣减月度汇总"""
+        entry = models.LedgerEntry(
+            id=1,
+            user_id=1,
+            raw_text="午饭",
+            status="completed",
+            amount=35.0,
+            currency="CNY",
+            category="餐饮美食",
+            event_time=datetime(2024, 3, 1, 12, 0, 0),
+            created_at=datetime(2024, 3, 1, 12, 0, 0)
+        )
+        executed_statements = []
+        
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            mock_session = AsyncMock()
+            mock_result = MagicMock()
+            mock_result.scalar_one_or_none.return_value = entry
+            
+            async def mock_execute(stmt):
+                executed_statements.append(stmt)
+                return mock_result
+            
+            mock_session.execute = AsyncMock(side_effect=mock_execute)
+            mock_session.delete = AsyncMock()
+            mock_session.commit = AsyncMock()
+            yield mock_session
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.delete(
+                "/ledger/1",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            
+            assert response.status_code == 200
+            rollup_updates = [
+                stmt for stmt in executed_statements
+                if "INSERT INTO ledger_monthly_rollups" in str(stmt)
+            ]
+            assert len(rollup_updates) == 1
+            params = rollup_updates[0].compile().params
+            assert params["amount"] == -35.0
+            assert params["count"] == -1
+            assert (params["year"], params["month"]) == (2024, 3)
+        finally:
+            app.dependency_overrides.clear()
+    
     def test_delete_ledger_not_found(
         self,
         client,
@@ -879,3 +1182,322 @@ class TestDeleteLedger:
         finally:
             app.dependency_overrides.clear()
 
+
+
+# ========== 测试状态推送 ==========
+
+class TestLedgerEvents:
+    """测试记账条目状态推送"""
+
+    @patch("app.services.ledger_events.get_sync_redis")
+    def test_publish_ledger_event(self, mock_get_redis):
+        from app.services.ledger_events import publish_ledger_event
+
+        mock_redis = MagicMock()
+        mock_get_redis.return_value = mock_redis
+        entry = models.LedgerEntry(
+            id=5,
+            user_id=3,
+            raw_text="午饭",
+            amount=25.0,
+            currency="CNY",
+            status="completed",
+            created_at=datetime(2024, 1, 15, 10, 0, 0),
+        )
+
+        publish_ledger_event(entry)
+
+        channel, payload = mock_redis.publish.call_args.args
+        assert channel == "ledger:events:3"
+        assert '"id":5' in payload
+        assert '"status":"completed"' in payload
+
+    @patch("app.services.ledger_events.get_sync_redis")
+    def test_publish_failure_is_swallowed(self, mock_get_redis):
+        from app.services.ledger_events import publish_ledger_event
+
+        mock_get_redis.return_value.publish.side_effect = ConnectionError("redis down")
+        entry = models.LedgerEntry(
+            id=5, user_id=3, raw_text="", currency="CNY", status="failed",
+            created_at=datetime(2024, 1, 15, 10, 0, 0),
+        )
+
+        # 不应抛出异常
+        publish_ledger_event(entry)
+
+    @patch("app.services.ledger_events.get_async_redis")
+    async def test_event_stream(self, mock_get_redis):
+        from app.services.ledger_events import ledger_event_stream
+
+        pubsub = MagicMock()
+        pubsub.subscribe = AsyncMock()
+        pubsub.unsubscribe = AsyncMock()
+        pubsub.aclose = AsyncMock()
+        pubsub.get_message = AsyncMock(side_effect=[
+            {"type": "message", "data": b'{"id":5,"status":"completed"}'},
+            None,
+        ])
+        mock_get_redis.return_value.pubsub.return_value = pubsub
+        is_disconnected = AsyncMock(side_effect=[False, False, True])
+
+        chunks = [chunk async for chunk in ledger_event_stream(3, is_disconnected)]
+
+        pubsub.subscribe.assert_awaited_once_with("ledger:events:3")
+        assert chunks == [
+            "retry: 3000\n\n",
+            'event: ledger\ndata: {"id":5,"status":"completed"}\n\n',
+            ": keepalive\n\n",
+        ]
+        pubsub.unsubscribe.assert_awaited_once_with("ledger:events:3")
+        pubsub.aclose.assert_awaited_once()
+
+
+# ========== 测试账单导入 ==========
+
+class TestLedgerImport:
+    """测试 CSV/OFX 账单批量导入"""
+
+    CSV_TEXT = (
+        "交易时间,交易对方,商品说明,收/支,金额,分类\n"
+        "2024-01-02 12:30:00,星巴克,拿铁,支出,¥35.00,餐饮美食\n"
+        "2024-01-03 09:00:00,公司,工资,收入,10000,\n"
+        "2024-01-04 18:00:00,滴滴出行,打车,支出,\"1,024.50\",\n"
+        ",,,支出,,\n"
+    )
+
+    OFX_TEXT = (
+        "OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>USD\n<BANKTRANLIST>\n"
+        "<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>20240105120000.000[-5:EST]\n<TRNAMT>-12.34\n<NAME>Grocery\n<MEMO>food\n</STMTTRN>\n"
+        "<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>20240106\n<TRNAMT>500.00\n<NAME>Salary\n</STMTTRN>\n"
+        "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n"
+    )
+
+    def test_csv_rows_skip_income_and_empty_lines(self):
+        from app.services.ledger_import import iter_import_rows
+
+        rows = list(iter_import_rows(io.StringIO(self.CSV_TEXT), "csv"))
+
+        assert rows[1] is None and rows[3] is None
+        coffee, taxi = rows[0], rows[2]
+        assert coffee["amount"] == 35.0
+        assert coffee["category"] == "餐饮美食"
+        assert coffee["event_time"] == datetime(2024, 1, 2, 12, 30)
+        assert coffee["raw_text"] == "2024-01-02 12:30 星巴克 拿铁 35.00 CNY"
+        assert taxi["amount"] == 1024.5
+        assert taxi["category"] is None
+
+    def test_csv_without_direction_uses_amount_sign(self):
+        from app.services.ledger_import import iter_import_rows
+
+        # 银行账单：没有收/支列，负数为支出、正数为收入（与上传时相同，经 TextIOWrapper 读取）
+        text = "date,description,amount\n2024-01-02,Coffee,-4.50\n2024-01-03,Salary,3000\n2024-01-04,Taxi,-23\n"
+        stream = io.TextIOWrapper(io.BytesIO(text.encode("utf-8")), encoding="utf-8-sig", newline="")
+
+        rows = list(iter_import_rows(stream, "csv"))
+
+        assert len(rows) == 3
+        assert rows[1] is None
+        assert [rows[0]["amount"], rows[2]["amount"]] == [4.5, 23.0]
+
+    def test_csv_without_direction_all_positive_imports_all(self):
+        from app.services.ledger_import import iter_import_rows
+
+        text = "date,description,amount\n2024-01-02,Coffee,4.50\n2024-01-03,Lunch,30\n"
+
+        rows = list(iter_import_rows(io.StringIO(text), "csv"))
+
+        # 全部为非负金额时视为支出明细
+        assert [row["amount"] for row in rows] == [4.5, 30.0]
+
+    def test_ofx_rows_import_debits_only(self):
+        from app.services.ledger_import import iter_ofx_rows
+
+        rows = list(iter_ofx_rows(io.StringIO(self.OFX_TEXT), chunk_size=64))
+
+        assert rows[1] is None
+        assert rows[0]["amount"] == 12.34
+        assert rows[0]["currency"] == "USD"
+        assert rows[0]["merchant"] == "Grocery"
+        assert rows[0]["event_time"] == datetime(2024, 1, 5, 12, 0)
+
+    def test_csv_without_usable_columns_is_rejected(self):
+        from app.services.ledger_import import LedgerImportError, iter_import_rows
+
+        with pytest.raises(LedgerImportError):
+            list(iter_import_rows(io.StringIO("foo,bar\n1,2\n"), "csv"))
+
+    async def test_insert_batch_groups_pending_rows_by_task(self):
+        from app.services.ledger_import import insert_import_batch
+
+        rows = [
+            {"raw_text": f"商户{i} 10.00 CNY", "amount": 10.0, "currency": "CNY",
+             "category": "餐饮美食" if i == 0 else None, "merchant": f"商户{i}", "event_time": datetime(2024, 1, 2)}
+            for i in range(6)
+        ]
+        session = AsyncMock()
+        insert_result = MagicMock()
+        insert_result.scalars.return_value.all.return_value = [101, 102, 103, 104, 105, 106]
+        session.execute = AsyncMock(return_value=insert_result)
+
+        completed, groups = await insert_import_batch(session, 1, rows, task_size=2)
+
+        assert completed == 1
+        assert [ids for _, ids in groups] == [[102, 103], [104, 105], [106]]
+        # 一条多行 INSERT：已完成和待分析的行使用相同的列，task_id 与投递的任务一致
+        values = session.execute.await_args_list[0].args[1]
+        assert [row["status"] for row in values] == ["completed"] + ["pending"] * 5
+        assert {row["task_id"] for row in values[1:3]} == {groups[0][0]}
+        # 待分析的条目与条目在同一事务中写入发件箱，每个条目一行，同一任务共用 task_id
+        outbox_values = session.execute.await_args_list[3].args[1]
+        assert [row["entry_id"] for row in outbox_values] == [102, 103, 104, 105, 106]
+        assert [row["task_id"] for row in outbox_values[:2]] == [groups[0][0]] * 2
+        assert all(row["payload"] == {"batch": True} for row in outbox_values)
+        # 月度汇总 upsert + 用户计数更新 + 发件箱，整批只提交一次
+        assert session.execute.await_count == 4
+        session.commit.assert_awaited_once()
+
+    def test_import_endpoint(self, client, mock_user, mock_token):
+        async def override_get_current_user():
+            return mock_user
+
+        async def override_get_session():
+            yield AsyncMock()
+
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        stats = {"imported": 2, "completed": 1, "pending": 1, "skipped": 2, "tasks": 1, "truncated": False}
+        try:
+            with patch("app.routers.ledger.import_ledger_file", new_callable=AsyncMock, return_value=stats) as mock_import:
+                response = client.post(
+                    "/ledger/import",
+                    files={"file": ("alipay.csv", self.CSV_TEXT.encode("utf-8"), "text/csv")},
+                    headers={"Authorization": f"Bearer {mock_token}"},
+                )
+
+            assert response.status_code == 200
+            assert response.json() == stats
+            assert mock_import.await_args.args[3] == "csv"
+        finally:
+            app.dependency_overrides.clear()
+
+    def test_import_endpoint_rejects_unknown_format(self, client, mock_user, mock_token):
+        async def override_get_current_user():
+            return mock_user
+
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        try:
+            response = client.post(
+                "/ledger/import",
+                files={"file": ("statement.xlsx", b"data", "application/octet-stream")},
+                headers={"Authorization": f"Bearer {mock_token}"},
+            )
+
+            assert response.status_code == 400
+        finally:
+            app.dependency_overrides.clear()
+
+
+# ========== 测试流式导出 ==========
+
+class TestLedgerExport:
+    """测试 GET /ledger/export"""
+
+    @staticmethod
+    def _export_session_factory(partitions):
+        """模拟服务端游标：stream_scalars 返回按块产出条目的结果"""
+        async def iterate():
+            for partition in partitions:
+                yield partition
+
+        result = MagicMock()
+        result.partitions = MagicMock(side_effect=lambda *args: iterate())
+        session = AsyncMock()
+        session.stream_scalars = AsyncMock(return_value=result)
+        factory = MagicMock()
+        factory.return_value.__aenter__ = AsyncMock(return_value=session)
+        factory.return_value.__aexit__ = AsyncMock(return_value=False)
+        return factory, session
+
+    @staticmethod
+    def _entry(entry_id, category="餐饮美食"):
+        return models.LedgerEntry(
+            id=entry_id,
+            user_id=1,
+            raw_text=f"午饭,{entry_id}",
+            amount=35.0,
+            currency="CNY",
+            category=category,
+            status="completed",
+            event_time=datetime(2024, 1, 2, 12, 0),
+            created_at=datetime(2024, 1, 2, 12, 5),
+        )
+
+    def _override_user(self, mock_user):
+        async def override_get_current_user():
+            return mock_user
+
+        app.dependency_overrides[get_current_user] = override_get_current_user
+
+    def test_export_csv_streams_partitions(self, client, mock_user, mock_token):
+        import csv as csv_module
+
+        self._override_user(mock_user)
+        factory, session = self._export_session_factory([[self._entry(1), self._entry(2)], [self._entry(3)]])
+        with patch("app.services.ledger_export.AsyncSessionLocal", factory):
+            response = client.get(
+                "/ledger/export?category=餐饮美食&start=2024-01-01&end=2024-01-31",
+                headers={"Authorization": f"Bearer {mock_token}"},
+            )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "attachment" in response.headers["content-disposition"]
+        rows = list(csv_module.DictReader(io.StringIO(response.content.decode("utf-8-sig"))))
+        assert [row["id"] for row in rows] == ["1", "2", "3"]
+        assert rows[0]["raw_text"] == "午饭,1"
+        assert rows[0]["event_time"] == "2024-01-02T12:00:00Z"
+        # 使用服务端游标分块读取
+        query = session.stream_scalars.await_args.args[0]
+        assert query.get_execution_options()["yield_per"] == 1000
+
+    def test_export_jsonl(self, client, mock_user, mock_token):
+        import json
+
+        self._override_user(mock_user)
+        factory, _ = self._export_session_factory([[self._entry(1)]])
+        with patch("app.services.ledger_export.AsyncSessionLocal", factory):
+            response = client.get(
+                "/ledger/export?format=jsonl",
+                headers={"Authorization": f"Bearer {mock_token}"},
+            )
+
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert json.loads(lines[0])["category"] == "餐饮美食"
+        assert len(lines) == 1
+
+    @pytest.mark.parametrize("params", [
+        "format=parquet",
+        "category=不存在",
+        "status=unknown",
+        "start=2024-02-01&end=2024-01-01",
+    ])
+    def test_export_rejects_invalid_params(self, client, mock_user, mock_token, params):
+        self._override_user(mock_user)
+
+        response = client.get(f"/ledger/export?{params}", headers={"Authorization": f"Bearer {mock_token}"})
+
+        assert response.status_code == 400
+
+    def test_export_query_filters(self):
+        from sqlalchemy.dialects import postgresql
+        from app.services.ledger_export import build_export_query
+        from datetime import date
+
+        query = build_export_query(1, "餐饮美食", date(2024, 1, 1), date(2024, 1, 31), "completed")
+        compiled = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+        sql = str(compiled)
+
+        assert "coalesce(ledger_entries.event_time, ledger_entries.created_at) >= '2024-01-01 00:00:00'" in sql
+        assert "< '2024-02-01 00:00:00'" in sql
+        assert "ORDER BY ledger_entries.created_at, ledger_entries.id" in sql
@@ -1,23 +1,46 @@
 """
 Ledger Celery 任务测试
 """
+import json
 import pytest
-from unittest.mock import patch, MagicMock, Mock
+from unittest.mock import patch, MagicMock, Mock, AsyncMock
 from datetime import datetime, timezone
 
 from app.tasks.ledger_tasks import (
     merge_text_and_analyze,
     wrap_analyze_text_with_entry_id,
     update_ledger_entry,
-    analyze_ledger_text
+    analyze_ledger_text,
+    mark_entry_processing,
 )
 from app import models
 
 
+@pytest.fixture
+def db_session_factory():
+    """内存 SQLite 数据库，替换任务使用的同步会话"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.db import Base
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with patch("app.tasks.ledger_tasks.SyncSessionLocal", factory):
+        yield factory
+    engine.dispose()
+
+
 # ========== 测试合并文本并分析 ==========
 
 class TestMergeTextAndAnalyze:
     """测试合并文本并分析任务"""
+
+    @pytest.fixture(autouse=True)
+    def mock_mark_processing(self):
+        with patch('app.tasks.ledger_tasks.mark_entry_processing', return_value=True) as mock_mark:
+            yield mock_mark
     
     @patch('app.tasks.ledger_tasks.analyze_ledger_text')
     def test_merge_text_with_original(self, mock_analyze):
@@ -96,9 +119,14 @@ class TestMergeTextAndAnalyze:
 
 class TestWrapAnalyzeText:
     """测试包装分析文本任务"""
+
+    @pytest.fixture(autouse=True)
+    def mock_mark_processing(self):
+        with patch('app.tasks.ledger_tasks.mark_entry_processing', return_value=True) as mock_mark:
+            yield mock_mark
     
     @patch('app.tasks.ledger_tasks.analyze_ledger_text')
-    def test_wrap_analyze_text_success(self, mock_analyze):
+    def test_wrap_analyze_text_success(self, mock_analyze, mock_mark_processing):
         """测试成功包装分析任务"""
         mock_analyze.return_value = {
             "amount": 200.0,
@@ -112,6 +140,8 @@ class TestWrapAnalyzeText:
         assert result["_entry_id"] == 1
         assert result["amount"] == 200.0
         mock_analyze.assert_called_once_with("今天买了200元的东西")
+        # 任务链的分析阶段开始时标记条目为 processing
+        mock_mark_processing.assert_called_once_with(1)
     
     @patch('app.tasks.ledger_tasks.analyze_ledger_text')
     def test_wrap_analyze_text_with_meta(self, mock_analyze):
@@ -137,8 +167,9 @@ class TestWrapAnalyzeText:
 class TestUpdateLedgerEntry:
     """测试更新 ledger 条目任务"""
     
+    @patch('app.tasks.ledger_tasks.publish_ledger_event')
     @patch('app.tasks.ledger_tasks.SyncSessionLocal')
-    def test_update_entry_success(self, mock_session_local):
+    def test_update_entry_success(self, mock_session_local, mock_publish):
         """测试成功更新条目"""
         # Mock 数据库会话
         mock_session = MagicMock()
@@ -177,6 +208,17 @@ class TestUpdateLedgerEntry:
         assert mock_entry.meta["description"] == "测试描述"
         mock_session.commit.assert_called_once()
         mock_session.refresh.assert_called_once()
+        # 完成的条目计入月度汇总
+        rollup_statements = [
+            call.args[0] for call in mock_session.execute.call_args_list
+            if "INSERT INTO ledger_monthly_rollups" in str(call.args[0])
+        ]
+        assert len(rollup_statements) == 1
+        params = rollup_statements[0].compile().params
+        assert params["amount"] == 200.0
+        assert (params["year"], params["month"], params["category"]) == (2024, 1, "餐饮美食")
+        # 提交后推送状态事件
+        mock_publish.assert_called_once_with(mock_entry)
     
     @patch('app.tasks.ledger_tasks.SyncSessionLocal')
     def test_update_entry_with_entry_id_in_result(self, mock_session_local):
@@ -299,7 +341,7 @@ class TestUpdateLedgerEntry:
 class TestAnalyzeLedgerText:
     """测试 LLM 分析任务"""
     
-    @patch('app.tasks.ledger_tasks.OpenAI')
+    @patch('app.services.llm_client.OpenAI')
     @patch('app.tasks.ledger_tasks.settings')
     def test_analyze_ledger_text_success(self, mock_settings, mock_openai_class):
         """测试成功分析文本"""
@@ -326,7 +368,7 @@ class TestAnalyzeLedgerText:
         assert result["event_time"] == "2024-01-15T12:00:00Z"
         assert "meta" in result
     
-    @patch('app.tasks.ledger_tasks.OpenAI')
+    @patch('app.services.llm_client.OpenAI')
     @patch('app.tasks.ledger_tasks.settings')
     def test_analyze_ledger_text_with_markdown_code_block(self, mock_settings, mock_openai_class):
         """测试 LLM 返回包含 markdown 代码块的情况"""
@@ -377,7 +419,7 @@ class TestAnalyzeLedgerText:
             ),
         ],
     )
-    @patch('app.tasks.ledger_tasks.OpenAI')
+    @patch('app.services.llm_client.OpenAI')
     @patch('app.tasks.ledger_tasks.settings')
     def test_analyze_ledger_text_dirty_amount_currency(
         self,
@@ -434,7 +476,7 @@ class TestAnalyzeLedgerText:
         assert result["category"] == "其他"
         assert "LLM_API_KEY 未配置" in result["meta"]["note"]
     
-    @patch('app.tasks.ledger_tasks.OpenAI')
+    @patch('app.services.llm_client.OpenAI')
     @patch('app.tasks.ledger_tasks.settings')
     def test_analyze_ledger_text_invalid_json(self, mock_settings, mock_openai_class):
         """测试 LLM 返回无效 JSON"""
@@ -456,7 +498,7 @@ class TestAnalyzeLedgerText:
         assert result["category"] == "其他"
         assert "LLM API 调用失败" in result["meta"]["note"]
     
-    @patch('app.tasks.ledger_tasks.OpenAI')
+    @patch('app.services.llm_client.OpenAI')
     @patch('app.tasks.ledger_tasks.settings')
     def test_analyze_ledger_text_invalid_time_format(self, mock_settings, mock_openai_class):
         """测试无效的时间格式"""
@@ -479,3 +521,1018 @@ class TestAnalyzeLedgerText:
         assert "T" in result["event_time"]
         assert result["event_time"].endswith("Z")
 
+
+
+# ========== 测试异步等待分析结果 ==========
+
+class TestLedgerAIAnalyze:
+    """测试 ledger_ai.analyze 在事件循环上等待 Celery 结果"""
+
+    @staticmethod
+    def _task_result(task_id="task-1"):
+        from app.celery_app import celery_app
+        return celery_app.AsyncResult(task_id)
+
+    @staticmethod
+    def _encoded_meta(status, result):
+        from app.celery_app import celery_app
+        backend = celery_app.backend
+        if isinstance(result, Exception):
+            result = backend.prepare_exception(result)
+        return backend.encode({"status": status, "result": result, "task_id": "task-1"})
+
+    @patch("app.services.ledger_ai.asyncio.sleep", new_callable=AsyncMock)
+    @patch("app.services.ledger_ai.get_async_redis")
+    @patch("app.services.ledger_ai.analyze_ledger_text")
+    async def test_analyze_polls_until_success(self, mock_task, mock_get_redis, mock_sleep):
+        from app.services.ledger_ai import analyze
+
+        mock_task.delay.return_value = self._task_result()
+        mock_redis = MagicMock()
+        mock_redis.get = AsyncMock(side_effect=[
+            None,
+            self._encoded_meta("STARTED", None),
+            self._encoded_meta("SUCCESS", {"amount": 10}),
+        ])
+        mock_get_redis.return_value = mock_redis
+
+        result = await analyze("午饭 10 元")
+
+        assert result == {"amount": 10}
+        assert mock_redis.get.await_count == 3
+        # 未就绪时按指数退避等待
+        intervals = [call.args[0] for call in mock_sleep.await_args_list]
+        assert intervals == [0.05, 0.1]
+
+    @patch("app.services.ledger_ai.get_async_redis")
+    @patch("app.services.ledger_ai.analyze_ledger_text")
+    async def test_analyze_reraises_task_failure(self, mock_task, mock_get_redis):
+        from app.services.ledger_ai import analyze
+
+        mock_task.delay.return_value = self._task_result()
+        mock_redis = MagicMock()
+        mock_redis.get = AsyncMock(return_value=self._encoded_meta("FAILURE", ValueError("LLM 调用失败")))
+        mock_get_redis.return_value = mock_redis
+
+        with pytest.raises(ValueError, match="LLM 调用失败"):
+            await analyze("午饭 10 元")
+
+    @patch("app.services.ledger_ai.get_async_redis")
+    async def test_wait_for_result_timeout(self, mock_get_redis):
+        from celery.exceptions import TimeoutError as CeleryTimeoutError
+        from app.services.ledger_ai import wait_for_result
+
+        mock_redis = MagicMock()
+        mock_redis.get = AsyncMock(return_value=None)
+        mock_get_redis.return_value = mock_redis
+
+        with pytest.raises(CeleryTimeoutError):
+            await wait_for_result(self._task_result(), timeout=0.01)
+
+
+# ========== 测试批量分析 ==========
+
+class TestAnalyzeLedgerBatch:
+    """测试批量 LLM 分析"""
+
+    def test_chunk_batch_texts_by_size_and_chars(self):
+        from app.tasks.ledger_tasks import chunk_batch_texts
+
+        items = [(1, "a" * 10), (2, "b" * 10), (3, "c" * 10), (4, "d" * 50), (5, "e")]
+
+        batches = chunk_batch_texts(items, max_size=2, max_chars=40)
+
+        assert [[entry_id for entry_id, _ in batch] for batch in batches] == [[1, 2], [3], [4], [5]]
+
+    @patch('app.services.llm_client.OpenAI')
+    @patch('app.tasks.ledger_tasks.settings')
+    def test_analyze_texts_batch_maps_by_index(self, mock_settings, mock_openai_class):
+        from app.tasks.ledger_tasks import analyze_ledger_texts_batch
+
+        mock_settings.llm_provider = "deepseek"
+        mock_settings.llm_api_key = "test_key"
+        mock_settings.llm_api_url = ""
+        mock_client = MagicMock()
+        mock_openai_class.return_value = mock_client
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = (
+            '```json\n'
+            '[{"index": 1, "amount": "-30", "currency": "usd", "category": "不存在的分类"},'
+            ' {"index": 0, "amount": 12.5, "category": "餐饮美食", "event_time": "2024-01-15T10:30:00Z"},'
+            ' {"index": 9, "amount": 1}]\n'
+            '```'
+        )
+        mock_client.chat.completions.create.return_value = mock_response
+
+        results = analyze_ledger_texts_batch(["午饭 12.5", "书 30 美元", "打车"])
+
+        # 三条文本只调用一次模型
+        mock_client.chat.completions.create.assert_called_once()
+        assert results[0]["amount"] == 12.5
+        assert results[0]["event_time"] == "2024-01-15T10:30:00Z"
+        assert results[1]["amount"] == 30.0
+        assert results[1]["currency"] == "USD"
+        assert results[1]["category"] == "其他"
+        assert results[2] is None
+
+    @patch('app.tasks.ledger_tasks.publish_ledger_event')
+    @patch('app.tasks.ledger_tasks.update_ledger_entry')
+    @patch('app.tasks.ledger_tasks.analyze_ledger_text')
+    @patch('app.tasks.ledger_tasks.complete_many')
+    @patch('app.tasks.ledger_tasks.settings')
+    @patch('app.tasks.ledger_tasks.SyncSessionLocal')
+    def test_analyze_batch_fans_out_and_falls_back(
+        self, mock_session_local, mock_settings, mock_complete_many, mock_single, mock_update, mock_publish
+    ):
+        from app.tasks.ledger_tasks import analyze_ledger_batch
+
+        mock_settings.llm_provider = "deepseek"
+        mock_settings.llm_api_key = "test_key"
+        mock_settings.llm_api_url = ""
+        mock_settings.ledger_batch_size = 20
+        mock_settings.ledger_batch_max_chars = 6000
+        entries = [
+            models.LedgerEntry(id=1, user_id=1, raw_text="午饭 12", status="pending"),
+            models.LedgerEntry(id=2, user_id=1, raw_text="看不懂的文本", status="pending"),
+        ]
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.order_by.return_value.all.return_value = entries
+        mock_session_local.return_value = mock_session
+        # 模型只返回了第一条
+        mock_complete_many.return_value = ['[{"index": 0, "amount": 12, "category": "餐饮美食"}]']
+        single_result = {"amount": None, "currency": "CNY", "category": "其他"}
+        mock_single.return_value = single_result
+
+        stats = analyze_ledger_batch([1, 2])
+
+        assert all(entry.status == "processing" for entry in entries)
+        provider, prompts = mock_complete_many.call_args.args
+        assert provider.name == "deepseek"
+        assert len(prompts) == 1
+        assert '"text": "看不懂的文本"' in prompts[0][1]
+        # 批量结果中缺失的条目退回单条分析
+        mock_single.assert_called_once_with("看不懂的文本")
+        written = [call.args[0] for call in mock_update.call_args_list]
+        assert written[0]["amount"] == 12.0
+        assert written[0]["category"] == "餐饮美食"
+        assert written[1] == single_result
+        assert [call.kwargs["entry_id"] for call in mock_update.call_args_list] == [1, 2]
+        assert stats == {
+            "entries": 2, "batches": 1, "fast_path": 0, "cached": 0, "llm_calls": 2, "fallbacks": 1, "failed": 0,
+        }
+
+    @patch('app.tasks.ledger_tasks.publish_ledger_event')
+    @patch('app.tasks.ledger_tasks.update_ledger_entry')
+    @patch('app.tasks.ledger_tasks.set_cached_llm_result')
+    @patch('app.tasks.ledger_tasks.get_cached_llm_results')
+    @patch('app.tasks.ledger_tasks.complete_many')
+    @patch('app.tasks.ledger_tasks.settings')
+    @patch('app.tasks.ledger_tasks.SyncSessionLocal')
+    def test_analyze_batch_uses_llm_cache(
+        self, mock_session_local, mock_settings, mock_complete_many, mock_get_cached, mock_set_cached, mock_update, mock_publish
+    ):
+        from app.tasks.ledger_tasks import analyze_ledger_batch
+
+        mock_settings.llm_provider = "deepseek"
+        mock_settings.llm_api_key = "test_key"
+        mock_settings.llm_api_url = ""
+        mock_settings.ledger_batch_size = 20
+        mock_settings.ledger_batch_max_chars = 6000
+        entries = [
+            models.LedgerEntry(id=i, user_id=1, raw_text=text, status="pending")
+            for i, text in ((1, "看不懂的文本一"), (2, "看不懂的文本二"), (3, "看不懂的文本三"))
+        ]
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.order_by.return_value.all.return_value = entries
+        mock_session_local.return_value = mock_session
+        # 第一条命中缓存，其余两条组成一个批次
+        mock_get_cached.return_value = [{"amount": 8, "category": "餐饮美食"}, None, None]
+        mock_complete_many.return_value = [
+            '[{"index": 0, "amount": 20, "category": "交通出行"}, {"index": 1, "amount": 30, "category": "日用百货"}]'
+        ]
+
+        stats = analyze_ledger_batch([1, 2, 3])
+
+        keys = mock_get_cached.call_args.args[0]
+        assert len(keys) == 3
+        _, prompts = mock_complete_many.call_args.args
+        assert "看不懂的文本一" not in prompts[0][1]
+        written = {call.kwargs["entry_id"]: call.args[0] for call in mock_update.call_args_list}
+        assert written[1]["amount"] == 8.0 and written[1]["meta"]["cached"] is True
+        assert written[2]["category"] == "交通出行"
+        # 批量结果按条写入缓存（原始结果，不含 index），与单条分析共用缓存键
+        assert [call.args for call in mock_set_cached.call_args_list] == [
+            (keys[1], {"amount": 20, "category": "交通出行"}),
+            (keys[2], {"amount": 30, "category": "日用百货"}),
+        ]
+        assert stats["cached"] == 1
+        assert stats["llm_calls"] == 1
+
+    @patch('app.tasks.ledger_tasks.publish_ledger_event')
+    def test_analyze_batch_keeps_imported_amount_and_date(self, mock_publish, db_session_factory, monkeypatch):
+        from app.config import settings
+        from app.tasks.ledger_tasks import analyze_ledger_batch
+
+        # 未配置 LLM 时默认结果的金额为空、时间为当前时间，不能覆盖账单中的数据
+        monkeypatch.setattr(settings, "llm_provider", "")
+        monkeypatch.setattr(settings, "ledger_fast_path_enabled", False)
+        event_time = datetime(2024, 3, 1)
+        with db_session_factory() as session:
+            entry = models.LedgerEntry(
+                user_id=1,
+                raw_text="2024-03-01 00:00 某某超市 1234.56 CNY",
+                amount=1234.56,
+                currency="CNY",
+                merchant="某某超市",
+                event_time=event_time,
+                meta={"source": "import"},
+                status="pending",
+            )
+            session.add(entry)
+            session.commit()
+            entry_id = entry.id
+
+        analyze_ledger_batch([entry_id])
+
+        with db_session_factory() as session:
+            entry = session.get(models.LedgerEntry, entry_id)
+            assert entry.status == "completed"
+            assert entry.amount == 1234.56
+            assert entry.currency == "CNY"
+            assert entry.event_time == event_time
+            assert entry.merchant == "某某超市"
+            assert entry.category == "其他"
+            assert entry.meta["source"] == "import"
+
+    def test_complete_many_runs_concurrently(self, monkeypatch):
+        import time
+        from app.config import settings
+        from app.services.llm_providers import MockLLMProvider, complete_many
+
+        monkeypatch.setattr(settings, "llm_mock_latency", 0.2)
+        monkeypatch.setattr(settings, "llm_max_concurrency", 10)
+
+        started = time.perf_counter()
+        responses = complete_many(MockLLMProvider(), [("prompt", f"午饭 {i + 10}") for i in range(10)])
+        elapsed = time.perf_counter() - started
+
+        # 10 个请求并发执行，总耗时接近单次耗时
+        assert elapsed < 1.0
+        assert [json.loads(response)["amount"] for response in responses] == [float(i + 10) for i in range(10)]
+
+    def test_complete_many_uses_sync_client_and_returns_errors(self, monkeypatch):
+        import asyncio
+        from app.services.llm_providers import LLMProvider, complete_many
+
+        class FlakyProvider(LLMProvider):
+            def complete(self, system_prompt, user_content):
+                if user_content == "bad":
+                    raise RuntimeError("模型超时")
+                return user_content.upper()
+
+        # 不应为批量请求创建事件循环（gevent 池中每个任务一个事件循环会拖垮 worker）
+        monkeypatch.setattr(asyncio, "run", Mock(side_effect=AssertionError("不应调用 asyncio.run")))
+
+        responses = complete_many(FlakyProvider(), [("prompt", "ok"), ("prompt", "bad"), ("prompt", "fine")])
+
+        assert responses[0] == "OK"
+        assert isinstance(responses[1], RuntimeError)
+        assert responses[2] == "FINE"
+
+
+# ========== 测试 LLM 结果缓存 ==========
+
+class TestLLMResultCache:
+    """测试 LLM 解析结果缓存"""
+
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, monkeypatch):
+        from app.config import settings
+        monkeypatch.setattr(settings, "llm_cache_ttl", 3600)
+        monkeypatch.setattr(settings, "llm_cache_max_entries", 2)
+
+    def test_cache_key_normalizes_text(self):
+        from app.services.llm_cache import llm_cache_key
+
+        key = llm_cache_key("咖啡  25", "prompt", "model")
+
+        assert key == llm_cache_key("  咖啡 25 ", "prompt", "model")
+        assert key == llm_cache_key("咖啡　25", "prompt", "model")
+        assert key != llm_cache_key("咖啡 25", "prompt v2", "model")
+        assert key != llm_cache_key("咖啡 26", "prompt", "model")
+
+    @patch('app.services.llm_cache.get_sync_redis')
+    def test_set_evicts_oldest_entries(self, mock_get_redis):
+        from app.services.llm_cache import set_cached_llm_result, CACHE_INDEX_KEY
+
+        mock_redis = MagicMock()
+        mock_get_redis.return_value = mock_redis
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [True, 1, 3]
+        mock_redis.zrange.return_value = [b"llm:ledger:old"]
+
+        set_cached_llm_result("llm:ledger:new", {"amount": 25})
+
+        pipe.set.assert_called_once_with("llm:ledger:new", '{"amount": 25}', ex=3600)
+        mock_redis.zrange.assert_called_once_with(CACHE_INDEX_KEY, 0, 0)
+        pipe.delete.assert_called_once_with(b"llm:ledger:old")
+        pipe.zrem.assert_called_once_with(CACHE_INDEX_KEY, b"llm:ledger:old")
+
+    @patch('app.services.llm_cache.get_sync_redis')
+    @patch('app.services.llm_client.OpenAI')
+    @patch('app.tasks.ledger_tasks.settings')
+    def test_analyze_uses_cache(self, mock_settings, mock_openai_class, mock_get_redis):
+        from app.services.llm_cache import CACHE_HITS_KEY, CACHE_MISSES_KEY
+
+        mock_settings.llm_provider = "deepseek"
+        mock_settings.llm_api_key = "test_key"
+        mock_settings.llm_api_url = "https://api.deepseek.com"
+        mock_redis = MagicMock()
+        mock_get_redis.return_value = mock_redis
+        mock_redis.pipeline.return_value.execute.return_value = [True, 1, 1]
+        mock_client = MagicMock()
+        mock_openai_class.return_value = mock_client
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = '{"amount": 25, "currency": "CNY", "category": "餐饮美食"}'
+        mock_client.chat.completions.create.return_value = mock_response
+
+        # 未命中：调用 LLM 并写入原始结果
+        mock_redis.get.return_value = None
+        first = analyze_ledger_text("咖啡 25")
+        mock_redis.incr.assert_called_with(CACHE_MISSES_KEY)
+        stored = mock_redis.pipeline.return_value.set.call_args.args[1]
+
+        # 命中：不再调用 LLM，结果重新校验
+        mock_redis.get.return_value = stored.encode("utf-8")
+        second = analyze_ledger_text("咖啡 25")
+        mock_redis.incr.assert_called_with(CACHE_HITS_KEY)
+
+        mock_client.chat.completions.create.assert_called_once()
+        assert second["amount"] == first["amount"] == 25.0
+        assert second["category"] == "餐饮美食"
+        assert second["meta"]["cached"] is True
+
+    @patch('app.services.llm_cache.get_sync_redis')
+    def test_get_many_uses_one_mget(self, mock_get_redis):
+        from app.services.llm_cache import CACHE_HITS_KEY, CACHE_MISSES_KEY, get_cached_llm_results
+
+        mock_redis = mock_get_redis.return_value
+        mock_redis.mget.return_value = [b'{"amount": 25}', None, None]
+
+        assert get_cached_llm_results(["a", "b", "c"]) == [{"amount": 25}, None, None]
+        mock_redis.mget.assert_called_once_with(["a", "b", "c"])
+        mock_redis.get.assert_not_called()
+        pipe = mock_redis.pipeline.return_value
+        pipe.incrby.assert_any_call(CACHE_HITS_KEY, 1)
+        pipe.incrby.assert_any_call(CACHE_MISSES_KEY, 2)
+
+    @patch('app.services.llm_cache.get_sync_redis')
+    def test_cache_failure_is_a_miss(self, mock_get_redis):
+        from app.services.llm_cache import get_cached_llm_result
+
+        mock_get_redis.return_value.get.side_effect = ConnectionError("redis down")
+
+        assert get_cached_llm_result("llm:ledger:x") is None
+
+
+# ========== 测试规则解析快速路径 ==========
+
+class TestLedgerFastPath:
+    """测试规则解析快速路径"""
+
+    NOW = datetime(2024, 3, 5, 8, 30, 0, tzinfo=timezone.utc)
+
+    @pytest.fixture
+    def shanghai(self):
+        from zoneinfo import ZoneInfo
+
+        return ZoneInfo("Asia/Shanghai")
+
+    # NOW 在上海时间为 2024-03-05 16:30，输入中的日期时间按本地时间理解，结果为 UTC
+    @pytest.mark.parametrize("text,amount,currency,category,event_time", [
+        ("午饭 35", 35.0, "CNY", "餐饮美食", "2024-03-05T08:30:00Z"),
+        ("taxi $12.5", 12.5, "USD", "交通出行", "2024-03-05T08:30:00Z"),
+        ("2024-03-01 超市 128.4元", 128.4, "CNY", "日用百货", "2024-03-01T08:30:00Z"),
+        ("３月２日 打车 ２３块", 23.0, "CNY", "交通出行", "2024-03-02T08:30:00Z"),
+        ("昨天 19:30 火锅 268", 268.0, "CNY", "餐饮美食", "2024-03-04T11:30:00Z"),
+        ("奶茶 2杯 30", 30.0, "CNY", "餐饮美食", "2024-03-05T08:30:00Z"),
+        ("1,299.00 手机", 1299.0, "CNY", "数码电器", "2024-03-05T08:30:00Z"),
+        ("午饭 rmb35", 35.0, "CNY", "餐饮美食", "2024-03-05T08:30:00Z"),
+        ("taxi usd12.5", 12.5, "USD", "交通出行", "2024-03-05T08:30:00Z"),
+    ])
+    def test_parse_simple_inputs(self, text, amount, currency, category, event_time, shanghai):
+        from app.services.ledger_parser import parse_ledger_text_fast
+
+        result = parse_ledger_text_fast(text, now=self.NOW, tz=shanghai)
+
+        assert result["amount"] == amount
+        assert result["currency"] == currency
+        assert result["category"] == category
+        assert result["event_time"] == event_time
+        assert result["meta"]["model"] == "rules"
+        assert result["meta"]["confidence"] >= 0.8
+
+    def test_relative_dates_use_local_day_near_midnight(self, shanghai):
+        from app.services.ledger_parser import parse_ledger_text_fast
+
+        # UTC 2024-03-04 17:00 在上海已经是 3 月 5 日 01:00
+        now = datetime(2024, 3, 4, 17, 0, 0, tzinfo=timezone.utc)
+
+        assert parse_ledger_text_fast("今天 午饭 35", now=now, tz=shanghai)["event_time"] == "2024-03-04T17:00:00Z"
+        assert parse_ledger_text_fast("昨天 火锅 268", now=now, tz=shanghai)["event_time"] == "2024-03-03T17:00:00Z"
+        assert parse_ledger_text_fast("今天 23:30 火锅 100", now=now, tz=shanghai)["event_time"] == "2024-03-05T15:30:00Z"
+        assert parse_ledger_text_fast("2024-03-05 00:10 午饭 35", now=now, tz=shanghai)["event_time"] == "2024-03-04T16:10:00Z"
+
+    def test_low_confidence_inputs(self):
+        from app.services.ledger_parser import parse_ledger_text_fast
+
+        # 没有金额或金额有歧义
+        assert parse_ledger_text_fast("买了点东西", now=self.NOW) is None
+        assert parse_ledger_text_fast("咖啡 25 和 面包 10", now=self.NOW) is None
+        # 无法判断分类
+        assert parse_ledger_text_fast("iphone15 5000", now=self.NOW)["meta"]["confidence"] < 0.8
+
+    def test_try_fast_parse_respects_settings(self, monkeypatch):
+        from app.config import settings
+        from app.services.ledger_parser import try_fast_parse
+
+        monkeypatch.setattr(settings, "ledger_fast_path_enabled", True)
+        monkeypatch.setattr(settings, "ledger_fast_path_min_confidence", 0.8)
+        assert try_fast_parse("午饭 35")["amount"] == 35.0
+        assert try_fast_parse("iphone15 5000") is None
+
+        monkeypatch.setattr(settings, "ledger_fast_path_enabled", False)
+        assert try_fast_parse("午饭 35") is None
+
+    @patch('app.services.llm_client.OpenAI')
+    def test_analyze_skips_llm_for_simple_input(self, mock_openai_class, monkeypatch):
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "ledger_fast_path_enabled", True)
+
+        result = analyze_ledger_text("午饭 35")
+
+        mock_openai_class.assert_not_called()
+        assert result["amount"] == 35.0
+        assert result["category"] == "餐饮美食"
+
+
+# ========== 测试进程级 LLM 客户端 ==========
+
+class TestLLMClientRegistry:
+    """测试 LLM 客户端复用"""
+
+    def test_client_is_reused(self):
+        from app.services.llm_client import get_llm_client
+
+        client = get_llm_client("key", "http://127.0.0.1:9/v1")
+
+        assert get_llm_client("key", "http://127.0.0.1:9/v1") is client
+        assert get_llm_client("other", "http://127.0.0.1:9/v1") is not client
+
+    def test_client_uses_configured_retries_and_timeouts(self, monkeypatch):
+        from app.config import settings
+        from app.services.llm_client import get_llm_client
+
+        monkeypatch.setattr(settings, "llm_max_retries", 5)
+        monkeypatch.setattr(settings, "llm_timeout", 12)
+        monkeypatch.setattr(settings, "llm_connect_timeout", 3)
+
+        client = get_llm_client("key", "http://127.0.0.1:9/v1")
+
+        assert client.max_retries == 5
+        assert client.timeout.read == 12
+        assert client.timeout.connect == 3
+
+    @patch('app.services.llm_client.OpenAI')
+    @patch('app.tasks.ledger_tasks.settings')
+    def test_analyze_reuses_client_across_calls(self, mock_settings, mock_openai_class):
+        mock_settings.llm_provider = "deepseek"
+        mock_settings.llm_api_key = "test_key"
+        mock_settings.llm_api_url = "https://api.deepseek.com"
+        mock_client = MagicMock()
+        mock_openai_class.return_value = mock_client
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = '{"amount": 25, "currency": "CNY", "category": "餐饮美食"}'
+        mock_client.chat.completions.create.return_value = mock_response
+
+        analyze_ledger_text("咖啡 25")
+        analyze_ledger_text("奶茶 18")
+
+        mock_openai_class.assert_called_once()
+        assert mock_client.chat.completions.create.call_count == 2
+
+    def test_clients_closed_on_worker_shutdown(self):
+        from celery.signals import worker_shutdown
+        from app.celery_app import celery_app
+
+        # gevent/solo 池不触发 worker_process_shutdown，主进程退出时也要关闭客户端
+        with patch('app.services.llm_client.close_llm_clients') as mock_close:
+            worker_shutdown.send(sender=celery_app)
+
+        mock_close.assert_called_once()
+
+
+# ========== 测试 LLM 提供商 ==========
+
+class TestLLMProviders:
+    """测试 LLM 提供商选择"""
+
+    def test_create_known_providers(self):
+        from app.services.llm_providers import create_llm_provider
+
+        deepseek = create_llm_provider("deepseek", "key")
+        assert deepseek.model == "deepseek-chat"
+        assert deepseek.base_url == "https://api.deepseek.com"
+        openai_compatible = create_llm_provider("openai", "key", "http://127.0.0.1:8000/v1")
+        assert openai_compatible.base_url == "http://127.0.0.1:8000/v1"
+        assert create_llm_provider("mock").requires_api_key is False
+
+    def test_unknown_provider(self):
+        from app.services.llm_providers import create_llm_provider
+
+        with pytest.raises(ValueError, match="不支持的 LLM 提供商"):
+            create_llm_provider("unknown")
+
+    @patch('app.tasks.ledger_tasks.settings')
+    def test_analyze_with_mock_provider(self, mock_settings):
+        mock_settings.llm_provider = "mock"
+        mock_settings.llm_api_key = None
+        mock_settings.llm_api_url = None
+
+        result = analyze_ledger_text("打车 23")
+
+        assert result["amount"] == 23.0
+        assert result["category"] == "交通出行"
+        assert result["meta"]["model"] == "mock"
+
+
+# ========== 测试融合处理任务 ==========
+
+class TestProcessLedgerEntry:
+    """测试单任务完成 OCR/分析/更新"""
+
+    @pytest.fixture(autouse=True)
+    def mock_mark_processing(self):
+        with patch('app.tasks.ledger_tasks.mark_entry_processing', return_value=True) as mock_mark:
+            yield mock_mark
+
+    @patch('app.tasks.ledger_tasks.update_ledger_entry')
+    @patch('app.tasks.ledger_tasks.analyze_ledger_text')
+    @patch('app.tasks.ledger_tasks.extract_text_from_image_task')
+    def test_process_image_entry(self, mock_ocr, mock_analyze, mock_update, mock_mark_processing):
+        from app.tasks.ledger_tasks import process_ledger_entry
+
+        mock_ocr.return_value = "小票 合计 88.00"
+        mock_analyze.return_value = {"amount": 88.0, "meta": {"model": "deepseek-chat"}}
+        mock_update.return_value = {"status": "completed", "entry_id": 7}
+
+        result = process_ledger_entry(7, None, "uploads/images/a.png", "聚餐")
+
+        mock_ocr.assert_called_once_with("uploads/images/a.png")
+        # OCR 文本交给合并分析阶段
+        assert mock_analyze.call_args.args[0].endswith("小票 合计 88.00")
+        mock_mark_processing.assert_called_once_with(7)
+        ai_result = mock_update.call_args.args[0]
+        assert mock_update.call_args.kwargs["entry_id"] == 7
+        assert ai_result["meta"]["model"] == "deepseek-chat"
+        # 写回阶段补充 update_ms / total_ms 后一起保存到条目
+        assert set(mock_update.call_args.kwargs["timings"]) == {"ocr_ms", "analyze_ms"}
+        assert result["status"] == "completed"
+
+    @patch('app.tasks.ledger_tasks.update_ledger_entry')
+    @patch('app.tasks.ledger_tasks.analyze_ledger_text')
+    @patch('app.tasks.ledger_tasks.extract_text_from_image_task')
+    def test_process_text_entry_skips_ocr(self, mock_ocr, mock_analyze, mock_update):
+        from app.tasks.ledger_tasks import process_ledger_entry
+
+        mock_analyze.return_value = {"amount": 35.0}
+        mock_update.return_value = {"status": "completed", "entry_id": 8}
+
+        process_ledger_entry(8, "午饭 35")
+
+        mock_ocr.assert_not_called()
+        mock_analyze.assert_called_once_with("午饭 35")
+        assert "ocr_ms" not in mock_update.call_args.kwargs["timings"]
+
+    @patch('app.tasks.ledger_tasks.update_ledger_entry')
+    @patch('app.tasks.ledger_tasks.analyze_ledger_text')
+    def test_process_skips_finished_entry(self, mock_analyze, mock_update, mock_mark_processing):
+        from app.tasks.ledger_tasks import process_ledger_entry
+
+        mock_mark_processing.return_value = False
+
+        result = process_ledger_entry(10, "午饭 35")
+
+        assert result == {"status": "skipped", "entry_id": 10}
+        mock_analyze.assert_not_called()
+        mock_update.assert_not_called()
+
+    @patch('app.tasks.ledger_tasks.publish_ledger_event')
+    @patch('app.tasks.ledger_tasks.analyze_ledger_text')
+    def test_process_stores_all_timings_on_entry(self, mock_analyze, mock_publish, db_session_factory, mock_mark_processing):
+        from app.tasks.ledger_tasks import process_ledger_entry
+
+        mock_mark_processing.side_effect = mark_entry_processing
+        published = []
+        mock_publish.side_effect = lambda entry: published.append(entry.status)
+        mock_analyze.return_value = {"amount": 35.0, "category": "餐饮美食", "meta": {"model": "mock"}}
+        with db_session_factory() as session:
+            user = models.User(email="timings@example.com", hashed_password="x")
+            session.add(user)
+            session.flush()
+            entry = models.LedgerEntry(user_id=user.id, raw_text="午饭 35", status="pending")
+            session.add(entry)
+            session.commit()
+            entry_id = entry.id
+
+        result = process_ledger_entry(entry_id, "午饭 35")
+
+        # 开始时先推送 processing 状态
+        assert published == ["processing", "completed"]
+        with db_session_factory() as session:
+            entry = session.get(models.LedgerEntry, entry_id)
+            assert entry.status == "completed"
+            assert set(entry.meta["timings"]) == {"analyze_ms", "update_ms", "total_ms"}
+            assert entry.meta["timings"] == result["timings"]
+
+    @patch('app.tasks.ledger_tasks.publish_ledger_event')
+    @patch('app.tasks.ledger_tasks.extract_text_from_image_task')
+    @patch('app.tasks.ledger_tasks.SyncSessionLocal')
+    def test_process_marks_failed_when_ocr_fails(self, mock_session_local, mock_ocr, mock_publish):
+        from app.tasks.ledger_tasks import process_ledger_entry
+
+        mock_ocr.side_effect = FileNotFoundError("图片文件不存在")
+        entry = models.LedgerEntry(id=9, user_id=1, raw_text="", status="processing")
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.first.return_value = entry
+        mock_session_local.return_value = mock_session
+
+        with pytest.raises(FileNotFoundError):
+            process_ledger_entry(9, None, "missing.png")
+
+        assert entry.status == "failed"
+        mock_session.commit.assert_called_once()
+        mock_publish.assert_called_once_with(entry)
+
+    def test_build_pipeline_modes(self, monkeypatch):
+        from app.config import settings
+        from app.tasks.dispatch import build_ledger_pipeline
+
+        monkeypatch.setattr(settings, "ledger_pipeline", "fused")
+        signature = build_ledger_pipeline(1, "午饭 35")
+        assert signature.task == "ledger.process_entry"
+        assert list(signature.args) == [1, "午饭 35", None, None]
+
+        monkeypatch.setattr(settings, "ledger_pipeline", "chain")
+        signature = build_ledger_pipeline(1, None, "a.png", "聚餐")
+        assert [task.task for task in signature.tasks] == [
+            "ocr.extract_text", "ledger.merge_and_analyze", "ledger.update_entry"
+        ]
+
+
+# ========== 测试任务路由 ==========
+
+class TestCeleryRouting:
+    """测试任务队列路由"""
+
+    @pytest.mark.parametrize("task_name,queue", [
+        ("ocr.extract_text", "ocr"),
+        ("ledger.analyze_text", "llm"),
+        ("ledger.merge_and_analyze", "llm"),
+        ("ledger.process_entry", "llm"),
+        ("ledger.update_entry", "db"),
+        ("ledger.reap_stale_entries", "maintenance"),
+        ("app.tasks.file_tasks.cleanup_orphan_files", "maintenance"),
+        ("test.echo", "celery"),
+    ])
+    def test_task_routes(self, task_name, queue):
+        from app.celery_app import celery_app
+
+        route = celery_app.amqp.router.route({}, task_name)
+
+        assert route["queue"].name == queue
+
+    def test_fused_image_entry_goes_to_ocr_queue(self, monkeypatch):
+        from app.config import settings
+        from app.tasks.dispatch import build_ledger_pipeline
+
+        monkeypatch.setattr(settings, "ledger_pipeline", "fused")
+
+        assert build_ledger_pipeline(1, None, "a.png").options["queue"] == "ocr"
+        assert "queue" not in build_ledger_pipeline(1, "午饭 35").options
+
+
+# ========== 测试结果存储策略 ==========
+
+class TestResultPolicy:
+    """只有需要读取返回值的任务写入结果后端"""
+
+    def test_fire_and_forget_tasks_ignore_result(self):
+        from app.celery_app import celery_app
+        import app.tasks.file_tasks  # noqa: F401  注册 cleanup_orphan_files
+
+        for name in (
+            "ocr.extract_text",
+            "ledger.merge_and_analyze",
+            "ledger.wrap_analyze_text",
+            "ledger.update_entry",
+            "ledger.process_entry",
+            "ledger.analyze_batch",
+            "ledger.reap_stale_entries",
+            "app.tasks.file_tasks.cleanup_orphan_files",
+        ):
+            assert celery_app.tasks[name].ignore_result is True, name
+
+    def test_awaited_tasks_keep_result(self):
+        from app.celery_app import celery_app
+
+        assert celery_app.tasks["ledger.analyze_text"].ignore_result is False
+        assert celery_app.conf.result_expires == 3600
+
+
+# ========== 测试任务发件箱 ==========
+
+class TestLedgerOutbox:
+    """测试发件箱中继的批量投递和失败重试"""
+
+    @staticmethod
+    def _outbox_row(row_id, entry_id, attempts=0):
+        return models.LedgerTaskOutbox(
+            id=row_id,
+            entry_id=entry_id,
+            task_id=f"task-{row_id}",
+            payload={"raw_text": f"午饭 {row_id}", "image_path": None, "original_text": None},
+            attempts=attempts,
+        )
+
+    @staticmethod
+    def _session_factory(rows, entries=(), group_sizes=None):
+        """
+        返回 (session_factory, session)：第一次查询返回各任务的记录数（默认按 rows 统计），
+        第二次返回锁定的发件箱记录，之后的查询返回 entries
+        """
+        session = AsyncMock()
+        if group_sizes is None:
+            group_sizes = {}
+            for row in rows:
+                group_sizes[row.task_id] = group_sizes.get(row.task_id, 0) + 1
+        group_result = MagicMock()
+        group_result.all.return_value = list(group_sizes.items())
+        outbox_result = MagicMock()
+        outbox_result.scalars.return_value.all.return_value = rows
+        entry_result = MagicMock()
+        entry_result.scalars.return_value.all.return_value = list(entries)
+        results = iter([group_result, outbox_result])
+        session.execute = AsyncMock(side_effect=lambda *args, **kwargs: next(results, entry_result))
+        factory = MagicMock()
+        factory.return_value.__aenter__ = AsyncMock(return_value=session)
+        factory.return_value.__aexit__ = AsyncMock(return_value=False)
+        return factory, session
+
+    @patch("app.tasks.dispatch.dispatch_ledger_pipeline")
+    def test_publish_rows_share_one_producer(self, mock_dispatch):
+        from app.celery_app import celery_app
+        from app.services.ledger_outbox import publish_outbox_rows
+
+        rows = [self._outbox_row(1, 10), self._outbox_row(2, 20)]
+        mock_dispatch.side_effect = [None, ConnectionError("broker down")]
+        producer = MagicMock()
+        with patch.object(celery_app, "producer_or_acquire") as mock_acquire:
+            mock_acquire.return_value.__enter__.return_value = producer
+            errors = publish_outbox_rows(rows)
+
+        assert errors == {1: None, 2: "broker down"}
+        mock_acquire.assert_called_once()
+        assert [call.kwargs["producer"] for call in mock_dispatch.call_args_list] == [producer, producer]
+        mock_dispatch.assert_any_call("task-1", 10, "午饭 1", None, None, producer=producer)
+
+    @patch("app.tasks.dispatch.dispatch_ledger_batch")
+    @patch("app.tasks.dispatch.dispatch_ledger_pipeline")
+    def test_publish_groups_batch_rows_by_task(self, mock_dispatch, mock_dispatch_batch):
+        from app.celery_app import celery_app
+        from app.services.ledger_outbox import BATCH_PAYLOAD, publish_outbox_rows
+
+        rows = [self._outbox_row(1, 10)] + [
+            models.LedgerTaskOutbox(id=row_id, entry_id=entry_id, task_id="import-task", payload=dict(BATCH_PAYLOAD), attempts=0)
+            for row_id, entry_id in ((2, 20), (3, 30))
+        ]
+        with patch.object(celery_app, "producer_or_acquire") as mock_acquire:
+            producer = mock_acquire.return_value.__enter__.return_value
+            errors = publish_outbox_rows(rows)
+
+        assert errors == {1: None, 2: None, 3: None}
+        mock_dispatch.assert_called_once()
+        # 同一 task_id 的导入条目合并为一个批量分析任务
+        mock_dispatch_batch.assert_called_once_with("import-task", [20, 30], producer=producer)
+
+    @patch("app.services.ledger_outbox.publish_outbox_rows")
+    async def test_relay_marks_sent_and_counts_failures(self, mock_publish):
+        from app.services.ledger_outbox import relay_outbox_batch
+
+        rows = [self._outbox_row(1, 10), self._outbox_row(2, 20)]
+        factory, session = self._session_factory(rows)
+
+        def publish(claimed_rows):
+            # 认领已提交：投递期间不持有行锁和连接
+            assert session.commit.await_count == 1
+            return {1: None, 2: "broker down"}
+
+        mock_publish.side_effect = publish
+
+        claimed, sent = await relay_outbox_batch(factory, batch_size=50)
+
+        assert (claimed, sent) == (2, 1)
+        # 先按 task_id 统计可认领的任务，再用 SKIP LOCKED 锁定这些任务的记录，并跳过其他中继认领未到期的记录
+        group_stmt = session.execute.await_args_list[0].args[0]
+        assert "GROUP BY ledger_task_outbox.task_id" in str(group_stmt)
+        claim_stmt = session.execute.await_args_list[1].args[0]
+        assert claim_stmt._for_update_arg.skip_locked is True
+        assert "claimed_until" in str(claim_stmt)
+        claim_update = session.execute.await_args_list[2].args[0]
+        assert "claimed_until" in str(claim_update)
+        # 统计 + 认领 + 设置认领期限 + 标记 sent_at + 失败记录增加重试次数
+        assert session.execute.await_count == 5
+        assert rows[1].attempts == 1
+        assert rows[1].last_error == "broker down"
+        assert session.commit.await_count == 2
+
+    @patch("app.services.ledger_outbox.publish_outbox_rows")
+    async def test_relay_claims_whole_batch_groups(self, mock_publish):
+        from app.services.ledger_outbox import BATCH_PAYLOAD, relay_outbox_batch
+
+        def batch_row(row_id, entry_id, task_id):
+            return models.LedgerTaskOutbox(
+                id=row_id, entry_id=entry_id, task_id=task_id, payload=dict(BATCH_PAYLOAD), attempts=0,
+            )
+
+        # import-b 有 3 行未投递，其中 1 行已被其他中继锁定（SKIP LOCKED 未返回）
+        rows = [batch_row(1, 10, "import-a"), batch_row(2, 20, "import-a"), batch_row(3, 30, "import-b"), batch_row(4, 40, "import-b")]
+        factory, session = self._session_factory(rows, group_sizes={"import-a": 2, "import-b": 3})
+        mock_publish.side_effect = lambda claimed_rows: {row.id: None for row in claimed_rows}
+
+        claimed, sent = await relay_outbox_batch(factory, batch_size=2)
+
+        # 只投递完整的任务组，不完整的组留到下一轮整组认领
+        assert (claimed, sent) == (2, 2)
+        assert [row.id for row in mock_publish.call_args.args[0]] == [1, 2]
+        claim_update = session.execute.await_args_list[2].args[0]
+        assert sorted(claim_update.compile().params["id_1"]) == [1, 2]
+
+    @patch("app.services.ledger_outbox.publish_ledger_event")
+    @patch("app.services.ledger_outbox.publish_outbox_rows")
+    async def test_relay_fails_entry_after_max_attempts(self, mock_publish, mock_event, monkeypatch):
+        from app.config import settings
+        from app.services.ledger_outbox import relay_outbox_batch
+
+        monkeypatch.setattr(settings, "ledger_outbox_max_attempts", 3)
+        row = self._outbox_row(1, 10, attempts=2)
+        entry = models.LedgerEntry(id=10, user_id=1, raw_text="午饭", status="pending")
+        mock_publish.return_value = {1: "broker down"}
+        factory, session = self._session_factory([row], entries=[entry])
+
+        claimed, sent = await relay_outbox_batch(factory)
+
+        assert (claimed, sent) == (1, 0)
+        assert row.attempts == 3
+        assert entry.status == "failed"
+        mock_event.assert_called_once_with(entry)
+
+    async def test_drain_stops_after_failed_batch(self, monkeypatch):
+        from app.config import settings
+        from app.services.ledger_outbox import OutboxRelay
+
+        monkeypatch.setattr(settings, "ledger_outbox_batch_size", 2)
+        relay = OutboxRelay(session_factory=MagicMock())
+        with patch(
+            "app.services.ledger_outbox.relay_outbox_batch",
+            new_callable=AsyncMock,
+            side_effect=[(2, 2), (2, 0), (1, 1)],
+        ) as mock_batch:
+            assert await relay.drain() == (4, 2)
+
+        assert mock_batch.await_count == 2
+
+    async def test_purge_runs_on_interval_while_busy(self, monkeypatch):
+        import asyncio
+        from app.config import settings
+        from app.services.ledger_outbox import OutboxRelay
+
+        monkeypatch.setattr(settings, "ledger_outbox_poll_interval", 0.01)
+        relay = OutboxRelay(session_factory=MagicMock())
+        relay.PURGE_INTERVAL = 0.02
+        # 每轮都有记录投递（从不空闲），仍然按时间间隔清理
+        with patch.object(relay, "drain", new_callable=AsyncMock, return_value=(1, 1)), \
+             patch("app.services.ledger_outbox.purge_sent_outbox", new_callable=AsyncMock, return_value=0) as mock_purge:
+            relay.start()
+            await asyncio.sleep(0.2)
+            await relay.stop()
+
+        assert mock_purge.await_count >= 2
+
+    def test_notify_without_running_relay_is_noop(self):
+        from app.services.ledger_outbox import OutboxRelay
+
+        OutboxRelay(session_factory=MagicMock()).notify()
+
+
+# ========== 测试卡住条目回收 ==========
+
+class TestReapStaleEntries:
+    """测试定时回收长时间未完成的条目"""
+
+    @staticmethod
+    def _add_entry(session, minutes_ago, status="pending", task_id="old-task", raw_text="午饭 35", redispatch_attempts=0):
+        from datetime import timedelta
+
+        updated_at = models.utc_now() - timedelta(minutes=minutes_ago)
+        entry = models.LedgerEntry(
+            user_id=1,
+            raw_text=raw_text,
+            status=status,
+            task_id=task_id,
+            redispatch_attempts=redispatch_attempts,
+            created_at=updated_at,
+            updated_at=updated_at,
+        )
+        session.add(entry)
+        session.flush()
+        return entry
+
+    @patch("app.tasks.ledger_tasks.publish_ledger_event")
+    def test_redispatches_stale_entries_through_outbox(self, mock_publish, db_session_factory):
+        from app.tasks.ledger_tasks import reap_stale_entries
+
+        with db_session_factory() as session:
+            stale = self._add_entry(session, minutes_ago=60, status="processing", raw_text="")
+            session.add(models.LedgerTaskOutbox(
+                entry_id=stale.id,
+                task_id="old-task",
+                payload={"raw_text": None, "image_path": "uploads/images/a.png", "original_text": "聚餐"},
+                sent_at=models.utc_now(),
+            ))
+            fresh = self._add_entry(session, minutes_ago=1, status="processing")
+            done = self._add_entry(session, minutes_ago=60, status="completed")
+            session.commit()
+            stale_id, fresh_id, done_id = stale.id, fresh.id, done.id
+
+        stats = reap_stale_entries()
+
+        assert stats == {"stale": 1, "redispatched": 1, "failed": 0}
+        with db_session_factory() as session:
+            entry = session.get(models.LedgerEntry, stale_id)
+            assert entry.status == "pending"
+            assert entry.task_id != "old-task"
+            assert entry.redispatch_attempts == 1
+            new_row = session.query(models.LedgerTaskOutbox).filter_by(task_id=entry.task_id).one()
+            # 重新投递沿用上次的输入，由发件箱中继发送
+            assert new_row.sent_at is None
+            assert new_row.payload["image_path"] == "uploads/images/a.png"
+            assert session.get(models.LedgerEntry, fresh_id).task_id == "old-task"
+            assert session.get(models.LedgerEntry, done_id).status == "completed"
+        mock_publish.assert_not_called()
+
+    @patch("app.tasks.ledger_tasks.publish_ledger_event")
+    def test_leaves_queued_entries_and_fails_exhausted_entries(self, mock_publish, db_session_factory, monkeypatch):
+        from app.config import settings
+        from app.tasks.ledger_tasks import reap_stale_entries
+
+        monkeypatch.setattr(settings, "ledger_max_redispatch", 2)
+        with db_session_factory() as session:
+            # 队列积压时 pending 条目的消息仍在 broker 中等待，不视为卡住
+            queued = self._add_entry(session, minutes_ago=600)
+            session.add(models.LedgerTaskOutbox(
+                entry_id=queued.id, task_id="old-task", payload={"raw_text": "午饭 35"}, sent_at=models.utc_now(),
+            ))
+            exhausted = self._add_entry(session, minutes_ago=60, status="processing", redispatch_attempts=2)
+            session.commit()
+            queued_id, exhausted_id = queued.id, exhausted.id
+
+        stats = reap_stale_entries()
+
+        assert stats == {"stale": 1, "redispatched": 0, "failed": 1}
+        with db_session_factory() as session:
+            queued = session.get(models.LedgerEntry, queued_id)
+            assert queued.status == "pending"
+            assert queued.task_id == "old-task"
+            assert queued.redispatch_attempts == 0
+            assert session.get(models.LedgerEntry, exhausted_id).status == "failed"
+        assert mock_publish.call_count == 1
+
+    @patch("app.tasks.ledger_tasks.publish_ledger_event")
+    def test_started_task_refreshes_staleness(self, mock_publish, db_session_factory):
+        from app.tasks.ledger_tasks import reap_stale_entries
+
+        with db_session_factory() as session:
+            entry = self._add_entry(session, minutes_ago=600)
+            session.commit()
+            entry_id = entry.id
+
+        # worker 开始执行时刷新 updated_at，之后的回收不会处理该条目
+        assert mark_entry_processing(entry_id) is True
+        assert reap_stale_entries()["stale"] == 0
+        with db_session_factory() as session:
+            assert session.get(models.LedgerEntry, entry_id).status == "processing"
@@ -257,6 +257,133 @@ class TestListNotes:
         finally:
             app.dependency_overrides.clear()
     
+    def test_list_notes_search_uses_search_text(
+        self,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试搜索在数据库中匹配 search_text，而不是在 Python 层过滤"""
+        executed_queries = []
+        
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            mock_session = AsyncMock()
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = []
+            
+            async def mock_execute(query):
+                executed_queries.append(query)
+                return mock_result
+            
+            mock_session.execute = AsyncMock(side_effect=mock_execute)
+            yield mock_session
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.get(
+                "/notes?q=  Hello ",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            
+            assert response.status_code == 200
+            assert len(executed_queries) == 1
+            compiled = executed_queries[0].compile()
+            assert "notes.search_text LIKE" in str(compiled)
+            assert "hello" in compiled.params.values()
+        finally:
+            app.dependency_overrides.clear()
+    
+    def test_list_notes_paginated(
+        self,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试游标分页：多取一条判断是否有下一页并返回 next_cursor"""
+        created_at = datetime(2024, 1, 1, 12, 0, 0)
+        notes = [
+            models.Note(
+                id=i,
+                user_id=1,
+                body_md=f"笔记 {i}",
+                is_pinned=False,
+                created_at=created_at,
+                updated_at=created_at
+            )
+            for i in (3, 2, 1)
+        ]
+        executed_queries = []
+        
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            mock_session = AsyncMock()
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = notes
+            
+            async def mock_execute(query):
+                executed_queries.append(query)
+                return mock_result
+            
+            mock_session.execute = AsyncMock(side_effect=mock_execute)
+            yield mock_session
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.get(
+                "/notes?limit=2",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert [item["id"] for item in data["items"]] == [3, 2]
+            assert data["next_cursor"]
+            assert executed_queries[0]._limit_clause.value == 3
+            
+            # 使用返回的游标请求下一页
+            response = client.get(
+                f"/notes?limit=2&cursor={data['next_cursor']}",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            assert response.status_code == 200
+            assert "(notes.created_at, notes.id) <" in str(executed_queries[1])
+        finally:
+            app.dependency_overrides.clear()
+    
+    def test_list_notes_invalid_cursor(
+        self,
+        client,
+        mock_user,
+        mock_token
+    ):
+        """测试无效游标返回 400"""
+        async def override_get_current_user():
+            return mock_user
+        
+        async def override_get_session():
+            yield AsyncMock()
+        
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        app.dependency_overrides[get_session] = override_get_session
+        
+        try:
+            response = client.get(
+                "/notes?limit=2&cursor=not-a-cursor",
+                headers={"Authorization": f"Bearer {mock_token}"}
+            )
+            assert response.status_code == 400
+        finally:
+            app.dependency_overrides.clear()
+    
     def test_list_notes_without_auth(self, client):
         """测试未认证获取笔记列表"""
         response = client.get("/notes")
@@ -268,25 +395,25 @@ class TestListNotes:
 class TestUploadImage:
     """测试上传图片端点"""
     
-    @patch('app.routers.notes.save_uploaded_img')
+    @patch('app.routers.notes.store_upload')
     def test_upload_image_success(
         self,
-        mock_save_img,
+        mock_store_upload,
         client,
         mock_user,
         mock_token,
         sample_image_bytes
     ):
         """测试成功上传图片"""
-        mock_save_img.return_value = "uploads/images/test.jpg"
+        mock_store_upload.return_value = ("uploads/blobs/ab/abc123", "abc123", 1024)
+        mock_session = AsyncMock()
+        mock_session.add = MagicMock()
+        mock_session.commit = AsyncMock()
         
         async def override_get_current_user():
             return mock_user
             
         async def override_get_session():
-            mock_session = AsyncMock()
-            mock_session.add = MagicMock()
-            mock_session.commit = AsyncMock()
             yield mock_session
         
         app.dependency_overrides[get_current_user] = override_get_current_user
@@ -301,8 +428,13 @@ class TestUploadImage:
             
             assert response.status_code == 200
             data = response.json()
-            assert "url" in data
-            assert "test.jpg" in data["url"]
+            assert data["url"].startswith("/notes/files/images/")
+            assert data["url"].endswith(".png")
+            # 每次上传有独立的访问路径，物理文件指向按内容存储的 blob
+            db_file = mock_session.add.call_args.args[0]
+            assert db_file.url_path == data["url"]
+            assert db_file.file_path == "uploads/blobs/ab/abc123"
+            assert db_file.content_hash == "abc123"
         finally:
             app.dependency_overrides.clear()
     
@@ -320,17 +452,17 @@ class TestUploadImage:
 class TestUploadFile:
     """测试上传文件端点"""
     
-    @patch('app.routers.notes.save_uploaded_file')
+    @patch('app.routers.notes.store_upload')
     def test_upload_file_success(
         self,
-        mock_save_file,
+        mock_store_upload,
         client,
         mock_user,
         mock_token,
         sample_file_bytes
     ):
         """测试成功上传文件"""
-        mock_save_file.return_value = ("uploads/files/test.txt", b"test content")
+        mock_store_upload.return_value = ("uploads/blobs/ab/abc123", "abc123", 12)
         
         async def override_get_current_user():
             return mock_user
@@ -354,8 +486,9 @@ class TestUploadFile:
             assert response.status_code == 200
             data = response.json()
             assert "url" in data
-            assert "name" in data
-            assert "size" in data
+            assert data["name"] == "test.txt"
+            assert data["size"] == 12
+            assert data["url"].endswith(".txt")
         finally:
             app.dependency_overrides.clear()
     
@@ -414,6 +547,7 @@ class TestUpdateNote:
             assert response.status_code == 200
             data = response.json()
             assert data["id"] == 1
+            assert mock_note.search_text == "更新后的内容"
         finally:
             app.dependency_overrides.clear()
     
@@ -651,3 +785,95 @@ class TestPinNote:
         response = client.patch("/notes/1/pin")
         assert response.status_code == 401
 
+
+
+# ========== 测试导出笔记 ==========
+
+class TestExportNotes:
+    """测试笔记 zip 导出"""
+
+    @staticmethod
+    def _session_factory(partitions):
+        """模拟服务端游标：stream_scalars 返回按块产出笔记的结果"""
+        async def iterate():
+            for partition in partitions:
+                yield partition
+
+        result = MagicMock()
+        result.partitions = MagicMock(side_effect=lambda *args: iterate())
+        session = AsyncMock()
+        session.stream_scalars = AsyncMock(return_value=result)
+        factory = MagicMock()
+        factory.return_value.__aenter__ = AsyncMock(return_value=session)
+        factory.return_value.__aexit__ = AsyncMock(return_value=False)
+        return factory
+
+    def test_export_streams_notes_and_attachments(self, client, mock_user, mock_token, tmp_path):
+        import zipfile
+
+        image = tmp_path / "a.png"
+        image.write_bytes(b"\x89PNG" + b"0" * 1000)
+        attachment = tmp_path / "report.pdf"
+        attachment.write_bytes(b"%PDF" * 100000)
+        created = datetime(2024, 1, 2, 12, 0)
+
+        def make_file(path, url_path, file_type):
+            return models.File(user_id=1, file_path=str(path), url_path=url_path, file_type=file_type)
+
+        first = models.Note(
+            id=1, user_id=1, is_pinned=True, created_at=created, updated_at=created,
+            body_md="截图 ![](/notes/files/images/a.png) 附件 [报告](/notes/files/files/report.pdf)",
+        )
+        first.managed_files = [
+            make_file(image, "/notes/files/images/a.png", "image"),
+            make_file(attachment, "/notes/files/files/report.pdf", "file"),
+        ]
+        second = models.Note(
+            id=2, user_id=1, is_pinned=False, created_at=created, updated_at=created,
+            body_md="同一张图 ![](/notes/files/images/a.png)",
+        )
+        second.managed_files = [
+            make_file(image, "/notes/files/images/a.png", "image"),
+            make_file(tmp_path / "missing.png", "/notes/files/images/missing.png", "image"),
+        ]
+
+        async def override_get_current_user():
+            return mock_user
+
+        app.dependency_overrides[get_current_user] = override_get_current_user
+        with patch("app.services.notes_export.AsyncSessionLocal", self._session_factory([[first], [second]])):
+            response = client.get("/notes/export", headers={"Authorization": f"Bearer {mock_token}"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zip"
+        archive = zipfile.ZipFile(io.BytesIO(response.content))
+        assert archive.testzip() is None
+        assert archive.namelist() == [
+            "notes/20240102-1.md",
+            "attachments/images/a.png",
+            "attachments/files/report.pdf",
+            "notes/20240102-2.md",
+        ]
+        markdown = archive.read("notes/20240102-1.md").decode("utf-8")
+        assert "pinned: true" in markdown
+        assert "![](../attachments/images/a.png)" in markdown
+        assert "[报告](../attachments/files/report.pdf)" in markdown
+        assert archive.read("attachments/files/report.pdf") == attachment.read_bytes()
+
+    def test_archive_is_emitted_in_chunks(self, tmp_path):
+        """大附件按块写出，不会整体缓存在内存中"""
+        import asyncio
+        from app.services import notes_export
+
+        attachment = tmp_path / "big.bin"
+        attachment.write_bytes(b"x" * (notes_export.ATTACHMENT_CHUNK_SIZE * 4))
+        note = models.Note(id=1, user_id=1, body_md="", created_at=datetime(2024, 1, 2))
+        note.managed_files = [models.File(user_id=1, file_path=str(attachment), url_path="/notes/files/files/big.bin", file_type="file")]
+
+        async def collect():
+            return [chunk async for chunk in notes_export.notes_archive_stream(1, self._session_factory([[note]]))]
+
+        chunks = asyncio.run(collect())
+
+        assert len(chunks) >= 4
+        assert max(len(chunk) for chunk in chunks) <= notes_export.ATTACHMENT_CHUNK_SIZE + 1024
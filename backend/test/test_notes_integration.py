@@ -295,17 +295,17 @@ class TestNotesIntegration:
         finally:
             app.dependency_overrides.clear()
     
-    @patch('app.routers.notes.save_uploaded_img')
+    @patch('app.routers.notes.store_upload')
     def test_full_flow_with_upload(
         self,
-        mock_save_img,
+        mock_store_upload,
         client,
         mock_user,
         mock_token,
         sample_image_bytes
     ):
         """测试包含文件上传的完整流程"""
-        mock_save_img.return_value = "uploads/images/test.jpg"
+        mock_store_upload.return_value = ("uploads/blobs/ab/abc123", "abc123", 1024)
         
         # 1. 上传图片
         async def override_get_current_user():